@@ -13,10 +13,17 @@ CREATE TABLE Availabilities (
 
 CREATE TABLE Vaccines (
     Name varchar(255),
-    Doses int,
     PRIMARY KEY (Name)
 );
 
+-- the doses of a vaccine are split over counter rows, so concurrent reservations update different rows
+CREATE TABLE VaccineDoses (
+    Name varchar(255) REFERENCES Vaccines,
+    Shard int,
+    Doses int,
+    PRIMARY KEY (Name, Shard)
+);
+
 CREATE TABLE Patients (
     Username varchar(255),
     Salt BINARY(16),
@@ -31,4 +38,57 @@ CREATE TABLE Reservations (
     VaccineName varchar(255) REFERENCES Vaccines (Name),
     Time date,
     PRIMARY KEY (ID)
-);
\ No newline at end of file
+);
+
+-- bookings per caregiver, kept by reserve and cancel for the assignment strategies;
+-- LastBooked is the time of the last booking in microseconds since 1970 (UTC)
+CREATE TABLE CaregiverBookings (
+    Username varchar(255) REFERENCES Caregivers,
+    Booked int,
+    LastBooked bigint,
+    PRIMARY KEY (Username)
+);
+
+CREATE TABLE Sessions (
+    Token varchar(64),
+    Username varchar(255),
+    Role varchar(16),
+    Expires bigint,
+    PRIMARY KEY (Token)
+);
+
+-- next free ID per table, handed out in blocks by IdAllocator
+CREATE TABLE IdBlocks (
+    Name varchar(255),
+    NextValue int,
+    PRIMARY KEY (Name)
+);
+
+-- patients waiting for a dose on any date from StartDate to EndDate, served in ID order
+CREATE TABLE Waitlist (
+    ID int,
+    PatientName varchar(255) REFERENCES Patients (Username),
+    VaccineName varchar(255),
+    StartDate date,
+    EndDate date,
+    PRIMARY KEY (ID)
+);
+
+-- one entry per patient and vaccine
+CREATE UNIQUE INDEX UX_Waitlist_PatientVaccine ON Waitlist (PatientName, VaccineName);
+
+-- per-day counts of open caregiver slots and bookings, kept in the transactions that change
+-- Availabilities and Reservations
+CREATE TABLE DailyUtilization (
+    Time date,
+    OpenSlots int,
+    Booked int,
+    PRIMARY KEY (Time)
+);
+
+CREATE TABLE DailyVaccineUtilization (
+    Time date,
+    VaccineName varchar(255),
+    Booked int,
+    PRIMARY KEY (Time, VaccineName)
+);
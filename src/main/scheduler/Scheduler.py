@@ -1,20 +1,45 @@
 from model.Vaccine import Vaccine
+from model.VaccineCache import VaccineCache
+from model.AvailabilityIndex import AvailabilityIndex
+from model.Reservation import Reservation
 from model.Caregiver import Caregiver
 from model.Patient import Patient
+from model.Session import Session
+from model.Waitlist import Waitlist
+from model.Utilization import Utilization
 from util.Util import Util
+from util.HashService import HashService
+from util.Metrics import CommandMetrics
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DBError
+from db.Tracing import Tracer
+import argparse
+import contextvars
+import csv
 import datetime
+import gzip
+import json
+import os
+import sys
+import time
 
 
-'''
-objects to keep track of the currently logged-in user
-Note: it is always true that at most one of currentCaregiver and currentPatient is not null
-        since only one user can be logged-in at a time
-'''
-current_patient = None
+class ClientSession:
+    '''
+    objects to keep track of the user logged in on one client: the prompt, a batch run or one server connection
+    Note: it is always true that at most one of caregiver and patient is not None
+            since only one user can be logged-in at a time per client
+    '''
+
+    def __init__(self):
+        self.patient = None
+        self.caregiver = None
+        # session token of the current login, if one was issued or resumed
+        self.session = None
 
-current_caregiver = None
+
+# the client the running command acts for; the prompt and batch runs use one ClientSession for the process
+current_client = contextvars.ContextVar("current_client", default=ClientSession())
 
 
 def create_patient(tokens):
@@ -26,21 +51,17 @@ def create_patient(tokens):
 
     username = tokens[1]
     password = tokens[2]
-    # check 2: check if the username has been taken already
-    if username_exists_patient(username):
-        print("Username taken, try again")
-        return
-    
+
     salt = Util.generate_salt()
-    hash = Util.generate_hash(password, salt)
+    hash = HashService.get().hash(password, salt)
 
     # create the patient
     patient = Patient(username, salt=salt, hash=hash)
 
-    # save to patient information to our database
+    # save to patient information to our database; the insert itself checks if the username has been taken already
     try:
-        patient.save_to_db()
-    except pymssql.Error as e:
+        created = patient.save_to_db()
+    except DBError as e:
         print("Create patient failed")
         print("Db-Error:", e)
         quit()
@@ -48,20 +69,22 @@ def create_patient(tokens):
         print("Create patient failed")
         print(e)
         return
+    if not created:
+        print("Username taken, try again")
+        return
     print("Created user ", username)
+    return True
 
 def username_exists_patient(username):
     cm = ConnectionManager()
     conn = cm.create_connection()
 
-    select_username = "SELECT * FROM Patients WHERE Username = %s"
+    select_username = "SELECT 1 FROM Patients WHERE Username = %s"
     try:
-        cursor = conn.cursor(as_dict=True)
+        cursor = conn.cursor()
         cursor.execute(select_username, username)
-        #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
-        for row in cursor:
-            return row['Username'] is not None
-    except pymssql.Error as e:
+        return cursor.fetchone() is not None
+    except DBError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
         quit()
@@ -81,21 +104,17 @@ def create_caregiver(tokens):
 
     username = tokens[1]
     password = tokens[2]
-    # check 2: check if the username has been taken already
-    if username_exists_caregiver(username):
-        print("Username taken, try again!")
-        return
 
     salt = Util.generate_salt()
-    hash = Util.generate_hash(password, salt)
+    hash = HashService.get().hash(password, salt)
 
     # create the caregiver
     caregiver = Caregiver(username, salt=salt, hash=hash)
 
-    # save to caregiver information to our database
+    # save to caregiver information to our database; the insert itself checks if the username has been taken already
     try:
-        caregiver.save_to_db()
-    except pymssql.Error as e:
+        created = caregiver.save_to_db()
+    except DBError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
         quit()
@@ -103,21 +122,23 @@ def create_caregiver(tokens):
         print("Failed to create user.")
         print(e)
         return
+    if not created:
+        print("Username taken, try again!")
+        return
     print("Created user ", username)
+    return True
 
 
 def username_exists_caregiver(username):
     cm = ConnectionManager()
     conn = cm.create_connection()
 
-    select_username = "SELECT * FROM Caregivers WHERE Username = %s"
+    select_username = "SELECT 1 FROM Caregivers WHERE Username = %s"
     try:
-        cursor = conn.cursor(as_dict=True)
+        cursor = conn.cursor()
         cursor.execute(select_username, username)
-        #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
-        for row in cursor:
-            return row['Username'] is not None
-    except pymssql.Error as e:
+        return cursor.fetchone() is not None
+    except DBError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
         quit()
@@ -129,16 +150,69 @@ def username_exists_caregiver(username):
     return False
 
 
+def read_accounts(path):
+    # one "username,password" row per line with an optional header; lowercased like interactive input
+    pairs = []
+    with open(path, newline="") as f:
+        for line_no, row in enumerate(csv.reader(f), 1):
+            if not row or not "".join(row).strip():
+                continue
+            if len(row) != 2:
+                raise ValueError(f"line {line_no}: expected username,password")
+            username, password = row[0].strip().lower(), row[1].strip().lower()
+            if line_no == 1 and (username, password) == ("username", "password"):
+                continue
+            if not username or not password:
+                raise ValueError(f"line {line_no}: username and password cannot be empty")
+            pairs.append((username, password))
+    return pairs
+
+
+def import_accounts(tokens, model):
+    # the passwords are hashed on all cores and the accounts inserted in one transaction
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    try:
+        pairs = read_accounts(tokens[1])
+        credentials = HashService.get().create_credentials(pairs)
+        created = model.save_many([model(username, salt=salt, hash=hash) for username, salt, hash in credentials])
+    except DBError as e:
+        print("Import failed")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Import failed")
+        print("Error:", e)
+        return
+    taken = len(set(username for username, _ in pairs)) - len(created)
+    print(f"Created {len(created)} user(s)")
+    if taken > 0:
+        print(f"Skipped {taken} username(s) that were already taken")
+    return True
+
+
+def import_patients(tokens):
+    # import_patients <csv file>
+    return import_accounts(tokens, Patient)
+
+
+def import_caregivers(tokens):
+    # import_caregivers <csv file>
+    return import_accounts(tokens, Caregiver)
+
+
 def login_patient(tokens):
-    # login_patient <username> <password>
+    # login_patient <username> <password> [--session]
     # check 1: if someone's already logged-in, they need to log out first
-    global current_patient
-    if current_caregiver is not None or current_patient is not None:
+    client = current_client.get()
+    if client.caregiver is not None or client.patient is not None:
         print("User already logged in, try again")
         return
 
-    # check 2: the length for tokens need to be exactly 3 to include all information (with the operation name)
-    if len(tokens) != 3:
+    # check 2: the length for tokens need to be 3, or 4 with --session, to include all information (with the operation name)
+    if len(tokens) != 3 and tokens[3:] != ["--session"]:
         print("Login patient failed")
         return
 
@@ -148,7 +222,7 @@ def login_patient(tokens):
     patient = None
     try:
         patient = Patient(username, password=password).get()
-    except pymssql.Error as e:
+    except DBError as e:
         print("Login patient failed")
         print("Db-Error:", e)
         quit()
@@ -162,19 +236,22 @@ def login_patient(tokens):
         print("Login patient failed")
     else:
         print("Logged in as " + username)
-        current_patient = patient
+        client.patient = patient
+        if len(tokens) == 4:
+            issue_session(username, "patient")
+        return True
 
 
 def login_caregiver(tokens):
-    # login_caregiver <username> <password>
+    # login_caregiver <username> <password> [--session]
     # check 1: if someone's already logged-in, they need to log out first
-    global current_caregiver
-    if current_caregiver is not None or current_patient is not None:
+    client = current_client.get()
+    if client.caregiver is not None or client.patient is not None:
         print("User already logged in.")
         return
 
-    # check 2: the length for tokens need to be exactly 3 to include all information (with the operation name)
-    if len(tokens) != 3:
+    # check 2: the length for tokens need to be 3, or 4 with --session, to include all information (with the operation name)
+    if len(tokens) != 3 and tokens[3:] != ["--session"]:
         print("Login failed.")
         return
 
@@ -184,7 +261,7 @@ def login_caregiver(tokens):
     caregiver = None
     try:
         caregiver = Caregiver(username, password=password).get()
-    except pymssql.Error as e:
+    except DBError as e:
         print("Login failed.")
         print("Db-Error:", e)
         quit()
@@ -198,48 +275,100 @@ def login_caregiver(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_caregiver = caregiver
+        client.caregiver = caregiver
+        if len(tokens) == 4:
+            issue_session(username, "caregiver")
+        return True
+
+
+def issue_session(username, role):
+    # the token lets the user log in again with resume, without the password
+    client = current_client.get()
+    try:
+        client.session = Session.create(username, role)
+    except DBError as e:
+        print("Could not create a session")
+        print("Db-Error:", e)
+        return
+    print("Session token: " + client.session.token)
+
+
+def resume(tokens):
+    # resume <session token>
+    client = current_client.get()
+    if client.caregiver is not None or client.patient is not None:
+        print("User already logged in.")
+        return
+
+    if len(tokens) != 2:
+        print("Please try again")
+        return
+
+    try:
+        session = Session(tokens[1]).get()
+    except DBError as e:
+        print("Resume failed")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Resume failed")
+        print("Error:", e)
+        return
+
+    if session is None:
+        print("Session expired or invalid, please login again")
+        return
+    if session.role == "patient":
+        client.patient = Patient(session.username)
+    else:
+        client.caregiver = Caregiver(session.username)
+    client.session = session
+    print("Logged in as " + session.username)
+    return True
 
 
 def search_caregiver_schedule(tokens):
-    global current_caregiver
-    global current_patient
+    # search_caregiver_schedule <date>
+    # search_caregiver_schedule <from> <to>
+    client = current_client.get()
 
     # check if a user has already logged in
-    if current_caregiver is None and current_patient is None:
+    if client.caregiver is None and client.patient is None:
         print("Please login first")
         return
     
-    # check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+    # check 2: the length for tokens need to be 2 or 3 to include all information (with the operation name)
+    if len(tokens) != 2 and len(tokens) != 3:
         print("Please try again")
         return
     
-    date = tokens[1]
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-
-    select_date = "SELECT Username FROM Availabilities WHERE Time = %s ORDER BY Username"
-    select_vaccines = "SELECT Name, Doses FROM Vaccines"
     try:
-        cursor = conn.cursor(as_dict=True)
-        # query caregivers
-        cursor.execute(select_date, date)
-        caregivers = [row['Username'] for row in cursor]
-
-        # query vaccines
-        cursor.execute(select_vaccines)
-        vaccines = [(row['Name'], row['Doses']) for row in cursor]
-
-        # print caregivers
-        for caregiver in caregivers:
-            print(caregiver)
+        # caregivers come from the availability index and vaccines from the inventory cache
+        if len(tokens) == 2:
+            caregivers = AvailabilityIndex.get(Util.parse_date(tokens[1]))
+            schedule = None
+        else:
+            start = Util.parse_date(tokens[1])
+            end = Util.parse_date(tokens[2])
+            if end < start:
+                raise ValueError("End date is before start date")
+            schedule = AvailabilityIndex.between(start, end)
+        vaccines = VaccineCache.all()
+
+        # print caregivers, one line per date for a range
+        if schedule is None:
+            for caregiver in caregivers:
+                print(caregiver)
+        else:
+            for date, caregivers in schedule:
+                print(f"{date.strftime('%m-%d-%Y')} " + " ".join(caregivers))
         
         # print vaccines
         for name, doses in vaccines:
             print(f"{name} {doses}")
-        
-    except pymssql.Error as e:
+        return True
+
+    except DBError as e:
         print("Please try again")
         print("Db-Error:", e)
         quit()
@@ -250,18 +379,16 @@ def search_caregiver_schedule(tokens):
         print("Please try again")
         print("Error:", e)
         return
-    finally:
-        cm.close_connection()
 
 def reserve(tokens):
-    global current_patient
+    client = current_client.get()
     # check 1: check if a user's already logged in
-    if current_patient is None and current_caregiver is None:
+    if client.patient is None and client.caregiver is None:
         print("Please login first")
         return
     
     #  check 2: check if the current logged-in user is a patient
-    if current_patient is None:
+    if client.patient is None:
         print("Please login as a patient")
         return
 
@@ -277,47 +404,32 @@ def reserve(tokens):
     conn = cm.create_connection()
 
     try:
+        date = Util.parse_date(date)
         cursor = conn.cursor(as_dict=True)
 
-        select_caregiver = "SELECT TOP 1 Username FROM Availabilities WHERE Time = %s ORDER BY Username"
-        cursor.execute(select_caregiver, date)
-        caregiver = cursor.fetchone()
+        # pick the caregiver, take the dose and book the appointment in one atomic operation
+        status, appointment_id, caregiver_name = cm.get_backend().reserve(cursor, client.patient.username, date, vaccine_name)
 
         # Check caregiver availability
-        if not caregiver:
+        if status == "no_caregiver":
+            conn.rollback()
             print("No caregiver is available")
             return
-        
-        caregiver_name = caregiver['Username']
 
-        select_vaccine = "SELECT Doses FROM Vaccines WHERE Name = %s"
-        cursor.execute(select_vaccine, vaccine_name)
-        vaccine = cursor.fetchone()
         # Check vaccine availability
-        if not vaccine or vaccine['Doses'] < 1:
+        if status == "no_doses":
+            conn.rollback()
             print("Not enough available doses")
-            return 
-        
-        # Create appointment
-        create_appointment_id = "SELECT NEXT VALUE FOR AppointmentSeq AS AppointmentID"
-        cursor.execute(create_appointment_id)
-        appointment_id = cursor.fetchone()['AppointmentID']
-
-        insert_appointment = "INSERT INTO Reservations (ID, PatientName, CaregiverName, VaccineName, Time) VALUES (%s, %s, %s, %s, %s)"
-        cursor.execute(insert_appointment, (appointment_id, current_patient.username, caregiver_name, vaccine_name, date))
-
-        # Update caregiver availability and vaccine doses
-        delete_availability = "DELETE FROM Availabilities WHERE Username = %s AND Time = %s"
-        cursor.execute(delete_availability, (caregiver_name, date))
-
-        update_vaccines = "UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = %s"
-        cursor.execute(update_vaccines, vaccine_name)
+            return
 
         conn.commit()
+        VaccineCache.invalidate(vaccine_name)
+        AvailabilityIndex.remove(date, caregiver_name)
 
         print(f"Appointment ID {appointment_id}, Caregiver username {caregiver_name}")
+        return True
 
-    except pymssql.Error as e:
+    except DBError as e:
         print("Please try again")
         print("Db-Error:", e)
         conn.rollback()
@@ -331,29 +443,148 @@ def reserve(tokens):
     finally:
         cm.close_connection()
 
+def reserve_earliest(tokens):
+    # reserve_earliest <vaccine> [<from date> [<to date>]]
+    # books the earliest date with a free caregiver from the from date (default today) onward, in one statement batch
+    client = current_client.get()
+    # check 1: check if a user's already logged in
+    if client.patient is None and client.caregiver is None:
+        print("Please login first")
+        return
+
+    #  check 2: check if the current logged-in user is a patient
+    if client.patient is None:
+        print("Please login as a patient")
+        return
+
+    # check 3: the length for tokens need to be 2 to 4 to include all information (with the operation name)
+    if len(tokens) < 2 or len(tokens) > 4:
+        print("Please try again")
+        return
+
+    vaccine_name = tokens[1]
+    try:
+        start = Util.parse_date(tokens[2]) if len(tokens) > 2 else datetime.date.today()
+        end = Util.parse_date(tokens[3]) if len(tokens) > 3 else None
+        if end is not None and end < start:
+            raise ValueError("End date is before start date")
+    except ValueError:
+        print("Please try again")
+        return
+
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+
+    try:
+        cursor = conn.cursor(as_dict=True)
+
+        status, appointment_id, caregiver_name, date = cm.get_backend().reserve_earliest(
+            cursor, client.patient.username, vaccine_name, start, end)
+
+        if status == "no_caregiver":
+            conn.rollback()
+            print("No caregiver is available")
+            return
+
+        if status == "no_doses":
+            conn.rollback()
+            print("Not enough available doses")
+            return
+
+        conn.commit()
+        VaccineCache.invalidate(vaccine_name)
+        AvailabilityIndex.remove(date, caregiver_name)
+
+        print(f"Appointment ID {appointment_id}, Caregiver username {caregiver_name}, Date {date.strftime('%m-%d-%Y')}")
+        return True
+
+    except DBError as e:
+        print("Please try again")
+        print("Db-Error:", e)
+        conn.rollback()
+    except Exception as e:
+        print("Please try again")
+        print("Error:", e)
+        conn.rollback()
+    finally:
+        cm.close_connection()
+
+def waitlist(tokens):
+    # waitlist <date> [<to date>] <vaccine>
+    # queues the patient for a dose on any date in the range; they are booked as soon as there is capacity
+    client = current_client.get()
+    if client.patient is None:
+        print("Please login as a patient")
+        return
+
+    if len(tokens) < 3 or len(tokens) > 4:
+        print("Please try again")
+        return
+
+    vaccine_name = tokens[-1]
+    try:
+        start = Util.parse_date(tokens[1])
+        end = Util.parse_date(tokens[2]) if len(tokens) == 4 else start
+        if end < start:
+            raise ValueError("End date is before start date")
+    except ValueError:
+        print("Please try again")
+        return
+
+    entry = Waitlist(client.patient.username, vaccine_name, start, end)
+    try:
+        if not entry.save():
+            print(f"You are already on the waitlist for {vaccine_name}")
+            return
+    except DBError as e:
+        print("Please try again")
+        print("Db-Error:", e)
+        return
+    print(f"Added to the waitlist for {vaccine_name} from {start.strftime('%m-%d-%Y')} to {end.strftime('%m-%d-%Y')}")
+    # there may be capacity already
+    match_waitlist([vaccine_name])
+    return True
+
+
+def match_waitlist(vaccine_names=None):
+    # books waitlisted patients after a command added capacity; the command itself has succeeded either way
+    try:
+        matches = Waitlist.match(vaccine_names)
+    except DBError as e:
+        print("Waitlist matching failed")
+        print("Db-Error:", e)
+        return
+    if matches:
+        print(f"Booked {len(matches)} waitlisted appointment(s)")
+
+
 def upload_availability(tokens):
     #  upload_availability <date>
+    #  upload_availability <date>,<date>,...
+    #  upload_availability <from> <to> [weekdays, e.g. mon,wed,fri]
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    client = current_client.get()
+    if client.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
-    # check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+    # check 2: the length for tokens need to be 2 to 4 to include all information (with the operation name)
+    if len(tokens) < 2 or len(tokens) > 4:
         print("Please try again!")
         return
 
-    date = tokens[1]
-    # assume input is hyphenated in the format mm-dd-yyyy
-    date_tokens = date.split("-")
-    month = int(date_tokens[0])
-    day = int(date_tokens[1])
-    year = int(date_tokens[2])
-    try:
-        d = datetime.datetime(year, month, day)
-        current_caregiver.upload_availability(d)
-    except pymssql.Error as e:
+    try:
+        # assume input is hyphenated in the format mm-dd-yyyy
+        if len(tokens) == 2:
+            dates = Util.parse_dates(tokens[1])
+        else:
+            weekdays = Util.parse_weekdays(tokens[3]) if len(tokens) == 4 else None
+            dates = Util.date_range(Util.parse_date(tokens[1]), Util.parse_date(tokens[2]), weekdays)
+        if not dates:
+            print("Please enter a valid date!")
+            return
+        inserted = client.caregiver.upload_availability(dates)
+    except DBError as e:
         print("Upload Availability Failed")
         print("Db-Error:", e)
         quit()
@@ -365,59 +596,110 @@ def upload_availability(tokens):
         print("Error:", e)
         return
     print("Availability uploaded!")
+    if inserted < len(dates):
+        print(f"Skipped {len(dates) - inserted} date(s) that were already uploaded or booked")
+    if inserted:
+        match_waitlist()
+    return True
 
 
 def cancel(tokens):
-    global current_caregiver, current_patient
+    # cancel <appointment_id> [<appointment_id> ...]
+    # cancels all the given appointments or none of them, in one set-based statement batch
+    client = current_client.get()
     # check 1: check if a user's already logged in
-    if current_patient is None and current_caregiver is None:
+    if client.patient is None and client.caregiver is None:
         print("Please login first")
         return
-    
-    # check 3: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+
+    # check 3: the length for tokens need to be at least 2 to include all information (with the operation name)
+    if len(tokens) < 2 or len(tokens) > 1 + max_cancel_ids:
         print("Please try again!")
         return
 
     try:
-        appointment_id = int(tokens[1])
+        appointment_ids = list(dict.fromkeys(int(token) for token in tokens[1:]))
     except ValueError:
         print("Invalid appointment ID format!")
         return
-    
+
     cm = ConnectionManager()
     conn = cm.create_connection()
     cursor = conn.cursor(as_dict=True)
 
     try:
-        select_appointment = "SELECT ID, Time, CaregiverName, PatientName FROM Reservations WHERE ID = %s"
-        cursor.execute(select_appointment, appointment_id)
-        appointment = cursor.fetchone()
-
-        if appointment is None:
-            print("Appointment not found!")
-            return
-        
-        # Check if the current user is authorized to cancel this appointment
-        if current_caregiver is not None and appointment["CaregiverName"] != current_caregiver.username:
-            print("You are not authorized to cancel this appointment.")
+        # only the appointments of the logged-in user match, so others' count as not found
+        canceled = cm.get_backend().cancel(
+            cursor, ids=appointment_ids,
+            patient=client.patient.username if client.patient is not None else None,
+            caregiver=client.caregiver.username if client.caregiver is not None else None,
+            shards=Vaccine.shards)
+        missing = set(appointment_ids) - {appointment_id for appointment_id, _, _, _ in canceled}
+        if missing:
+            conn.rollback()
+            print("Appointment not found: " + ", ".join(str(appointment_id) for appointment_id in sorted(missing)))
+            if len(appointment_ids) > 1:
+                print("No appointment was canceled.")
             return
-        if current_patient is not None and appointment["PatientName"] != current_patient.username:
-            print("You are not authorized to cancel this appointment.")
-            return
-        
-         # Delete the appointment from the Reservations table
-        delete_appointment = "DELETE FROM Reservations WHERE ID = %s"
-        cursor.execute(delete_appointment, appointment_id)
-
-        # Update the caregiver's availability
-        update_availability = "INSERT INTO Availabilities (Username, Time) VALUES (%s, %s)"
-        cursor.execute(update_availability, (appointment["CaregiverName"], appointment["Time"]))
 
         conn.commit()
-        print(f"Appointment {appointment_id} has been canceled successfully.")
+        VaccineCache.invalidate(*{vaccine_name for _, _, vaccine_name, _ in canceled})
+        for _, caregiver_name, _, date in canceled:
+            AvailabilityIndex.add([date], caregiver_name)
+        for appointment_id, _, _, _ in canceled:
+            print(f"Appointment {appointment_id} has been canceled successfully.")
+        # the caregivers and doses given back may serve the waitlist
+        match_waitlist()
+        return True
+
+    except DBError as e:
+        print("An error occurred while processing the cancellation.")
+        print("Db-Error:", e)
+        conn.rollback()
+    except Exception as e:
+        print("An unexpected error occurred.")
+        print("Error:", e)
+        conn.rollback()
+    finally:
+        cm.close_connection()
+
+
+def cancel_day(tokens):
+    # cancel_day <date>
+    # a caregiver who can't work on date cancels all their appointments and withdraws their availability for it
+    client = current_client.get()
+    if client.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    try:
+        date = Util.parse_date(tokens[1])
+    except ValueError:
+        print("Please try again!")
+        return
+
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor(as_dict=True)
 
-    except pymssql.Error as e:
+    try:
+        canceled = cm.get_backend().cancel(cursor, caregiver=client.caregiver.username, date=date,
+                                           shards=Vaccine.shards, restore_availability=False)
+        cm.get_backend().remove_availability(cursor, client.caregiver.username, date)
+        conn.commit()
+        VaccineCache.invalidate(*{vaccine_name for _, _, vaccine_name, _ in canceled})
+        AvailabilityIndex.remove(date, client.caregiver.username)
+        for appointment_id, _, _, _ in canceled:
+            print(f"Appointment {appointment_id} has been canceled successfully.")
+        print(f"Canceled {len(canceled)} appointment(s) on {date.strftime('%m-%d-%Y')}")
+        match_waitlist({vaccine_name for _, _, vaccine_name, _ in canceled})
+        return True
+
+    except DBError as e:
         print("An error occurred while processing the cancellation.")
         print("Db-Error:", e)
         conn.rollback()
@@ -431,8 +713,8 @@ def cancel(tokens):
 def add_doses(tokens):
     #  add_doses <vaccine> <number>
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    client = current_client.get()
+    if client.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
@@ -442,11 +724,11 @@ def add_doses(tokens):
         return
 
     vaccine_name = tokens[1]
-    doses = int(tokens[2])
-    vaccine = None
+    # adds the doses to an existing entry, or creates a new (vaccine, doses) entry, in one statement
     try:
-        vaccine = Vaccine(vaccine_name, doses).get()
-    except pymssql.Error as e:
+        doses = int(tokens[2])
+        Vaccine.add_doses([(vaccine_name, doses)])
+    except DBError as e:
         print("Error occurred when adding doses")
         print("Db-Error:", e)
         quit()
@@ -454,69 +736,115 @@ def add_doses(tokens):
         print("Error occurred when adding doses")
         print("Error:", e)
         return
+    print("Doses updated!")
+    match_waitlist([vaccine_name])
+    return True
 
-    # if the vaccine is not found in the database, add a new (vaccine, doses) entry.
-    # else, update the existing entry by adding the new doses
-    if vaccine is None:
-        vaccine = Vaccine(vaccine_name, doses)
-        try:
-            vaccine.save_to_db()
-        except pymssql.Error as e:
-            print("Error occurred when adding doses")
-            print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Error occurred when adding doses")
-            print("Error:", e)
-            return
-    else:
-        # if the vaccine is not null, meaning that the vaccine already exists in our table
-        try:
-            vaccine.increase_available_doses(doses)
-        except pymssql.Error as e:
-            print("Error occurred when adding doses")
-            print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Error occurred when adding doses")
-            print("Error:", e)
+
+def import_doses(tokens):
+    #  import_doses <csv file>, one "vaccine,doses" row per line with an optional "vaccine,doses" header
+    #  check 1: check if the current logged-in user is a caregiver
+    client = current_client.get()
+    if client.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    #  check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    shipment = []
+    try:
+        with open(tokens[1], newline="") as f:
+            for line_no, row in enumerate(csv.reader(f), 1):
+                if not row or not "".join(row).strip():
+                    continue
+                if len(row) != 2:
+                    raise ValueError(f"line {line_no}: expected vaccine,doses")
+                vaccine_name, doses = row[0].strip().lower(), row[1].strip()
+                if line_no == 1 and (vaccine_name, doses.lower()) == ("vaccine", "doses"):
+                    # header; any other first row is data and checked like the rest
+                    continue
+                try:
+                    doses = int(doses)
+                except ValueError:
+                    raise ValueError(f"line {line_no}: invalid number of doses {doses}")
+                if doses <= 0:
+                    raise ValueError(f"line {line_no}: number of doses must be positive")
+                shipment.append((vaccine_name, doses))
+        if not shipment:
+            print("No doses to import")
             return
-    print("Doses updated!")
+        results = Vaccine.add_doses(shipment)
+    except DBError as e:
+        print("Error occurred when importing doses")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when importing doses")
+        print("Error:", e)
+        return
+    for vaccine_name, added, doses, created in sorted(results):
+        print(f"{vaccine_name} +{added} -> {doses}" + (" (new)" if created else ""))
+    print(f"Doses imported for {len(results)} vaccine(s)!")
+    match_waitlist([vaccine_name for vaccine_name, _, _, _ in results])
+    return True
 
 
 def show_appointments(tokens):
-    global current_caregiver, current_patient
+    # show_appointments [--from-date <date>] [--limit <n>] [--after <appointment_id>]
+    client = current_client.get()
     # check 1: check if a user's already logged in
-    if current_patient is None and current_caregiver is None:
+    if client.patient is None and client.caregiver is None:
         print("Please login first")
         return
     
-    # check 1: the length for tokens need to be exactly 1 to include all information (with the operation name)
-    if len(tokens) != 1:
+    # check 2: the options come in pairs after the operation name
+    if len(tokens) % 2 != 1:
         print("Please try again")
         return
-    
-    cm = ConnectionManager()
-    conn = cm.create_connection()
 
     try:
-        cursor = conn.cursor(as_dict=True)
-
-        if current_caregiver:
-            select_appointments = "SELECT ID, VaccineName, Time, PatientName FROM Reservations WHERE CaregiverName = %s ORDER BY ID"
-            cursor.execute(select_appointments, current_caregiver.username)
-            appointments = cursor.fetchall()
-            for appt in appointments:
-                print(f"{appt['ID']} {appt['VaccineName']} {appt['Time']} {appt['PatientName']}")
+        options = dict(zip(tokens[1::2], tokens[2::2]))
+        if not set(options) <= {"--from-date", "--limit", "--after"}:
+            raise ValueError("Unknown option")
+        from_date = Util.parse_date(options["--from-date"]) if "--from-date" in options else None
+        limit = int(options["--limit"]) if "--limit" in options else None
+        after = int(options["--after"]) if "--after" in options else None
+        if limit is not None and limit <= 0:
+            raise ValueError("Limit must be positive")
+    except ValueError:
+        print("Please try again")
+        return
 
-        elif current_patient:
-            select_appointments = "SELECT ID, VaccineName, Time, CaregiverName FROM Reservations WHERE PatientName = %s ORDER BY ID"
-            cursor.execute(select_appointments, current_patient.username)
-            appointments = cursor.fetchall()
+    try:
+        username = client.caregiver.username if client.caregiver else client.patient.username
+        # one extra row tells whether there is another page
+        appointments = Reservation.stream(username, caregiver=client.caregiver is not None, from_date=from_date,
+                                          after=after, limit=limit + 1 if limit is not None else None)
+        shown = 0
+        last_id = None
+        try:
             for appt in appointments:
-                print(f"{appt['ID']} {appt['VaccineName']} {appt['Time']} {appt['CaregiverName']}")
-
-    except pymssql.Error as e:
+                if limit is not None and shown == limit:
+                    print(f"More appointments: show_appointments --limit {limit} --after {last_id}")
+                    break
+                if client.caregiver:
+                    print(f"{appt.appointment_id} {appt.vaccine_name} {appt.time} {appt.patient_name}")
+                else:
+                    print(f"{appt.appointment_id} {appt.vaccine_name} {appt.time} {appt.caregiver_name}")
+                shown += 1
+                last_id = appt.appointment_id
+        finally:
+            # gives the connection back even when we stop early
+            appointments.close()
+        if client.caregiver is None and after is None:
+            for entry in Waitlist.of_patient(username):
+                print(f"Waiting for {entry.vaccine_name} from {entry.start.strftime('%m-%d-%Y')} to {entry.end.strftime('%m-%d-%Y')}")
+        return True
+
+    except DBError as e:
         print("Please try again")
         print("Db-Error:", e)
         quit()
@@ -524,13 +852,148 @@ def show_appointments(tokens):
         print("Please try again")
         print("Error:", e)
         return
+
+
+def export_reservations(tokens):
+    # export_reservations <from> <to> <path> [--format csv|jsonl]
+    # writes every reservation in the date range to path as it streams from the database, gzipped if path ends in .gz
+    client = current_client.get()
+    if client.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) not in (4, 6):
+        print("Please try again!")
+        return
+
+    try:
+        start = Util.parse_date(tokens[1])
+        end = Util.parse_date(tokens[2])
+        if end < start:
+            raise ValueError("End date is before start date")
+        options = dict(zip(tokens[4::2], tokens[5::2]))
+        if not set(options) <= {"--format"}:
+            raise ValueError("Unknown option")
+        export_format = options.get("--format", "csv").lower()
+        if export_format not in ("csv", "jsonl"):
+            raise ValueError("Unknown format")
+    except ValueError:
+        print("Please try again!")
+        return
+
+    path = tokens[3]
+    # written under another name first, so a failed export never leaves a truncated file at path
+    partial = path + ".part"
+    fields = ["id", "vaccine", "date", "patient", "caregiver"]
+    rows = 0
+    started = time.perf_counter()
+    try:
+        if path.endswith(".gz"):
+            # level 6 like the gzip tool; 9 costs several times the CPU for a few percent
+            f = gzip.open(partial, "wt", compresslevel=6, newline="", encoding="utf-8")
+        else:
+            f = open(partial, "w", newline="", encoding="utf-8")
+        with f:
+            writer = csv.writer(f) if export_format == "csv" else None
+            if writer is not None:
+                writer.writerow(fields)
+            appointments = Reservation.between(start, end)
+            try:
+                for appt in appointments:
+                    values = [appt.appointment_id, appt.vaccine_name, appt.time.isoformat(), appt.patient_name, appt.caregiver_name]
+                    if writer is not None:
+                        writer.writerow(values)
+                    else:
+                        f.write(json.dumps(dict(zip(fields, values))) + "\n")
+                    rows += 1
+            finally:
+                # gives the connection back when writing fails
+                appointments.close()
+        os.replace(partial, path)
+    except DBError as e:
+        print("Error occurred when exporting reservations")
+        print("Db-Error:", e)
+        return
+    except OSError as e:
+        print("Error occurred when exporting reservations")
+        print("Error:", e)
+        return
     finally:
-        cm.close_connection()    
+        if os.path.exists(partial):
+            os.remove(partial)
+    elapsed = time.perf_counter() - started
+    print(f"Exported {rows} reservation(s) to {path} in {elapsed:.2f}s ({rows / elapsed if elapsed > 0 else 0:.0f} rows/s)")
+    return True
+
+
+def utilization(tokens):
+    # utilization <from> <to>
+    # open slots and bookings per day and vaccine, from the summary tables, then the doses left per vaccine
+    client = current_client.get()
+    if client.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) != 3:
+        print("Please try again!")
+        return
+
+    try:
+        start = Util.parse_date(tokens[1])
+        end = Util.parse_date(tokens[2])
+        if end < start:
+            raise ValueError("End date is before start date")
+    except ValueError:
+        print("Please try again!")
+        return
+
+    try:
+        days = Utilization.between(start, end)
+        vaccines = VaccineCache.all()
+    except DBError as e:
+        print("Please try again")
+        print("Db-Error:", e)
+        return
+    for day in days:
+        vaccine_bookings = ", ".join(f"{name} {booked}" for name, booked in day.vaccines.items())
+        print(f"{day.date.strftime('%m-%d-%Y')} open {day.open_slots} booked {day.booked}"
+              + (f" ({vaccine_bookings})" if vaccine_bookings else ""))
+    print("Doses left: " + (", ".join(f"{name} {doses}" for name, doses in sorted(vaccines)) or "none"))
+    return True
+
+
+def rebuild_utilization(tokens):
+    # rebuild_utilization [--verify]
+    # recomputes the utilization summaries from Availabilities and Reservations; --verify only reports differences
+    client = current_client.get()
+    if client.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) > 2 or (len(tokens) == 2 and tokens[1] != "--verify"):
+        print("Please try again!")
+        return
+
+    try:
+        if len(tokens) == 2:
+            differences = Utilization.verify()
+            for date, vaccine_name, counter, expected, stored in differences:
+                print(f"{date.strftime('%m-%d-%Y')} {vaccine_name or 'all'} {counter} {stored}, expected {expected}")
+            print(f"{len(differences)} difference(s) in the utilization summary")
+            return not differences
+        days = Utilization.rebuild()
+    except DBError as e:
+        print("Please try again")
+        print("Db-Error:", e)
+        return
+    print(f"Rebuilt the utilization summary for {days} day(s)")
+    return True
+
 
 def logout(tokens):
-    global current_patient, current_caregiver
+    client = current_client.get()
     
-    if current_caregiver is None and current_patient is None:
+    if client.caregiver is None and client.patient is None:
         print("Please login first")
         return
     
@@ -538,26 +1001,108 @@ def logout(tokens):
         print("Please try again")
         return
     
-    current_patient = None
-    current_caregiver = None
+    if client.session is not None:
+        try:
+            client.session.revoke()
+        except DBError as e:
+            print("Could not revoke the session")
+            print("Db-Error:", e)
+        client.session = None
+    client.patient = None
+    client.caregiver = None
     print('Successfully logged out')
+    return True
+
+
+# appointment IDs one cancel takes, well under the 2100 parameters of an Azure SQL batch
+max_cancel_ids = 1000
+
+# commands that take a file path keep the case of their arguments
+keep_case_commands = {"import_doses", "import_patients", "import_caregivers", "export_reservations"}
+
+
+def tokenize(response):
+    tokens = response.split(" ")
+    if tokens[0].lower() in keep_case_commands:
+        return [tokens[0].lower()] + tokens[1:]
+    return [token.lower() for token in tokens]
+
+
+def stats(tokens):
+    # stats: latency and outcome of every command run so far, plus connection pool and cache counters
+    if len(tokens) != 1:
+        print("Please try again")
+        return
+    for line in metrics.report():
+        print(line)
+    pool = ConnectionManager.pool_stats()
+    if pool:
+        print("pool " + " ".join(f"{name}={value:.3f}" if isinstance(value, float) else f"{name}={value}"
+                                 for name, value in pool.items()))
+    print("vaccine cache " + " ".join(f"{name}={value}" for name, value in VaccineCache.stats().items()))
+    return True
+
+
+# operation name -> (handler, min tokens, max tokens, usage), tokens counting the operation name
+commands = {
+    "create_patient": (create_patient, 3, 3, "create_patient <username> <password>"),
+    "create_caregiver": (create_caregiver, 3, 3, "create_caregiver <username> <password>"),
+    "import_patients": (import_patients, 2, 2, "import_patients <csv file>"),
+    "import_caregivers": (import_caregivers, 2, 2, "import_caregivers <csv file>"),
+    "login_patient": (login_patient, 3, 4, "login_patient <username> <password> [--session]"),
+    "login_caregiver": (login_caregiver, 3, 4, "login_caregiver <username> <password> [--session]"),
+    "resume": (resume, 2, 2, "resume <session token>"),
+    "search_caregiver_schedule": (search_caregiver_schedule, 2, 3, "search_caregiver_schedule <date> [<to date>]"),
+    "reserve": (reserve, 3, 3, "reserve <date> <vaccine>"),
+    "reserve_earliest": (reserve_earliest, 2, 4, "reserve_earliest <vaccine> [<from date> [<to date>]]"),
+    "waitlist": (waitlist, 3, 4, "waitlist <date> [<to date>] <vaccine>"),
+    "upload_availability": (upload_availability, 2, 4, "upload_availability <date> | <date>,<date>,... | <from> <to> [weekdays]"),
+    "cancel": (cancel, 2, 1 + max_cancel_ids, "cancel <appointment_id> [<appointment_id> ...]"),
+    "cancel_day": (cancel_day, 2, 2, "cancel_day <date>"),
+    "add_doses": (add_doses, 3, 3, "add_doses <vaccine> <number>"),
+    "import_doses": (import_doses, 2, 2, "import_doses <csv file>"),
+    "show_appointments": (show_appointments, 1, 7, "show_appointments [--from-date <date>] [--limit <n>] [--after <appointment_id>]"),
+    "export_reservations": (export_reservations, 4, 6, "export_reservations <from> <to> <path> [--format csv|jsonl]"),
+    "utilization": (utilization, 3, 3, "utilization <from> <to>"),
+    "rebuild_utilization": (rebuild_utilization, 1, 2, "rebuild_utilization [--verify]"),
+    "logout": (logout, 1, 1, "logout"),
+    "stats": (stats, 1, 1, "stats"),
+}
+
+metrics = CommandMetrics()
+
+
+def run_command(tokens, client=None):
+    # every command returns True when it succeeded; each run is timed and counted under its name
+    # client is the ClientSession to act for, by default the one of the prompt
+    command = commands.get(tokens[0])
+    if command is None:
+        print("Invalid operation name!")
+        return
+    handler, min_tokens, max_tokens, usage = command
+    reset = current_client.set(client) if client is not None else None
+    Tracer.begin_command(tokens[0])
+    started = time.perf_counter()
+    ok = False
+    try:
+        if len(tokens) < min_tokens or len(tokens) > max_tokens:
+            print("Please try again! Usage: " + usage)
+            return
+        ok = handler(tokens) is True
+        return ok
+    finally:
+        metrics.record(tokens[0], time.perf_counter() - started, ok)
+        Tracer.end_command()
+        if reset is not None:
+            current_client.reset(reset)
 
 
 def start():
     stop = False
     print()
     print(" *** Please enter one of the following commands *** ")
-    print("> create_patient <username> <password>")  # //TODO: implement create_patient (Part 1)
-    print("> create_caregiver <username> <password>")
-    print("> login_patient <username> <password>")  # // TODO: implement login_patient (Part 1)
-    print("> login_caregiver <username> <password>")
-    print("> search_caregiver_schedule <date>")  # // TODO: implement search_caregiver_schedule (Part 2)
-    print("> reserve <date> <vaccine>")  # // TODO: implement reserve (Part 2)
-    print("> upload_availability <date>")
-    print("> cancel <appointment_id>")  # // TODO: implement cancel (extra credit)
-    print("> add_doses <vaccine> <number>")
-    print("> show_appointments")  # // TODO: implement show_appointments (Part 2)
-    print("> logout")  # // TODO: implement logout (Part 2)
+    for _, _, _, usage in commands.values():
+        print("> " + usage)
     print("> Quit")
     print()
     while not stop:
@@ -570,39 +1115,64 @@ def start():
             print("Please try again!")
             break
 
-        response = response.lower()
-        tokens = response.split(" ")
+        tokens = tokenize(response)
         if len(tokens) == 0:
             ValueError("Please try again!")
             continue
-        operation = tokens[0]
-        if operation == "create_patient":
-            create_patient(tokens)
-        elif operation == "create_caregiver":
-            create_caregiver(tokens)
-        elif operation == "login_patient":
-            login_patient(tokens)
-        elif operation == "login_caregiver":
-            login_caregiver(tokens)
-        elif operation == "search_caregiver_schedule":
-            search_caregiver_schedule(tokens)
-        elif operation == "reserve":
-            reserve(tokens)
-        elif operation == "upload_availability":
-            upload_availability(tokens)
-        elif operation == cancel:
-            cancel(tokens)
-        elif operation == "add_doses":
-            add_doses(tokens)
-        elif operation == "show_appointments":
-            show_appointments(tokens)
-        elif operation == "logout":
-            logout(tokens)
-        elif operation == "quit":
+        if tokens[0] == "quit":
             print("Bye!")
             stop = True
         else:
-            print("Invalid operation name!")
+            run_command(tokens)
+
+
+def run_batch(lines, commit_every=0):
+    # runs commands without prompts over one shared connection,
+    # committing every commit_every commands (0 commits once at the end)
+    succeeded = 0
+    failed = []
+    commits = 0
+    pending = 0
+    started = time.perf_counter()
+    with ConnectionManager.share() as shared:
+        for line_no, line in enumerate(lines, 1):
+            response = line.strip()
+            if not response or response.startswith("#"):
+                continue
+            tokens = tokenize(response)
+            if tokens[0] == "quit":
+                break
+            shared.begin_command()
+            try:
+                ok = run_command(tokens) is True
+                error = "command failed"
+            except SystemExit:
+                ok = False
+                error = "database error"
+            except Exception as e:
+                ok = False
+                error = str(e)
+            if ok:
+                shared.end_command()
+                succeeded += 1
+                pending += 1
+            else:
+                shared.rollback()
+                failed.append((line_no, response, error))
+                print(f"line {line_no}: {error}: {response}", file=sys.stderr)
+            if commit_every > 0 and pending >= commit_every:
+                shared.flush()
+                commits += 1
+                pending = 0
+        if pending > 0:
+            shared.flush()
+            commits += 1
+    elapsed = time.perf_counter() - started
+    total = succeeded + len(failed)
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"{total} commands, {succeeded} succeeded, {len(failed)} failed, {commits} commits "
+          f"in {elapsed:.2f}s ({rate:.1f} commands/s)", file=sys.stderr)
+    return failed
 
 
 if __name__ == "__main__":
@@ -613,8 +1183,34 @@ if __name__ == "__main__":
     // and then construct a map of vaccineName -> vaccineObject
     '''
 
-    # start command line
-    print()
-    print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", nargs="?", const="-", metavar="FILE",
+                        help="run the commands in FILE (or stdin) without prompts")
+    parser.add_argument("--commit-every", type=int, default=0, metavar="N",
+                        help="commit every N commands in batch mode, default once per file")
+    parser.add_argument("--stats", action="store_true",
+                        help="print per-command latency statistics on exit")
+    args = parser.parse_args()
+    Tracer.configure_from_env()
 
-    start()
+    try:
+        if args.batch is not None:
+            # the commands call quit() on database errors, which closes sys.stdin, so read through our own handle
+            if args.batch == "-":
+                source = open(sys.stdin.fileno(), closefd=False)
+            else:
+                source = open(args.batch)
+            with source as f:
+                failed = run_batch(f, args.commit_every)
+            sys.exit(1 if failed else 0)
+
+        # start command line
+        print()
+        print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
+        start()
+    finally:
+        if args.stats:
+            for line in metrics.report():
+                print(line, file=sys.stderr)
+        ConnectionManager.close_pool()
+        HashService.get().shutdown()
@@ -0,0 +1,175 @@
+from Scheduler import ClientSession, commands, keep_case_commands, run_command, tokenize
+from db.ConnectionManager import ConnectionManager
+from db.Tracing import Tracer
+from util.HashService import HashService
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import contextvars
+import io
+import os
+import signal
+import sys
+
+
+'''
+line-protocol server for the scheduler commands: python Server.py --port 8765
+
+a client sends one command per line, as typed at the prompt, and gets back what the command printed
+followed by a line ".ok" or ".failed"; output lines that start with "." get one more "." in front.
+"quit" closes the connection. every connection has its own ClientSession, so its login is its own
+'''
+
+# commands grouped by what they wait on; each group runs at most its limit of commands at once
+command_classes = {
+    # PBKDF2 on the HashService processes
+    "auth": {"create_patient", "create_caregiver", "login_patient", "login_caregiver"},
+    "read": {"search_caregiver_schedule", "show_appointments", "utilization", "stats"},
+    "write": {"reserve", "reserve_earliest", "waitlist", "cancel", "cancel_day", "upload_availability", "rebuild_utilization", "add_doses", "resume", "logout"},
+}
+
+# buffer collecting the output of the command running in this context, see ClientOutput
+command_output = contextvars.ContextVar("command_output", default=None)
+
+
+class ClientOutput:
+    '''
+    stands in for sys.stdout so the print() calls of a command go to the client that ran it
+
+    writes made outside a command go to the real stream
+    '''
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        output = command_output.get()
+        return (output if output is not None else self.stream).write(text)
+
+    def flush(self):
+        if command_output.get() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class SchedulerServer:
+    '''
+    runs every command on a thread of executor, so the event loop only reads and writes lines;
+    commands of one connection run one after the other, commands of different connections
+    at the same time up to the limit of their class
+    '''
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.executor = ThreadPoolExecutor(max_workers=sum(limits.values()), thread_name_prefix="scheduler")
+        self.semaphores = None
+        self.clients = 0
+
+    def command_class(name):
+        for command_class, names in command_classes.items():
+            if name in names:
+                return command_class
+        # unknown commands only print an error
+        return "read"
+
+    def execute(self, tokens, client):
+        # runs on an executor thread; returns whether the command succeeded and what it printed
+        output = io.StringIO()
+        reset = command_output.set(output)
+        try:
+            ok = run_command(tokens, client) is True
+        except SystemExit:
+            # the commands quit() on database errors; here that fails only this command
+            ok = False
+        except Exception as e:
+            print("Error:", e)
+            ok = False
+        finally:
+            command_output.reset(reset)
+        return ok, output.getvalue()
+
+    def frame(text, ok):
+        lines = ["." + line if line.startswith(".") else line for line in text.splitlines()]
+        lines.append(".ok" if ok else ".failed")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    async def run(self, tokens, client):
+        if tokens[0] in keep_case_commands:
+            # these read or write files on the server
+            return False, "Not available over the network\n"
+        async with self.semaphores[SchedulerServer.command_class(tokens[0])]:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.execute, tokens, client)
+
+    async def handle(self, reader, writer):
+        client = ClientSession()
+        self.clients += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = line.decode("utf-8", errors="replace").strip()
+                if not response:
+                    continue
+                tokens = tokenize(response)
+                if tokens[0] == "quit":
+                    break
+                ok, text = await self.run(tokens, client)
+                writer.write(SchedulerServer.frame(text, ok))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # the client went away, or sent a line longer than the stream limit
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    async def serve(self, host, port):
+        self.semaphores = {name: asyncio.Semaphore(limit) for name, limit in self.limits.items()}
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+        print(f"Serving {len(commands)} commands on {addresses}", file=sys.stderr)
+        # serve until SIGINT or SIGTERM, then let the running commands finish
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop.set)
+            except NotImplementedError:
+                # Windows: Ctrl+C still raises KeyboardInterrupt
+                pass
+        async with server:
+            await stop.wait()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    Tracer.configure_from_env()
+
+    # every password hash goes to the worker processes, so the executor threads only wait on it
+    hash_service = HashService(inline_below=1)
+    HashService.default = hash_service
+    pool_size = int(os.getenv("PoolMaxSize", "10"))
+    server = SchedulerServer({
+        "auth": int(os.getenv("ServerAuthConcurrency", str(hash_service.workers * 2))),
+        "read": int(os.getenv("ServerReadConcurrency", str(pool_size))),
+        "write": int(os.getenv("ServerWriteConcurrency", str(pool_size))),
+    })
+    sys.stdout = ClientOutput(sys.stdout)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        ConnectionManager.close_pool()
+        hash_service.shutdown()
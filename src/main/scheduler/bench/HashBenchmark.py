@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util.Util import Util
+from util.HashService import HashService
+
+
+# compares hashing N passwords on the calling thread against HashService with 1..cores workers
+# run from src/main/scheduler: python -m bench.HashBenchmark --passwords 2000
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--passwords", type=int, default=1000)
+    parser.add_argument("--workers", type=int, nargs="*", default=None,
+                        help="worker counts to try, default 1, 2, 4, ... up to the number of cores")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    worker_counts = args.workers
+    if not worker_counts:
+        worker_counts = []
+        n = 1
+        while n < cores:
+            worker_counts.append(n)
+            n *= 2
+        worker_counts.append(cores)
+
+    pairs = [(f"user{i}", f"password{i}") for i in range(args.passwords)]
+
+    started = time.perf_counter()
+    for _, password in pairs:
+        Util.generate_hash(password, Util.generate_salt())
+    baseline = time.perf_counter() - started
+    print(f"cores {cores}, passwords {args.passwords}")
+    print(f"inline      {baseline:8.2f}s {args.passwords / baseline:10.1f} hashes/s")
+
+    for workers in worker_counts:
+        service = HashService(workers=workers)
+        # start the worker processes before timing
+        service.generate_hashes([("warmup", Util.generate_salt())] * workers * 2)
+        started = time.perf_counter()
+        service.create_credentials(pairs)
+        elapsed = time.perf_counter() - started
+        service.shutdown()
+        print(f"workers {workers:3d} {elapsed:8.2f}s {args.passwords / elapsed:10.1f} hashes/s  speedup {baseline / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
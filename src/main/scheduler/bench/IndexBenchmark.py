@@ -0,0 +1,190 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from db import Migrations
+from db.Backend import SQLiteBackend
+from util.Metrics import LatencyHistogram
+
+
+# times the queries behind show_appointments, cancel and search_caregiver_schedule on a local SQLite
+# database with many reservations, before and after the reservation_indexes migration
+# run from src/main/scheduler: python -m bench.IndexBenchmark --reservations 1000000
+
+# the migration measured here; the database is seeded at the version before it
+MIGRATION = "reservation_indexes"
+# name -> (query, parameter kind); the reservation queries are those of Reservation.stream and cancel
+QUERIES = {
+    "patient_appointments": ("SELECT ID, VaccineName, Time, PatientName, CaregiverName FROM Reservations "
+                             "WHERE PatientName = %s ORDER BY ID", "patient"),
+    "caregiver_appointments": ("SELECT ID, VaccineName, Time, PatientName, CaregiverName FROM Reservations "
+                               "WHERE CaregiverName = %s ORDER BY ID", "caregiver"),
+    "appointment_by_id": ("SELECT ID, Time, CaregiverName, PatientName FROM Reservations WHERE ID = %s", "id"),
+    "availability_by_date": ("SELECT Username FROM Availabilities WHERE Time = %s ORDER BY Username", "date"),
+}
+
+
+def seed(backend, args):
+    start_date = datetime.date(2026, 1, 1)
+    conn = backend.connect()
+    try:
+        db = conn.conn
+        db.executemany("INSERT INTO Patients (Username) VALUES (?)", ((f"p{i}",) for i in range(args.patients)))
+        db.executemany("INSERT INTO Caregivers (Username) VALUES (?)", ((f"c{i}",) for i in range(args.caregivers)))
+        db.executemany("INSERT INTO Vaccines (Name) VALUES (?)", ((f"v{i}",) for i in range(args.vaccines)))
+        rng = random.Random(args.seed)
+        # one row per caregiver and day, minus the booked ones, like a schedule that is partly taken
+        db.executemany("INSERT INTO Availabilities (Time, Username) VALUES (?, ?)",
+                       ((start_date + datetime.timedelta(days=day), f"c{i}")
+                        for day in range(args.days) for i in range(args.caregivers) if rng.random() < 0.5))
+
+        def reservations():
+            for appointment_id in range(1, args.reservations + 1):
+                yield (appointment_id, f"p{rng.randrange(args.patients)}", f"c{rng.randrange(args.caregivers)}",
+                       f"v{rng.randrange(args.vaccines)}", start_date + datetime.timedelta(days=rng.randrange(args.days)))
+        db.executemany("INSERT INTO Reservations (ID, PatientName, CaregiverName, VaccineName, Time) VALUES (?, ?, ?, ?, ?)",
+                       reservations())
+        db.commit()
+        db.execute("ANALYZE")
+    finally:
+        conn.close()
+    return start_date
+
+
+def plan(cursor, query, param):
+    cursor.execute("EXPLAIN QUERY PLAN " + query, param)
+    return "; ".join(row[3] for row in cursor.fetchall())
+
+
+def measure(backend, args, start_date):
+    # the same parameters for every phase, so both read the same rows
+    rng = random.Random(args.seed + 1)
+    params = {
+        "patient": lambda: f"p{rng.randrange(args.patients)}",
+        "caregiver": lambda: f"c{rng.randrange(args.caregivers)}",
+        "id": lambda: rng.randrange(1, args.reservations + 1),
+        "date": lambda: start_date + datetime.timedelta(days=rng.randrange(args.days)),
+    }
+    results = {}
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        for name, (query, kind) in QUERIES.items():
+            latency = LatencyHistogram()
+            rows = 0
+            for i in range(args.queries):
+                param = params[kind]()
+                started = time.perf_counter()
+                cursor.execute(query, param)
+                rows += len(cursor.fetchall())
+                latency.record(time.perf_counter() - started)
+            results[name] = {
+                "count": latency.count,
+                "rows": rows / latency.count,
+                "mean": latency.mean(),
+                "p50": latency.percentile(50),
+                "p99": latency.percentile(99),
+                "max": latency.max,
+                "plan": plan(cursor, query, param),
+            }
+    finally:
+        conn.close()
+    return results
+
+
+def report(phase, results):
+    print(f"{phase}")
+    print(f"{'query':24s} {'rows':>7s} {'p50 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}  plan")
+    for name, result in results.items():
+        print(f"{name:24s} {result['rows']:7.1f} {result['p50'] * 1000:9.3f} {result['p99'] * 1000:9.3f} "
+              f"{result['max'] * 1000:9.3f}  {result['plan']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reservations", type=int, default=1000000)
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--caregivers", type=int, default=1000)
+    parser.add_argument("--vaccines", type=int, default=3)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--queries", type=int, default=200, help="runs of each query per phase")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", default=None, help="SQLite file to create, default a temporary one")
+    parser.add_argument("--output", default=None,
+                        help="results file, default bench/results/indexes-<timestamp>.json")
+    args = parser.parse_args()
+
+    temp_dir = None
+    if args.db is None:
+        temp_dir = tempfile.mkdtemp(prefix="scheduler-bench-")
+        args.db = os.path.join(temp_dir, "scheduler.db")
+    elif os.path.exists(args.db):
+        parser.error(f"{args.db} already exists, the benchmark seeds a new database")
+
+    version = next(number for number, name, _ in Migrations.migrations if name == MIGRATION)
+    try:
+        backend = SQLiteBackend(args.db, apply_schema=False)
+        backend.apply_schema()
+        Migrations.migrate(backend, target=version - 1)
+        started = time.perf_counter()
+        start_date = seed(backend, args)
+        seed_time = time.perf_counter() - started
+        print(f"seeded {args.reservations} reservations of {args.patients} patients and {args.caregivers} caregivers "
+              f"in {seed_time:.2f}s")
+
+        before = measure(backend, args, start_date)
+        report(f"before {MIGRATION}", before)
+        started = time.perf_counter()
+        Migrations.migrate(backend, target=version)
+        migration_time = time.perf_counter() - started
+        print(f"{MIGRATION} applied in {migration_time:.2f}s")
+        after = measure(backend, args, start_date)
+        report(f"after {MIGRATION}", after)
+        print(f"{'query':24s} {'p50 speedup':>12s} {'p99 speedup':>12s}")
+        for name in QUERIES:
+            print(f"{name:24s} {before[name]['p50'] / after[name]['p50']:11.1f}x "
+                  f"{before[name]['p99'] / after[name]['p99']:11.1f}x")
+
+        config = {name: value for name, value in vars(args).items() if name != "output"}
+        if temp_dir is not None:
+            config["db"] = None
+        result = {
+            "benchmark": "indexes",
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "environment": {
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "platform": platform.platform(),
+                "cores": os.cpu_count(),
+            },
+            "config": config,
+            "migration": MIGRATION,
+            "seed_seconds": seed_time,
+            "migration_seconds": migration_time,
+            "before": before,
+            "after": after,
+        }
+        output = args.output
+        if output is None:
+            results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+            os.makedirs(results_dir, exist_ok=True)
+            output = os.path.join(results_dir, f"indexes-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"results written to {output}")
+        backend.close()
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from db.Assignment import AssignmentStrategy
+from db.Backend import SQLiteBackend, UTILIZATION_DAYS
+from db.ConnectionManager import ConnectionManager
+from model.Caregiver import Caregiver
+from model.Patient import Patient
+from model.Vaccine import Vaccine
+from util.Metrics import LatencyHistogram
+from util.Util import Util
+
+
+# seeds a local SQLite database and replays a mix of scheduler commands from K worker processes
+# run from src/main/scheduler: python -m bench.WorkloadBenchmark --workers 8 --duration 30
+#
+# every worker is its own process, with its own connection pool and caches,
+# like K scheduler processes sharing one database
+
+PASSWORD = "benchpass"
+DEFAULT_MIX = "search=40,reserve=25,cancel=10,show=15,login_patient=8,login_caregiver=2"
+# mix name -> scheduler command
+COMMANDS = {
+    "search": "search_caregiver_schedule",
+    "reserve": "reserve",
+    "reserve_earliest": "reserve_earliest",
+    "cancel": "cancel",
+    "show": "show_appointments",
+    "login_patient": "login_patient",
+    "login_caregiver": "login_caregiver",
+}
+# output of a command that was turned down because other workers took the capacity first
+CONFLICT_MESSAGES = ("No caregiver is available", "Not enough available doses", "Appointment not found")
+# database errors caused by concurrent writers
+CONFLICT_ERRORS = re.compile(r"locked|busy|deadlock", re.IGNORECASE)
+APPOINTMENT = re.compile(r"Appointment ID (\d+)")
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in COMMANDS:
+            raise argparse.ArgumentTypeError(f"unknown command {name}, expected one of {', '.join(COMMANDS)}")
+        weights[name] = float(weight)
+    if sum(weights.values()) <= 0:
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return weights
+
+
+def format_date(d):
+    return d.strftime("%m-%d-%Y")
+
+
+def seed(args):
+    # every account shares one salt and hash, so seeding skips the PBKDF2 cost; logins still pay it
+    salt = Util.generate_salt()
+    hash = Util.generate_hash(PASSWORD, salt)
+    started = time.perf_counter()
+    Patient.save_many([Patient(f"patient{i}", salt=salt, hash=hash) for i in range(args.patients)])
+    caregivers = [Caregiver(f"caregiver{i}", salt=salt, hash=hash) for i in range(args.caregivers)]
+    Caregiver.save_many(caregivers)
+    days = Util.date_range(args.start_date, args.start_date + datetime.timedelta(days=args.days - 1))
+    for caregiver in caregivers:
+        caregiver.upload_availability(days)
+    Vaccine.add_doses([(f"vaccine{v}", args.doses) for v in range(args.vaccines)])
+    return time.perf_counter() - started
+
+
+def check_invariants(path, args):
+    # things a correct run never produces, counted straight from the database
+    conn = sqlite3.connect(path)
+    try:
+        double_booked = conn.execute("SELECT COUNT(*) FROM (SELECT Time, CaregiverName FROM Reservations "
+                                     "GROUP BY Time, CaregiverName HAVING COUNT(*) > 1)").fetchone()[0]
+        booked_and_available = conn.execute("SELECT COUNT(*) FROM Reservations r JOIN Availabilities a "
+                                            "ON a.Time = r.Time AND a.Username = r.CaregiverName").fetchone()[0]
+        negative_doses = conn.execute("SELECT COUNT(*) FROM VaccineDoses WHERE Doses < 0").fetchone()[0]
+        reservations = conn.execute("SELECT COUNT(*) FROM Reservations").fetchone()[0]
+        # every seeded dose and caregiver day is either still free or in a reservation; cancel gives both back
+        lost_doses = conn.execute("SELECT COUNT(*) FROM Vaccines v WHERE ? <> "
+                                  "(SELECT COALESCE(SUM(Doses), 0) FROM VaccineDoses d WHERE d.Name = v.Name) + "
+                                  "(SELECT COUNT(*) FROM Reservations r WHERE r.VaccineName = v.Name)", (args.doses,)).fetchone()[0]
+        lost_slots = args.caregivers * args.days - reservations - conn.execute("SELECT COUNT(*) FROM Availabilities").fetchone()[0]
+        # days whose DailyUtilization row disagrees with the base tables
+        utilization_off = conn.execute(f"SELECT COUNT(*) FROM ({UTILIZATION_DAYS}) e LEFT JOIN DailyUtilization d ON d.Time = e.Time "
+                                       "WHERE d.Time IS NULL OR d.OpenSlots <> e.OpenSlots OR d.Booked <> e.Booked").fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        "reservations": reservations,
+        "double_booked": double_booked,
+        "booked_and_available": booked_and_available,
+        "negative_doses": negative_doses,
+        "lost_doses": lost_doses,
+        "lost_slots": lost_slots,
+        "utilization_off": utilization_off,
+    }
+
+
+def booking_spread(path, caregivers):
+    # how evenly reserve spread the appointments over the caregivers
+    conn = sqlite3.connect(path)
+    try:
+        counts = [row[0] for row in conn.execute("SELECT COUNT(*) FROM Reservations GROUP BY CaregiverName")]
+    finally:
+        conn.close()
+    counts += [0] * (caregivers - len(counts))
+    mean = sum(counts) / len(counts) if counts else 0.0
+    return {
+        "min": min(counts, default=0),
+        "max": max(counts, default=0),
+        "mean": mean,
+        "stddev": (sum((count - mean) ** 2 for count in counts) / len(counts)) ** 0.5 if counts else 0.0,
+    }
+
+
+class Worker:
+    '''
+    one simulated client: logs in as one of its patients and runs commands drawn from the mix until the deadline
+
+    commands that need a patient are preceded by a login_patient when the worker is logged in as a caregiver,
+    and cancel falls back to reserve while the current patient has nothing booked
+    '''
+
+    def __init__(self, args, index):
+        import Scheduler
+        self.scheduler = Scheduler
+        self.args = args
+        self.rng = random.Random(args.seed * 1000 + index)
+        # patients and caregivers are split between workers so two workers never share a login
+        self.patients = [f"patient{i}" for i in range(index, args.patients, args.workers)] or ["patient0"]
+        self.caregivers = [f"caregiver{i}" for i in range(index, args.caregivers, args.workers)] or ["caregiver0"]
+        self.days = [args.start_date + datetime.timedelta(days=d) for d in range(args.days)]
+        self.names = list(args.mix)
+        self.weights = [args.mix[name] for name in self.names]
+        self.role = None
+        self.username = None
+        self.appointments = {}
+        self.results = {}
+        self.error_samples = []
+
+    def run_command(self, tokens):
+        # runs one command the way the prompt does, returning its outcome and what it printed
+        output = io.StringIO()
+        status = "ok"
+        started = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(output):
+                ok = self.scheduler.run_command(tokens) is True
+        except SystemExit:
+            # the commands quit() on some database errors
+            ok = False
+        except Exception as e:
+            ok = False
+            output.write(f"Error: {e}")
+        elapsed = time.perf_counter() - started
+        text = output.getvalue()
+        if not ok:
+            if any(message in text for message in CONFLICT_MESSAGES) or CONFLICT_ERRORS.search(text):
+                status = "conflict"
+            else:
+                status = "error"
+        return status, elapsed, text
+
+    def record(self, name, status, elapsed, text):
+        result = self.results.get(name)
+        if result is None:
+            result = self.results[name] = {"ok": 0, "conflict": 0, "error": 0, "latency": LatencyHistogram()}
+        result[status] += 1
+        result["latency"].record(elapsed)
+        if status == "error" and len(self.error_samples) < 5:
+            self.error_samples.append(f"{name}: {' '.join(text.split())[:200]}")
+
+    def login(self, role, timed=True):
+        if self.role is not None:
+            self.run_command(["logout"])
+        self.role = None
+        username = self.rng.choice(self.patients if role == "patient" else self.caregivers)
+        name = "login_" + role
+        status, elapsed, text = self.run_command([name, username, PASSWORD])
+        if timed:
+            self.record(name, status, elapsed, text)
+        if status == "ok":
+            self.role = role
+            self.username = username
+
+    def step(self):
+        name = self.rng.choices(self.names, self.weights)[0]
+        if name in ("login_patient", "login_caregiver"):
+            self.login(name[len("login_"):])
+            return
+        if name in ("reserve", "reserve_earliest", "cancel") and self.role != "patient":
+            self.login("patient")
+            return
+        if self.role is None:
+            self.login("patient")
+            return
+
+        booked = self.appointments.setdefault(self.username, [])
+        if name == "cancel" and not booked:
+            name = "reserve"
+        if name == "search":
+            start = self.rng.choice(self.days)
+            if self.rng.random() < 0.7:
+                tokens = ["search_caregiver_schedule", format_date(start)]
+            else:
+                tokens = ["search_caregiver_schedule", format_date(start), format_date(start + datetime.timedelta(days=6))]
+        elif name == "reserve":
+            tokens = ["reserve", format_date(self.rng.choice(self.days)), f"vaccine{self.rng.randrange(self.args.vaccines)}"]
+        elif name == "reserve_earliest":
+            tokens = ["reserve_earliest", f"vaccine{self.rng.randrange(self.args.vaccines)}", format_date(self.rng.choice(self.days))]
+        elif name == "cancel":
+            tokens = ["cancel", str(booked.pop(self.rng.randrange(len(booked))))]
+        else:
+            tokens = ["show_appointments"]
+
+        status, elapsed, text = self.run_command(tokens)
+        self.record(name, status, elapsed, text)
+        if name in ("reserve", "reserve_earliest") and status == "ok":
+            match = APPOINTMENT.search(text)
+            if match:
+                booked.append(int(match.group(1)))
+
+    def run(self, barrier):
+        self.login("patient", timed=False)
+        barrier.wait()
+        deadline = time.perf_counter() + self.args.duration
+        while time.perf_counter() < deadline:
+            self.step()
+
+
+def run_worker(args, index, barrier, results):
+    os.environ["PoolMinSize"] = "1"
+    ConnectionManager.configure(SQLiteBackend(args.db, apply_schema=False))
+    AssignmentStrategy.default = AssignmentStrategy.by_name(args.strategy)
+    Vaccine.shards = args.shards
+    worker = Worker(args, index)
+    try:
+        worker.run(barrier)
+    finally:
+        ConnectionManager.close_pool()
+    results.put((index, worker.results, worker.error_samples))
+
+
+def summarize(merged, elapsed):
+    commands = {}
+    total = {"count": 0, "ok": 0, "conflict": 0, "error": 0}
+    for name, result in sorted(merged.items()):
+        latency = result["latency"]
+        commands[name] = {
+            "count": latency.count,
+            "ok": result["ok"],
+            "conflicts": result["conflict"],
+            "errors": result["error"],
+            "throughput": latency.count / elapsed,
+            "conflict_rate": result["conflict"] / latency.count,
+            "error_rate": result["error"] / latency.count,
+            "mean_ms": latency.mean() * 1000,
+            "p50_ms": latency.percentile(50) * 1000,
+            "p90_ms": latency.percentile(90) * 1000,
+            "p99_ms": latency.percentile(99) * 1000,
+            "max_ms": latency.max * 1000,
+        }
+        total["count"] += latency.count
+        for status in ("ok", "conflict", "error"):
+            total[status] += result[status]
+    count = max(1, total["count"])
+    return commands, {
+        "count": total["count"],
+        "ok": total["ok"],
+        "conflicts": total["conflict"],
+        "errors": total["error"],
+        "throughput": total["count"] / elapsed,
+        "conflict_rate": total["conflict"] / count,
+        "error_rate": total["error"] / count,
+    }
+
+
+def report(commands, total):
+    print(f"{'command':<18}{'count':>8}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'conflict':>10}{'error':>8}")
+    for name, stats in commands.items():
+        print(f"{name:<18}{stats['count']:>8}{stats['throughput']:>10.1f}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+              f"{stats['max_ms']:>10.2f}{stats['conflict_rate']:>10.1%}{stats['error_rate']:>8.1%}")
+    print(f"{'total':<18}{total['count']:>8}{total['throughput']:>10.1f}{'':>30}"
+          f"{total['conflict_rate']:>10.1%}{total['error_rate']:>8.1%}")
+
+
+def compare(commands, total, baseline_path):
+    # relative change against an earlier results file, positive means more
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"compared with {baseline_path}")
+
+    def change(new, old):
+        return f"{(new - old) / old:+.1%}" if old else "n/a"
+
+    print(f"{'command':<18}{'ops/s':>10}{'p50':>10}{'p99':>10}")
+    for name, stats in commands.items():
+        old = baseline["commands"].get(name)
+        if old is None:
+            continue
+        print(f"{name:<18}{change(stats['throughput'], old['throughput']):>10}"
+              f"{change(stats['p50_ms'], old['p50_ms']):>10}{change(stats['p99_ms'], old['p99_ms']):>10}")
+    print(f"{'total':<18}{change(total['throughput'], baseline['total']['throughput']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--caregivers", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30, help="days of availability uploaded by every caregiver")
+    parser.add_argument("--vaccines", type=int, default=3)
+    parser.add_argument("--doses", type=int, default=100000, help="doses of every vaccine")
+    parser.add_argument("--shards", type=int, default=Vaccine.shards, help="VaccineDoses rows the doses of a vaccine are spread over")
+    parser.add_argument("--start-date", type=Util.parse_date, default=datetime.date(2030, 1, 1), metavar="MM-DD-YYYY")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of replay")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"relative weight of every command, default {DEFAULT_MIX}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--strategy", default=os.getenv("AssignmentStrategy", "least_booked"),
+                        help="caregiver assignment strategy of reserve: least_booked, round_robin, random or first")
+    parser.add_argument("--db", default=None, help="SQLite file to create and keep, default a temporary file")
+    parser.add_argument("--output", default=None,
+                        help="results file, default bench/results/workload-<timestamp>.json")
+    parser.add_argument("--compare", default=None, metavar="RESULTS", help="earlier results file to compare with")
+    args = parser.parse_args()
+    try:
+        AssignmentStrategy.by_name(args.strategy)
+    except ValueError as e:
+        parser.error(str(e))
+
+    Vaccine.shards = args.shards
+
+    temp_dir = None
+    if args.db is None:
+        temp_dir = tempfile.mkdtemp(prefix="scheduler-bench-")
+        args.db = os.path.join(temp_dir, "scheduler.db")
+    elif os.path.exists(args.db):
+        parser.error(f"{args.db} already exists, the benchmark seeds a new database")
+
+    try:
+        backend = SQLiteBackend(args.db)
+        ConnectionManager.configure(backend)
+        seed_time = seed(args)
+        ConnectionManager.close_pool()
+        backend.close()
+        print(f"seeded {args.patients} patients, {args.caregivers} caregivers, {args.days} days, "
+              f"{args.vaccines} vaccines in {seed_time:.2f}s")
+
+        # fresh interpreters, so no worker inherits the seeding connections
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(args.workers + 1)
+        results = context.Queue()
+        processes = [context.Process(target=run_worker, args=(args, index, barrier, results))
+                     for index in range(args.workers)]
+        for process in processes:
+            process.start()
+        barrier.wait()
+        started = time.perf_counter()
+        merged = {}
+        error_samples = []
+        for _ in processes:
+            _, worker_results, samples = results.get()
+            error_samples += samples
+            for name, result in worker_results.items():
+                into = merged.setdefault(name, {"ok": 0, "conflict": 0, "error": 0, "latency": LatencyHistogram()})
+                for status in ("ok", "conflict", "error"):
+                    into[status] += result[status]
+                into["latency"].merge(result["latency"])
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+
+        commands, total = summarize(merged, elapsed)
+        invariants = check_invariants(args.db, args)
+        spread = booking_spread(args.db, args.caregivers)
+        report(commands, total)
+        print("invariants " + " ".join(f"{name}={value}" for name, value in invariants.items()))
+        print(f"appointments per caregiver ({args.strategy}) " + " ".join(f"{name}={value:.1f}" for name, value in spread.items()))
+        for sample in error_samples:
+            print("error " + sample)
+        if args.compare:
+            compare(commands, total, args.compare)
+
+        config = {name: value for name, value in vars(args).items() if name not in ("output", "compare")}
+        config["start_date"] = format_date(args.start_date)
+        if temp_dir is not None:
+            config["db"] = None
+        result = {
+            "benchmark": "workload",
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "environment": {
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "platform": platform.platform(),
+                "cores": os.cpu_count(),
+            },
+            "config": config,
+            "seed_seconds": seed_time,
+            "elapsed_seconds": elapsed,
+            "total": total,
+            "commands": commands,
+            "invariants": invariants,
+            "booking_spread": spread,
+            "error_samples": error_samples,
+        }
+        output = args.output
+        if output is None:
+            results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+            os.makedirs(results_dir, exist_ok=True)
+            output = os.path.join(results_dir, f"workload-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"results written to {output}")
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
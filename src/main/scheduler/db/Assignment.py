@@ -0,0 +1,67 @@
+import os
+
+
+class AssignmentStrategy:
+    '''
+    decides which of the caregivers available on a date reserve books
+
+    a strategy is an ORDER BY over the candidates, a being their Availabilities row and b their
+    CaregiverBookings counters (NULL before their first booking); the backend ranks the candidates in
+    that order and books the first one it can lock, so concurrent reservers that skip locked rows
+    spread over the next candidates (see MSSQLBackend.reserve_claim_caregiver)
+    '''
+    name = None
+    # the process-wide strategy, see get()
+    default = None
+
+    def order_by(self, backend):
+        raise NotImplementedError
+
+    def get():
+        # AssignmentStrategy=least_booked (default), round_robin, random or first
+        if AssignmentStrategy.default is None:
+            AssignmentStrategy.default = AssignmentStrategy.by_name(os.getenv("AssignmentStrategy", "least_booked"))
+        return AssignmentStrategy.default
+
+    def by_name(name):
+        strategy = strategies.get(name.lower())
+        if strategy is None:
+            raise ValueError(f"Unknown assignment strategy {name}, expected one of {', '.join(strategies)}")
+        return strategy()
+
+
+class FirstAvailable(AssignmentStrategy):
+    # alphabetical, the original behavior; every reserver for a date wants the same row
+    name = "first"
+
+    def order_by(self, backend):
+        return "a.Username"
+
+
+class LeastBooked(AssignmentStrategy):
+    # fewest appointments so far, by the CaregiverBookings counter. a caregiver available on a date has
+    # no appointment on it (booking takes the availability row, and a booked date can't be uploaded
+    # again), so among the candidates of a date this is also the least booked for it
+    name = "least_booked"
+
+    def order_by(self, backend):
+        return "COALESCE(b.Booked, 0), a.Username"
+
+
+class RoundRobin(AssignmentStrategy):
+    # booked longest ago, by the time of their last booking (CaregiverBookings.LastBooked); appointment
+    # IDs aren't in booking order once every process takes them from its own IdBlocks block
+    name = "round_robin"
+
+    def order_by(self, backend):
+        return "COALESCE(b.LastBooked, 0), a.Username"
+
+
+class RandomAvailable(AssignmentStrategy):
+    name = "random"
+
+    def order_by(self, backend):
+        return backend.random_order
+
+
+strategies = {strategy.name: strategy for strategy in (LeastBooked, RoundRobin, RandomAvailable, FirstAvailable)}
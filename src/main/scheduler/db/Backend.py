@@ -0,0 +1,767 @@
+import datetime
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from db.Assignment import AssignmentStrategy
+from db.IdAllocator import IdAllocator
+from db.Migrations import migrate
+
+try:
+    import pymssql
+except ImportError:
+    # only needed for the Azure SQL backend
+    pymssql = None
+
+
+# catch this instead of a driver specific error so the commands work on every backend
+# IntegrityError is raised for key violations, e.g. a username that is already taken
+if pymssql is not None:
+    DBError = (pymssql.Error, sqlite3.Error)
+    IntegrityError = (pymssql.IntegrityError, sqlite3.IntegrityError)
+else:
+    DBError = (sqlite3.Error,)
+    IntegrityError = (sqlite3.IntegrityError,)
+
+def column(row, name, index=0):
+    # reads one value from a row fetched by either a tuple or an as_dict cursor
+    return row[name] if isinstance(row, dict) else row[index]
+
+
+# the DailyUtilization and DailyVaccineUtilization rows, counted from the base tables
+UTILIZATION_DAYS = "SELECT Time, SUM(OpenSlots) AS OpenSlots, SUM(Booked) AS Booked FROM (" \
+                   "SELECT Time, COUNT(*) AS OpenSlots, 0 AS Booked FROM Availabilities GROUP BY Time UNION ALL " \
+                   "SELECT Time, 0, COUNT(*) FROM Reservations GROUP BY Time) u GROUP BY Time"
+UTILIZATION_VACCINE_DAYS = "SELECT Time, VaccineName, COUNT(*) AS Booked FROM Reservations GROUP BY Time, VaccineName"
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources", "create.sql")
+
+
+class Backend:
+    name = None
+
+    def connect(self):
+        raise NotImplementedError
+
+    def ping(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+
+    def apply_schema(self, path=SCHEMA_PATH):
+        raise NotImplementedError
+
+    # catalog lookups for db.Migrations
+    def table_exists(self, cursor, table):
+        raise NotImplementedError
+
+    def column_exists(self, cursor, table, name):
+        raise NotImplementedError
+
+    def index_exists(self, cursor, table, index):
+        raise NotImplementedError
+
+    # an index on columns of table that also holds include, so queries reading only those columns skip the table;
+    # a unique one also rejects a second row with the same columns
+    def create_index(self, cursor, name, table, columns, include=(), unique=False):
+        raise NotImplementedError
+
+    # changes the declared type of a column whose values all fit the new type
+    def alter_column_type(self, cursor, table, name, type):
+        raise NotImplementedError
+
+    # reserves count IDs of table in IdBlocks and returns the first one; the row of table is created on
+    # first use, after the largest ID already in column. the caller commits
+    def allocate_ids(self, cursor, table, id_column, count):
+        cursor.execute("UPDATE IdBlocks SET NextValue = NextValue + %d WHERE Name = %s", (count, table))
+        if cursor.rowcount == 0:
+            cursor.execute(f"INSERT INTO IdBlocks (Name, NextValue) SELECT %s, COALESCE(MAX({id_column}), 0) + 1 + %d FROM {table}",
+                           (table, count))
+        cursor.execute("SELECT NextValue FROM IdBlocks WHERE Name = %s", table)
+        return column(cursor.fetchone(), "NextValue") - count
+
+    # a new ID for a row of table; by default taken in the caller's transaction
+    def next_id(self, cursor, table, id_column):
+        return self.allocate_ids(cursor, table, id_column, 1)
+
+    # adds to the DailyUtilization counters of the days, a list of (date, open slots, bookings), and the
+    # DailyVaccineUtilization counters of vaccine_days, a list of (date, vaccine name, bookings), in the caller's transaction;
+    # every write to Availabilities or Reservations goes with one, so the summaries stay equal to their counts
+    def merge_utilization(self, cursor, days, vaccine_days=()):
+        raise NotImplementedError
+
+    # inserts the (date, caregiver name) rows that aren't in Availabilities yet and counts them in DailyUtilization;
+    # a date the caregiver already has an appointment on is skipped too, it would be booked twice. returns those inserted
+    def add_availability(self, cursor, rows):
+        raise NotImplementedError
+
+    # recomputes both summaries from Availabilities and Reservations, in the caller's transaction
+    def rebuild_utilization(self, cursor):
+        cursor.execute("DELETE FROM DailyUtilization")
+        cursor.execute("INSERT INTO DailyUtilization (Time, OpenSlots, Booked) " + UTILIZATION_DAYS)
+        cursor.execute("DELETE FROM DailyVaccineUtilization")
+        cursor.execute("INSERT INTO DailyVaccineUtilization (Time, VaccineName, Booked) " + UTILIZATION_VACCINE_DAYS)
+
+    # withdraws a caregiver's availability for date, if any; returns whether there was one
+    def remove_availability(self, cursor, username, date):
+        cursor.execute("DELETE FROM Availabilities WHERE Time = %s AND Username = %s", (date, username))
+        removed = cursor.rowcount
+        if removed > 0:
+            self.merge_utilization(cursor, [(date, -removed, 0)])
+        return removed > 0
+
+    # adds doses to many vaccines at once, creating the missing ones; rows is a list of (name, shard, doses)
+    # returns a list of (name, doses after the update over all shards, True if the vaccine was created)
+    def merge_doses(self, cursor, rows):
+        raise NotImplementedError
+
+    # books a caregiver available on date, picked by strategy (an AssignmentStrategy, AssignmentStrategy.get() by default),
+    # and one dose of vaccine for patient, in the caller's transaction; counts the booking in CaregiverBookings
+    # returns (status, appointment id, caregiver name) where status is "ok", "no_caregiver" or "no_doses";
+    # the caller commits on "ok" and rolls back otherwise
+    def reserve(self, cursor, patient, date, vaccine, strategy=None):
+        status, appointment_id, caregiver, _ = self.reserve_earliest(cursor, patient, vaccine, date, date, strategy)
+        return status, appointment_id, caregiver
+
+    # like reserve, on the earliest date from start to end (both included, end None for no limit) with a caregiver
+    # available; a range seek on the Availabilities primary key, which starts with Time
+    # returns (status, appointment id, caregiver name, date)
+    def reserve_earliest(self, cursor, patient, vaccine, start, end=None, strategy=None):
+        raise NotImplementedError
+
+    # deletes the reservations with the given ids (None for any) that belong to patient and caregiver (None for anyone)
+    # and are on date (None for any date), in the caller's transaction, all with set-based statements: the dose of each
+    # goes back to shard ID % shards of its vaccine, the booking is taken off CaregiverBookings and, with
+    # restore_availability, the caregiver is available again on the date
+    # returns the (appointment id, caregiver name, vaccine name, date) of those deleted, by ID
+    def cancel(self, cursor, ids=None, patient=None, caregiver=None, date=None, shards=1, restore_availability=True):
+        raise NotImplementedError
+
+    def savepoint(self, cursor, name):
+        raise NotImplementedError
+
+    def rollback_to_savepoint(self, cursor, name):
+        raise NotImplementedError
+
+    # forgets a savepoint once the work after it is kept; the work stays in the caller's transaction
+    def release_savepoint(self, cursor, name):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def get_backend():
+        name = os.getenv("Backend", "mssql").lower()
+        if name == "mssql":
+            return MSSQLBackend()
+        if name == "sqlite":
+            return SQLiteBackend(os.getenv("SQLitePath", ":memory:"))
+        raise ValueError(f"Unknown backend {name}")
+
+
+def _cancel_where(ids, patient, caregiver, date):
+    # WHERE condition and parameters over Reservations for Backend.cancel
+    conditions, params = [], []
+    if ids is not None:
+        conditions.append("ID IN (" + ", ".join(["%d"] * len(ids)) + ")")
+        params += ids
+    for name, value in (("PatientName", patient), ("CaregiverName", caregiver), ("Time", date)):
+        if value is not None:
+            conditions.append(f"{name} = %s")
+            params.append(value)
+    return " AND ".join(conditions) if conditions else "1 = 1", tuple(params)
+
+
+def _count_days(availability):
+    # DailyUtilization rows for the (date, caregiver name) rows added to Availabilities
+    counts = {}
+    for date, _ in availability:
+        counts[date] = counts.get(date, 0) + 1
+    return [(date, count, 0) for date, count in sorted(counts.items())]
+
+
+def _date_range(name, start, end):
+    # WHERE condition and parameters for name between start and end, end None for no upper limit
+    if end is None:
+        return f"{name} >= %s", (start,)
+    return f"{name} >= %s AND {name} <= %s", (start, end)
+
+
+class MSSQLBackend(Backend):
+    name = "mssql"
+    random_order = "NEWID()"
+
+    # picks the caregiver for the AssignmentStrategy: the first {candidates} availabilities on the dates
+    # of {where} in the order of {order_by} are ranked without locks, then claimed one by one with UPDLOCK,
+    # READPAST, which skips rows another reservation holds. a sorted TOP 1 with those hints would take
+    # update locks on every row it sorts, so concurrent reservers would skip all of them; claiming by
+    # rank keeps the strategy's order and spreads the reservers over the next candidates. when every
+    # candidate is taken meanwhile it claims any other row nobody holds, and only if there is none waits
+    # for the first row in key order, so the batch answers no_caregiver only when no caregiver is left
+    reserve_candidates = 10
+    reserve_claim_caregiver = """
+INSERT INTO @Caregivers (Username, Time) SELECT TOP ({candidates}) a.Username, a.Time FROM Availabilities a
+    LEFT JOIN CaregiverBookings b ON b.Username = a.Username
+    WHERE {where} ORDER BY a.Time, {order_by};
+SET @Rank = 1;
+WHILE @Caregiver IS NULL AND @Rank <= (SELECT COUNT(*) FROM @Caregivers)
+BEGIN
+    SELECT @Caregiver = a.Username, @Time = a.Time FROM @Caregivers c
+        JOIN Availabilities a WITH (UPDLOCK, READPAST, ROWLOCK) ON a.Time = c.Time AND a.Username = c.Username
+        WHERE c.Rank = @Rank;
+    SET @Rank = @Rank + 1;
+END
+IF @Caregiver IS NULL
+    SELECT TOP 1 @Caregiver = a.Username, @Time = a.Time FROM Availabilities a WITH (UPDLOCK, READPAST, ROWLOCK)
+        LEFT JOIN CaregiverBookings b ON b.Username = a.Username
+        WHERE {where} ORDER BY a.Time, {order_by};
+IF @Caregiver IS NULL
+    SELECT TOP 1 @Caregiver = a.Username, @Time = a.Time FROM Availabilities a WITH (UPDLOCK, ROWLOCK)
+        WHERE {where} ORDER BY a.Time, a.Username;
+"""
+
+    # one batch, one round trip: the caregiver is claimed as above, then a dose from the non-empty
+    # shards of the vaccine, ranked in random order and claimed the same way
+    reserve_batch = """
+SET NOCOUNT ON;
+DECLARE @Vaccine varchar(255) = %s, @ID int = %s, @Caregiver varchar(255), @Time date, @Shard int, @Rank int;
+DECLARE @Caregivers TABLE (Rank int IDENTITY PRIMARY KEY, Username varchar(255), Time date);
+DECLARE @Shards TABLE (Rank int IDENTITY PRIMARY KEY, Shard int);
+{claim_caregiver}
+IF @Caregiver IS NULL
+BEGIN
+    SELECT 'no_caregiver' AS Status, NULL AS ID, NULL AS CaregiverName, NULL AS Time;
+    RETURN;
+END
+
+INSERT INTO @Shards (Shard) SELECT Shard FROM VaccineDoses WHERE Name = @Vaccine AND Doses > 0 ORDER BY NEWID();
+SET @Rank = 1;
+WHILE @Shard IS NULL AND @Rank <= (SELECT COUNT(*) FROM @Shards)
+BEGIN
+    SELECT @Shard = d.Shard FROM @Shards s
+        JOIN VaccineDoses d WITH (UPDLOCK, READPAST, ROWLOCK) ON d.Name = @Vaccine AND d.Shard = s.Shard
+        WHERE s.Rank = @Rank AND d.Doses > 0;
+    SET @Rank = @Rank + 1;
+END
+IF @Shard IS NULL
+    SELECT TOP 1 @Shard = Shard FROM VaccineDoses WITH (UPDLOCK, ROWLOCK) WHERE Name = @Vaccine AND Doses > 0 ORDER BY Shard;
+IF @Shard IS NULL
+BEGIN
+    SELECT 'no_doses' AS Status, NULL AS ID, NULL AS CaregiverName, NULL AS Time;
+    RETURN;
+END
+UPDATE VaccineDoses SET Doses = Doses - 1 WHERE Name = @Vaccine AND Shard = @Shard;
+
+DELETE FROM Availabilities WHERE Time = @Time AND Username = @Caregiver;
+INSERT INTO Reservations (ID, PatientName, CaregiverName, VaccineName, Time) VALUES (@ID, %s, @Caregiver, @Vaccine, @Time);
+MERGE CaregiverBookings WITH (HOLDLOCK) AS t
+    USING (SELECT @Caregiver AS Username, DATEDIFF_BIG(MICROSECOND, '1970-01-01', SYSUTCDATETIME()) AS LastBooked) AS s
+    ON t.Username = s.Username
+    WHEN MATCHED THEN UPDATE SET Booked = t.Booked + 1, LastBooked = s.LastBooked
+    WHEN NOT MATCHED THEN INSERT (Username, Booked, LastBooked) VALUES (s.Username, 1, s.LastBooked);
+MERGE DailyUtilization WITH (HOLDLOCK) AS t USING (SELECT @Time AS Time) AS s ON t.Time = s.Time
+    WHEN MATCHED THEN UPDATE SET OpenSlots = t.OpenSlots - 1, Booked = t.Booked + 1
+    WHEN NOT MATCHED THEN INSERT (Time, OpenSlots, Booked) VALUES (s.Time, -1, 1);
+MERGE DailyVaccineUtilization WITH (HOLDLOCK) AS t USING (SELECT @Time AS Time, @Vaccine AS VaccineName) AS s
+    ON t.Time = s.Time AND t.VaccineName = s.VaccineName
+    WHEN MATCHED THEN UPDATE SET Booked = t.Booked + 1
+    WHEN NOT MATCHED THEN INSERT (Time, VaccineName, Booked) VALUES (s.Time, s.VaccineName, 1);
+SELECT 'ok' AS Status, @ID AS ID, @Caregiver AS CaregiverName, @Time AS Time;
+"""
+
+    # one batch: DELETE ... OUTPUT collects the canceled rows, and every later step joins them
+    cancel_batch = """
+SET NOCOUNT ON;
+DECLARE @Canceled TABLE (ID int PRIMARY KEY, CaregiverName varchar(255), VaccineName varchar(255), Time date);
+DECLARE @Restored TABLE (Time date);
+DELETE FROM Reservations OUTPUT deleted.ID, deleted.CaregiverName, deleted.VaccineName, deleted.Time INTO @Canceled
+    WHERE {where};
+{restore}
+MERGE VaccineDoses WITH (HOLDLOCK) AS t
+    USING (SELECT VaccineName AS Name, ID %% {shards} AS Shard, COUNT(*) AS Doses FROM @Canceled GROUP BY VaccineName, ID %% {shards}) AS s
+    ON t.Name = s.Name AND t.Shard = s.Shard
+    WHEN MATCHED THEN UPDATE SET Doses = t.Doses + s.Doses
+    WHEN NOT MATCHED THEN INSERT (Name, Shard, Doses) VALUES (s.Name, s.Shard, s.Doses);
+UPDATE b SET Booked = CASE WHEN b.Booked > c.Canceled THEN b.Booked - c.Canceled ELSE 0 END
+    FROM CaregiverBookings b JOIN (SELECT CaregiverName, COUNT(*) AS Canceled FROM @Canceled GROUP BY CaregiverName) c
+    ON c.CaregiverName = b.Username;
+MERGE DailyUtilization WITH (HOLDLOCK) AS t
+    USING (SELECT Time, SUM(OpenSlots) AS OpenSlots, SUM(Booked) AS Booked FROM (
+        SELECT Time, 0 AS OpenSlots, -1 AS Booked FROM @Canceled UNION ALL SELECT Time, 1, 0 FROM @Restored) u GROUP BY Time) AS s
+    ON t.Time = s.Time
+    WHEN MATCHED THEN UPDATE SET OpenSlots = t.OpenSlots + s.OpenSlots, Booked = t.Booked + s.Booked
+    WHEN NOT MATCHED THEN INSERT (Time, OpenSlots, Booked) VALUES (s.Time, s.OpenSlots, s.Booked);
+UPDATE u SET Booked = u.Booked - c.Canceled
+    FROM DailyVaccineUtilization u JOIN (SELECT Time, VaccineName, COUNT(*) AS Canceled FROM @Canceled GROUP BY Time, VaccineName) c
+    ON c.Time = u.Time AND c.VaccineName = u.VaccineName;
+SELECT ID, CaregiverName, VaccineName, Time FROM @Canceled ORDER BY ID;
+"""
+    cancel_restore = """
+INSERT INTO Availabilities (Time, Username) OUTPUT inserted.Time INTO @Restored
+    SELECT DISTINCT c.Time, c.CaregiverName FROM @Canceled c
+    WHERE NOT EXISTS (SELECT 1 FROM Availabilities a WITH (UPDLOCK) WHERE a.Time = c.Time AND a.Username = c.CaregiverName);
+"""
+
+    def __init__(self, server=None, db_name=None, user=None, password=None):
+        if pymssql is None:
+            raise ImportError("pymssql is required for the mssql backend")
+        server = server if server is not None else os.getenv("Server")
+        self.server_name = server + ".database.windows.net"
+        self.db_name = db_name if db_name is not None else os.getenv("DBName")
+        self.user = user if user is not None else os.getenv("UserID")
+        self.password = password if password is not None else os.getenv("Password")
+        # table -> IdAllocator
+        self.id_allocators = {}
+        self.id_allocators_lock = threading.Lock()
+
+    def connect(self):
+        return pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
+
+    def apply_schema(self, path=SCHEMA_PATH):
+        with open(path) as f:
+            script = f.read()
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(script)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def table_exists(self, cursor, table):
+        cursor.execute("SELECT 1 WHERE OBJECT_ID(%s, 'U') IS NOT NULL", table)
+        return cursor.fetchone() is not None
+
+    def column_exists(self, cursor, table, name):
+        cursor.execute("SELECT 1 WHERE COL_LENGTH(%s, %s) IS NOT NULL", (table, name))
+        return cursor.fetchone() is not None
+
+    def index_exists(self, cursor, table, index):
+        cursor.execute("SELECT 1 FROM sys.indexes WHERE name = %s AND object_id = OBJECT_ID(%s)", (index, table))
+        return cursor.fetchone() is not None
+
+    def create_index(self, cursor, name, table, columns, include=(), unique=False):
+        statement = f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({', '.join(columns)})"
+        if include:
+            statement += f" INCLUDE ({', '.join(include)})"
+        cursor.execute(statement)
+
+    def alter_column_type(self, cursor, table, name, type):
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN {name} {type}")
+
+    # from a block of IDs held in memory, so the common case costs no round trip
+    def next_id(self, cursor, table, id_column):
+        allocator = self.id_allocators.get(table)
+        if allocator is None:
+            with self.id_allocators_lock:
+                allocator = self.id_allocators.get(table)
+                if allocator is None:
+                    allocator = self.id_allocators[table] = IdAllocator(self, table, id_column, retry_on=IntegrityError)
+        return allocator.next()
+
+    def close(self):
+        with self.id_allocators_lock:
+            for allocator in self.id_allocators.values():
+                allocator.close()
+            self.id_allocators.clear()
+
+    def merge_doses(self, cursor, rows):
+        vaccine_names = list(dict.fromkeys(name for name, _, _ in rows))
+        names = " UNION ALL ".join(["SELECT %s AS Name"] * len(vaccine_names))
+        add_vaccines = "MERGE Vaccines WITH (HOLDLOCK) AS t USING (" + names + ") AS s ON t.Name = s.Name " \
+                       "WHEN NOT MATCHED THEN INSERT (Name) VALUES (s.Name) OUTPUT inserted.Name AS Name;"
+        cursor.execute(add_vaccines, tuple(vaccine_names))
+        created = {column(row, "Name") for row in cursor.fetchall()}
+        source = " UNION ALL ".join(["SELECT %s AS Name, %d AS Shard, %d AS Doses"] * len(rows))
+        add_doses = "MERGE VaccineDoses WITH (HOLDLOCK) AS t USING (" + source + ") AS s ON t.Name = s.Name AND t.Shard = s.Shard " \
+                    "WHEN MATCHED THEN UPDATE SET Doses = t.Doses + s.Doses " \
+                    "WHEN NOT MATCHED THEN INSERT (Name, Shard, Doses) VALUES (s.Name, s.Shard, s.Doses);"
+        cursor.execute(add_doses, tuple(value for row in rows for value in row))
+        placeholders = ", ".join(["%s"] * len(vaccine_names))
+        cursor.execute(f"SELECT Name, SUM(Doses) AS Doses FROM VaccineDoses WHERE Name IN ({placeholders}) GROUP BY Name",
+                       tuple(vaccine_names))
+        return [(column(row, "Name", 0), column(row, "Doses", 1), column(row, "Name", 0) in created)
+                for row in cursor.fetchall()]
+
+    def merge_utilization(self, cursor, days, vaccine_days=()):
+        if days:
+            source = " UNION ALL ".join(["SELECT %s AS Time, %d AS OpenSlots, %d AS Booked"] * len(days))
+            cursor.execute("MERGE DailyUtilization WITH (HOLDLOCK) AS t USING (" + source + ") AS s ON t.Time = s.Time "
+                           "WHEN MATCHED THEN UPDATE SET OpenSlots = t.OpenSlots + s.OpenSlots, Booked = t.Booked + s.Booked "
+                           "WHEN NOT MATCHED THEN INSERT (Time, OpenSlots, Booked) VALUES (s.Time, s.OpenSlots, s.Booked);",
+                           tuple(value for row in days for value in row))
+        if vaccine_days:
+            source = " UNION ALL ".join(["SELECT %s AS Time, %s AS VaccineName, %d AS Booked"] * len(vaccine_days))
+            cursor.execute("MERGE DailyVaccineUtilization WITH (HOLDLOCK) AS t USING (" + source + ") AS s "
+                           "ON t.Time = s.Time AND t.VaccineName = s.VaccineName "
+                           "WHEN MATCHED THEN UPDATE SET Booked = t.Booked + s.Booked "
+                           "WHEN NOT MATCHED THEN INSERT (Time, VaccineName, Booked) VALUES (s.Time, s.VaccineName, s.Booked);",
+                           tuple(value for row in vaccine_days for value in row))
+
+    def add_availability(self, cursor, rows):
+        source = " UNION ALL ".join(["SELECT %s AS Time, %s AS Username"] * len(rows))
+        cursor.execute("INSERT INTO Availabilities (Time, Username) OUTPUT inserted.Time, inserted.Username "
+                       "SELECT v.Time, v.Username FROM (" + source + ") v WHERE NOT EXISTS "
+                       "(SELECT 1 FROM Availabilities a WITH (UPDLOCK) WHERE a.Time = v.Time AND a.Username = v.Username) "
+                       "AND NOT EXISTS (SELECT 1 FROM Reservations r WHERE r.Time = v.Time AND r.CaregiverName = v.Username)",
+                       tuple(value for row in rows for value in row))
+        inserted = [(column(row, "Time", 0), column(row, "Username", 1)) for row in cursor.fetchall()]
+        self.merge_utilization(cursor, _count_days(inserted))
+        return inserted
+
+    def reserve_earliest(self, cursor, patient, vaccine, start, end=None, strategy=None):
+        strategy = strategy if strategy is not None else AssignmentStrategy.get()
+        where, params = _date_range("a.Time", start, end)
+        claim_caregiver = MSSQLBackend.reserve_claim_caregiver.format(where=where, order_by=strategy.order_by(self),
+                                                                      candidates=MSSQLBackend.reserve_candidates)
+        batch = MSSQLBackend.reserve_batch.format(claim_caregiver=claim_caregiver)
+        appointment_id = self.next_id(cursor, "Reservations", "ID")
+        cursor.execute(batch, (vaccine, appointment_id) + params * 3 + (patient,))
+        row = cursor.fetchone()
+        return column(row, "Status", 0), column(row, "ID", 1), column(row, "CaregiverName", 2), column(row, "Time", 3)
+
+    def cancel(self, cursor, ids=None, patient=None, caregiver=None, date=None, shards=1, restore_availability=True):
+        where, params = _cancel_where(ids, patient, caregiver, date)
+        batch = MSSQLBackend.cancel_batch.format(where=where, shards=int(shards),
+                                                 restore=MSSQLBackend.cancel_restore if restore_availability else "")
+        cursor.execute(batch, params)
+        return [(column(row, "ID", 0), column(row, "CaregiverName", 1), column(row, "VaccineName", 2), column(row, "Time", 3))
+                for row in cursor.fetchall()]
+
+    def savepoint(self, cursor, name):
+        cursor.execute(f"SAVE TRANSACTION {name}")
+
+    def rollback_to_savepoint(self, cursor, name):
+        cursor.execute(f"ROLLBACK TRANSACTION {name}")
+
+    def release_savepoint(self, cursor, name):
+        # T-SQL has no RELEASE; a savepoint goes away with its transaction
+        pass
+
+
+def _adapt_date(d):
+    return d.isoformat()
+
+
+def _convert_date(value):
+    return datetime.date.fromisoformat(value.decode())
+
+
+def as_date(value):
+    # RETURNING columns and columns of subqueries have no declared type, so SQLite hands their dates back as text
+    return datetime.date.fromisoformat(value) if isinstance(value, str) else value
+
+
+sqlite3.register_adapter(datetime.date, _adapt_date)
+sqlite3.register_converter("date", _convert_date)
+
+
+class SQLiteBackend(Backend):
+    '''
+    embedded backend for local runs, benchmarks and soak tests
+
+    path is a file name or ":memory:"; an in-memory database is shared by all
+    connections of this backend and lives until close() is called
+    '''
+    name = "sqlite"
+    random_order = "RANDOM()"
+    memory_databases = 0
+    memory_lock = threading.Lock()
+
+    def __init__(self, path=":memory:", apply_schema=True):
+        self.keeper = None
+        if path == ":memory:":
+            with SQLiteBackend.memory_lock:
+                SQLiteBackend.memory_databases += 1
+                self.database = f"file:scheduler_{os.getpid()}_{SQLiteBackend.memory_databases}?mode=memory&cache=shared"
+            # a shared in-memory database disappears with its last connection
+            self.keeper = self.connect()
+        else:
+            self.database = path
+            # readers don't block the writer on a file database
+            conn = self.connect()
+            conn.conn.execute("PRAGMA journal_mode = WAL")
+            conn.close()
+        if apply_schema:
+            if not self.has_schema():
+                self.apply_schema()
+            migrate(self)
+
+    def connect(self):
+        conn = sqlite3.connect(self.database, uri=self.database.startswith("file:"),
+                               timeout=30, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys = ON")
+        return SQLiteConnection(conn, timeout=30)
+
+    def has_schema(self):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Caregivers'")
+            return cursor.fetchone() is not None
+        finally:
+            conn.close()
+
+    def apply_schema(self, path=SCHEMA_PATH):
+        with open(path) as f:
+            script = f.read()
+        conn = self.connect()
+        try:
+            conn.conn.executescript(script)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def table_exists(self, cursor, table):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", table)
+        return cursor.fetchone() is not None
+
+    def column_exists(self, cursor, table, name):
+        cursor.execute("SELECT 1 FROM pragma_table_info(%s) WHERE name = %s", (table, name))
+        return cursor.fetchone() is not None
+
+    def index_exists(self, cursor, table, index):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s", (table, index))
+        return cursor.fetchone() is not None
+
+    def create_index(self, cursor, name, table, columns, include=(), unique=False):
+        # no INCLUDE in SQLite; the included columns go at the end of the key, which a unique index can't take
+        if unique and include:
+            raise ValueError("A unique index can't include columns in SQLite")
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({', '.join(list(columns) + list(include))})")
+
+    def alter_column_type(self, cursor, table, name, type):
+        # SQLite can't change a declared type, and doesn't need to: an int column already holds 64-bit integers
+        pass
+
+    def merge_utilization(self, cursor, days, vaccine_days=()):
+        # WHERE true keeps SQLite from parsing ON CONFLICT as part of the SELECT
+        if days:
+            source = " UNION ALL ".join(["SELECT %s AS Time, %d AS OpenSlots, %d AS Booked"] * len(days))
+            cursor.execute("INSERT INTO DailyUtilization (Time, OpenSlots, Booked) SELECT Time, OpenSlots, Booked FROM (" + source + ") "
+                           "WHERE true ON CONFLICT (Time) DO UPDATE SET OpenSlots = OpenSlots + excluded.OpenSlots, "
+                           "Booked = Booked + excluded.Booked", tuple(value for row in days for value in row))
+        if vaccine_days:
+            source = " UNION ALL ".join(["SELECT %s AS Time, %s AS VaccineName, %d AS Booked"] * len(vaccine_days))
+            cursor.execute("INSERT INTO DailyVaccineUtilization (Time, VaccineName, Booked) SELECT Time, VaccineName, Booked "
+                           "FROM (" + source + ") WHERE true ON CONFLICT (Time, VaccineName) DO UPDATE SET Booked = Booked + excluded.Booked",
+                           tuple(value for row in vaccine_days for value in row))
+
+    def add_availability(self, cursor, rows):
+        source = " UNION ALL ".join(["SELECT %s AS Time, %s AS Username"] * len(rows))
+        cursor.execute("INSERT INTO Availabilities (Time, Username) SELECT v.Time, v.Username FROM (" + source + ") v "
+                       "WHERE NOT EXISTS (SELECT 1 FROM Availabilities a WHERE a.Time = v.Time AND a.Username = v.Username) "
+                       "AND NOT EXISTS (SELECT 1 FROM Reservations r WHERE r.Time = v.Time AND r.CaregiverName = v.Username) "
+                       "RETURNING Time, Username", tuple(value for row in rows for value in row))
+        inserted = [(as_date(column(row, "Time", 0)), column(row, "Username", 1)) for row in cursor.fetchall()]
+        self.merge_utilization(cursor, _count_days(inserted))
+        return inserted
+
+    def merge_doses(self, cursor, rows):
+        vaccine_names = list(dict.fromkeys(name for name, _, _ in rows))
+        names = ", ".join(["%s"] * len(vaccine_names))
+        cursor.execute(f"SELECT Name FROM Vaccines WHERE Name IN ({names})", tuple(vaccine_names))
+        existing = {column(row, "Name") for row in cursor.fetchall()}
+        cursor.execute("INSERT OR IGNORE INTO Vaccines (Name) VALUES " + ", ".join(["(%s)"] * len(vaccine_names)),
+                       tuple(vaccine_names))
+        source = " UNION ALL ".join(["SELECT %s AS Name, %d AS Shard, %d AS Doses"] * len(rows))
+        # WHERE true keeps SQLite from parsing ON CONFLICT as part of the SELECT
+        upsert = "INSERT INTO VaccineDoses (Name, Shard, Doses) SELECT Name, Shard, Doses FROM (" + source + ") WHERE true " \
+                 "ON CONFLICT (Name, Shard) DO UPDATE SET Doses = Doses + excluded.Doses"
+        cursor.execute(upsert, tuple(value for row in rows for value in row))
+        cursor.execute(f"SELECT Name, SUM(Doses) AS Doses FROM VaccineDoses WHERE Name IN ({names}) GROUP BY Name",
+                       tuple(vaccine_names))
+        return [(column(row, "Name", 0), column(row, "Doses", 1), column(row, "Name", 0) not in existing)
+                for row in cursor.fetchall()]
+
+    def reserve_earliest(self, cursor, patient, vaccine, start, end=None, strategy=None):
+        strategy = strategy if strategy is not None else AssignmentStrategy.get()
+        # the guarded decrement comes first so the transaction takes the database write lock
+        # before it reads, which serializes concurrent reservers without busy snapshot errors
+        # one random non-empty shard; SQLite has one writer at a time, so shards only matter on Azure SQL
+        cursor.execute("UPDATE VaccineDoses SET Doses = Doses - 1 WHERE rowid = "
+                       f"(SELECT rowid FROM VaccineDoses WHERE Name = %s AND Doses > 0 ORDER BY {self.random_order} LIMIT 1)", vaccine)
+        has_dose = cursor.rowcount == 1
+        where, params = _date_range("a.Time", start, end)
+        cursor.execute("SELECT a.Username, a.Time FROM Availabilities a LEFT JOIN CaregiverBookings b ON b.Username = a.Username "
+                       f"WHERE {where} ORDER BY a.Time, {strategy.order_by(self)} LIMIT 1", params)
+        row = cursor.fetchone()
+        if row is None:
+            return "no_caregiver", None, None, None
+        if not has_dose:
+            return "no_doses", None, None, None
+        caregiver = column(row, "Username", 0)
+        date = column(row, "Time", 1)
+        # one writer at a time and no network, so the ID comes from IdBlocks inside this transaction: a block
+        # reserved on another connection would wait for the write lock this transaction already holds
+        appointment_id = self.next_id(cursor, "Reservations", "ID")
+        cursor.execute("DELETE FROM Availabilities WHERE Time = %s AND Username = %s", (date, caregiver))
+        cursor.execute("INSERT INTO Reservations (ID, PatientName, CaregiverName, VaccineName, Time) VALUES (%s, %s, %s, %s, %s)",
+                       (appointment_id, patient, caregiver, vaccine, date))
+        cursor.execute("INSERT INTO CaregiverBookings (Username, Booked, LastBooked) VALUES (%s, 1, %s) "
+                       "ON CONFLICT (Username) DO UPDATE SET Booked = Booked + 1, LastBooked = excluded.LastBooked",
+                       (caregiver, time.time_ns() // 1000))
+        self.merge_utilization(cursor, [(date, -1, 1)], [(date, vaccine, 1)])
+        return "ok", appointment_id, caregiver, date
+
+    def cancel(self, cursor, ids=None, patient=None, caregiver=None, date=None, shards=1, restore_availability=True):
+        where, params = _cancel_where(ids, patient, caregiver, date)
+        # RETURNING stands in for OUTPUT; the later steps get the canceled rows back as a VALUES list
+        cursor.execute(f"DELETE FROM Reservations WHERE {where} RETURNING ID, CaregiverName, VaccineName, Time", params)
+        canceled = sorted((column(row, "ID", 0), column(row, "CaregiverName", 1), column(row, "VaccineName", 2),
+                           as_date(column(row, "Time", 3))) for row in cursor.fetchall())
+        if not canceled:
+            return []
+        rows = " UNION ALL ".join(["SELECT %d AS ID, %s AS CaregiverName, %s AS VaccineName, %s AS Time"] * len(canceled))
+        values = tuple(value for row in canceled for value in row)
+        if restore_availability:
+            self.add_availability(cursor, list(dict.fromkeys((date, caregiver_name) for _, caregiver_name, _, date in canceled)))
+        cursor.execute("INSERT INTO VaccineDoses (Name, Shard, Doses) "
+                       f"SELECT VaccineName, ID % {int(shards)}, COUNT(*) FROM ({rows}) GROUP BY VaccineName, ID % {int(shards)} "
+                       "ON CONFLICT (Name, Shard) DO UPDATE SET Doses = Doses + excluded.Doses", values)
+        cursor.execute("UPDATE CaregiverBookings SET Booked = MAX(Booked - c.Canceled, 0) "
+                       f"FROM (SELECT CaregiverName, COUNT(*) AS Canceled FROM ({rows}) GROUP BY CaregiverName) c "
+                       "WHERE c.CaregiverName = CaregiverBookings.Username", values)
+        days, vaccine_days = {}, {}
+        for _, _, vaccine_name, date in canceled:
+            days[date] = days.get(date, 0) - 1
+            vaccine_days[(date, vaccine_name)] = vaccine_days.get((date, vaccine_name), 0) - 1
+        self.merge_utilization(cursor, [(date, 0, booked) for date, booked in sorted(days.items())],
+                               [(date, vaccine_name, booked) for (date, vaccine_name), booked in sorted(vaccine_days.items())])
+        return canceled
+
+    def savepoint(self, cursor, name):
+        # an outermost savepoint would be the transaction itself and RELEASE would commit it,
+        # so open the transaction first when none is active yet. IMMEDIATE takes the write lock
+        # up front: a transaction that reads first and writes later could find the lock taken by a
+        # writer that needs what it has read, and neither would get anywhere until the timeout
+        if not cursor.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(f"SAVEPOINT {name}")
+
+    def rollback_to_savepoint(self, cursor, name):
+        cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+
+    def release_savepoint(self, cursor, name):
+        cursor.execute(f"RELEASE SAVEPOINT {name}")
+
+    def close(self):
+        if self.keeper is not None:
+            self.keeper.close()
+            self.keeper = None
+
+
+TOP_PATTERN = re.compile(r"^\s*SELECT\s+TOP\s+(\d+)\s+", re.IGNORECASE)
+PARAM_PATTERN = re.compile(r"%[sd]")
+# statements built from user input (IN lists, TOP n) would grow an unbounded cache
+TRANSLATION_CACHE_SIZE = int(os.getenv("SQLiteTranslationCacheSize", "512"))
+
+
+@functools.lru_cache(maxsize=TRANSLATION_CACHE_SIZE)
+def translate(operation):
+    # rewrites the T-SQL flavoured statements used by the models (%s/%d params, SELECT TOP n) for SQLite
+    translated = PARAM_PATTERN.sub("?", operation)
+    top = TOP_PATTERN.match(translated)
+    if top:
+        translated = "SELECT " + translated[top.end():].rstrip().rstrip(";") + f" LIMIT {top.group(1)}"
+    return translated
+
+
+def _params(params):
+    # pymssql accepts a single bare value in place of a one element tuple
+    if params is None:
+        return ()
+    if isinstance(params, (tuple, list, dict)):
+        return params
+    return (params,)
+
+
+class SQLiteConnection:
+    # gives a sqlite3 connection the subset of the pymssql connection API the scheduler uses
+    def __init__(self, conn, timeout=30):
+        self.conn = conn
+        self.timeout = timeout
+
+    def cursor(self, as_dict=False):
+        return SQLiteCursor(self.conn.cursor(), as_dict, self.timeout)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLiteCursor:
+    def __init__(self, cursor, as_dict=False, timeout=30):
+        self.cursor = cursor
+        self.as_dict = as_dict
+        self.timeout = timeout
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def in_transaction(self):
+        return self.cursor.connection.in_transaction
+
+    def _run(self, call):
+        # a table locked by another connection of a shared in-memory database fails at once instead of
+        # waiting like a locked file does, so wait here, up to the same timeout. readers wait for
+        # writers too: they only ever see committed rows
+        deadline = None
+        delay = 0.001
+        while True:
+            try:
+                return call()
+            except sqlite3.OperationalError as e:
+                if "table is locked" not in str(e):
+                    raise
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.timeout
+                if now >= deadline:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+
+    def execute(self, operation, params=None):
+        self._run(lambda: self.cursor.execute(translate(operation), _params(params)))
+        return self
+
+    def executemany(self, operation, seq_of_params):
+        seq_of_params = [_params(p) for p in seq_of_params]
+        self._run(lambda: self.cursor.executemany(translate(operation), seq_of_params))
+        return self
+
+    def _row(self, row):
+        if row is None or not self.as_dict:
+            return row
+        return {column[0]: value for column, value in zip(self.cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self.cursor.fetchone())
+
+    def fetchmany(self, size=None):
+        rows = self.cursor.fetchmany(size) if size is not None else self.cursor.fetchmany()
+        return [self._row(row) for row in rows]
+
+    def fetchall(self):
+        return [self._row(row) for row in self.cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self.cursor:
+            yield self._row(row)
+
+    def close(self):
+        self.cursor.close()
@@ -1,29 +1,182 @@
-import pymssql
-import os
-
-
-class ConnectionManager:
-
-    def __init__(self):
-        self.server_name = os.getenv("Server") + ".database.windows.net"
-        self.db_name = os.getenv("DBName")
-        self.user = os.getenv("UserID")
-        self.password = os.getenv("Password")
-        self.conn = None
-
-    def create_connection(self):
-        try:
-            self.conn = pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
-        except pymssql.Error as db_err:
-            print("Database Programming Error in SQL connection processing! ")
-            print(db_err)
-            quit()
-        return self.conn
-
-    def close_connection(self):
-        try:
-            self.conn.close()
-        except pymssql.Error as db_err:
-            print("Database Programming Error in SQL connection processing! ")
-            print(db_err)
-            quit()
+import os
+import threading
+from db.Backend import Backend, DBError
+from db.ConnectionPool import ConnectionPool, PoolTimeoutError
+from db.Tracing import Tracer
+
+
+class ConnectionManager:
+    # one backend and one pool per process, shared by every ConnectionManager instance
+    backend = None
+    pool = None
+    pool_lock = threading.Lock()
+    # connection pinned by share() for the current thread
+    local = threading.local()
+    # called after a shared connection throws work away, so caches drop what they learned from it
+    rollback_listeners = []
+
+    def __init__(self):
+        self.conn = None
+        # the pool conn was borrowed from, which configure() or close_pool() may have replaced since
+        self.pool = None
+
+    def configure(backend):
+        # switch the process to another backend, e.g. a local SQLiteBackend for benchmarks
+        with ConnectionManager.pool_lock:
+            if ConnectionManager.pool is not None:
+                ConnectionManager.pool.close()
+                ConnectionManager.pool = None
+            ConnectionManager.backend = backend
+
+    def get_backend(self):
+        if ConnectionManager.backend is None:
+            with ConnectionManager.pool_lock:
+                if ConnectionManager.backend is None:
+                    ConnectionManager.backend = Backend.get_backend()
+        return ConnectionManager.backend
+
+    def get_pool(self):
+        if ConnectionManager.pool is None:
+            backend = self.get_backend()
+            created = None
+            with ConnectionManager.pool_lock:
+                if ConnectionManager.pool is None:
+                    # connections are wrapped so Tracer can time every call once a sink is configured
+                    ConnectionManager.pool = ConnectionPool(
+                        lambda: Tracer.connect(backend.connect),
+                        min_size=int(os.getenv("PoolMinSize", "1")),
+                        max_size=int(os.getenv("PoolMaxSize", "10")),
+                        idle_timeout=float(os.getenv("PoolIdleTimeout", "300")),
+                        ping_interval=float(os.getenv("PoolPingInterval", "30")),
+                        borrow_timeout=float(os.getenv("PoolBorrowTimeout", "30")),
+                        ping=backend.ping,
+                    )
+                    created = ConnectionManager.pool
+            if created is not None:
+                # opens PoolMinSize connections up front, outside the lock so other threads aren't held up
+                created.fill()
+        return ConnectionManager.pool
+
+    def create_connection(self):
+        if self.conn is not None:
+            return self.conn
+        shared = getattr(ConnectionManager.local, "shared", None)
+        if shared is not None:
+            self.conn = shared
+            return self.conn
+        try:
+            pool = self.get_pool()
+            self.conn = pool.borrow()
+            self.pool = pool
+        except (DBError, PoolTimeoutError) as db_err:
+            print("Database Programming Error in SQL connection processing! ")
+            print(db_err)
+            quit()
+        return self.conn
+
+    def close_connection(self):
+        # hands the connection back to the pool; safe to call more than once
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        pool, self.pool = self.pool, None
+        if isinstance(conn, SharedConnection):
+            return
+        try:
+            pool.release(conn)
+        except DBError as db_err:
+            print("Database Programming Error in SQL connection processing! ")
+            print(db_err)
+            quit()
+
+    def __enter__(self):
+        return self.create_connection()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close_connection()
+        return False
+
+    def share():
+        # with ConnectionManager.share() as shared: every ConnectionManager on this thread uses one connection
+        cm = ConnectionManager()
+        return SharedConnection(cm, cm.create_connection(), cm.get_backend())
+
+    def on_rollback(listener):
+        ConnectionManager.rollback_listeners.append(listener)
+
+    def rolled_back():
+        for listener in list(ConnectionManager.rollback_listeners):
+            listener()
+
+    def pool_stats():
+        if ConnectionManager.pool is None:
+            return {}
+        return ConnectionManager.pool.stats()
+
+    def close_pool():
+        with ConnectionManager.pool_lock:
+            if ConnectionManager.pool is not None:
+                ConnectionManager.pool.close()
+                ConnectionManager.pool = None
+
+
+class SharedConnection:
+    '''
+    one pooled connection reused by every command run on this thread, e.g. by a batch run
+
+    commit() calls of the commands are deferred until flush(), and rollback() only undoes
+    the work done since the last begin_command(); the caches see a command's writes before they
+    are committed, so whatever is rolled back or never flushed is dropped from them as well
+    '''
+
+    def __init__(self, cm, conn, backend):
+        self.cm = cm
+        self.conn = conn
+        self.backend = backend
+        self.commands = 0
+        self.savepoint = None
+        # work not committed by flush() yet
+        self.pending = False
+
+    def __enter__(self):
+        ConnectionManager.local.shared = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ConnectionManager.local.shared = None
+        # anything not flushed is rolled back when the connection goes back to the pool
+        self.cm.close_connection()
+        if self.pending:
+            self.pending = False
+            ConnectionManager.rolled_back()
+        return False
+
+    def cursor(self, as_dict=False):
+        return self.conn.cursor(as_dict=as_dict)
+
+    def begin_command(self):
+        self.commands += 1
+        self.savepoint = f"command_{self.commands}"
+        self.pending = True
+        self.backend.savepoint(self.conn.cursor(), self.savepoint)
+
+    def end_command(self):
+        # the command succeeded, its work stays in the transaction until flush()
+        if self.savepoint is not None:
+            self.backend.release_savepoint(self.conn.cursor(), self.savepoint)
+            self.savepoint = None
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        if self.savepoint is None:
+            self.conn.rollback()
+        else:
+            self.backend.rollback_to_savepoint(self.conn.cursor(), self.savepoint)
+        ConnectionManager.rolled_back()
+
+    def flush(self):
+        self.savepoint = None
+        self.conn.commit()
+        self.pending = False
@@ -0,0 +1,217 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool:
+    '''
+    thread-safe pool of open database connections
+
+    connections are handed out most-recently-used first so that the warm ones get reused,
+    idle ones beyond min_size are closed once they sit unused for idle_timeout seconds,
+    and a connection that has been idle longer than ping_interval is checked before it is lent out
+    '''
+
+    def __init__(self, connect, min_size=1, max_size=10, idle_timeout=300.0,
+                 ping_interval=30.0, borrow_timeout=30.0, ping=None, reset=None):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size!")
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.borrow_timeout = borrow_timeout
+        self.ping = ping if ping is not None else ConnectionPool.default_ping
+        self.reset = reset if reset is not None else ConnectionPool.default_reset
+
+        self.lock = threading.Condition()
+        # (connection, time it was returned to the pool), oldest on the left
+        self.idle = deque()
+        self.size = 0
+        self.waiters = deque()
+        self.closed = False
+        self.counters = {
+            "borrows": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "creations": 0,
+            "releases": 0,
+            "discards": 0,
+            "evictions": 0,
+            "failed_pings": 0,
+            "timeouts": 0,
+        }
+
+    def default_ping(conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+
+    def default_reset(conn):
+        # never hand the next borrower a connection with someone else's open transaction
+        conn.rollback()
+
+    def borrow(self, timeout=None):
+        timeout = self.borrow_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.counters["borrows"] += 1
+        while True:
+            conn, last_used = self._take(deadline)
+            if conn is None:
+                # a free slot was reserved for us, open a new connection outside the lock
+                return self._create()
+            if time.monotonic() - last_used < self.ping_interval:
+                return conn
+            try:
+                self.ping(conn)
+                return conn
+            except Exception:
+                with self.lock:
+                    self.counters["failed_pings"] += 1
+                self._discard(conn)
+
+    def _take(self, deadline):
+        with self.lock:
+            if self.closed:
+                raise PoolTimeoutError("Connection pool is closed")
+            self._evict_idle()
+            if self.waiters or (not self.idle and self.size >= self.max_size):
+                self._wait_turn(deadline)
+            if self.idle:
+                return self.idle.pop()
+            self.size += 1
+            return None, None
+
+    def _wait_turn(self, deadline):
+        # caller holds the lock; borrowers are served first come first served so nobody starves
+        ticket = object()
+        self.waiters.append(ticket)
+        self.counters["waits"] += 1
+        started = time.monotonic()
+        try:
+            while self.waiters[0] is not ticket or (not self.idle and self.size >= self.max_size):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    raise PoolTimeoutError(f"Timed out waiting for a connection (max_size={self.max_size})")
+                self.lock.wait(remaining)
+                if self.closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+        finally:
+            self.waiters.remove(ticket)
+            self.counters["wait_time"] += time.monotonic() - started
+            self.lock.notify_all()
+
+    def _create(self):
+        try:
+            conn = self.connect()
+        except BaseException:
+            with self.lock:
+                self.size -= 1
+                self.lock.notify_all()
+            raise
+        with self.lock:
+            self.counters["creations"] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                self.reset(conn)
+            except Exception:
+                discard = True
+        if discard:
+            self._discard(conn)
+            return
+        with self.lock:
+            self.counters["releases"] += 1
+            if self.closed:
+                self.size -= 1
+                ConnectionPool._close_quietly(conn)
+                return
+            self.idle.append((conn, time.monotonic()))
+            self._evict_idle()
+            self.lock.notify_all()
+
+    def _discard(self, conn):
+        ConnectionPool._close_quietly(conn)
+        with self.lock:
+            self.size -= 1
+            self.counters["discards"] += 1
+            self.lock.notify_all()
+
+    def _evict_idle(self):
+        # caller holds the lock; the oldest idle connections are on the left
+        now = time.monotonic()
+        while self.idle and self.size > self.min_size and now - self.idle[0][1] >= self.idle_timeout:
+            conn, _ = self.idle.popleft()
+            self.size -= 1
+            self.counters["evictions"] += 1
+            ConnectionPool._close_quietly(conn)
+
+    def evict_idle(self):
+        with self.lock:
+            self._evict_idle()
+
+    def fill(self):
+        # open connections up to min_size so the first commands don't pay for the handshake
+        while True:
+            with self.lock:
+                if self.closed or self.size >= self.min_size:
+                    return
+                self.size += 1
+            conn = self._create()
+            with self.lock:
+                self.idle.appendleft((conn, time.monotonic()))
+                self.lock.notify_all()
+
+    def connection(self, timeout=None):
+        return PooledConnection(self, timeout)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["size"] = self.size
+            stats["idle"] = len(self.idle)
+            stats["in_use"] = self.size - len(self.idle)
+            stats["min_size"] = self.min_size
+            stats["max_size"] = self.max_size
+            return stats
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            while self.idle:
+                conn, _ = self.idle.pop()
+                self.size -= 1
+                ConnectionPool._close_quietly(conn)
+            self.lock.notify_all()
+
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class PooledConnection:
+    # with pool.connection() as conn: ... returns the connection to the pool on exit
+    def __init__(self, pool, timeout=None):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.pool.borrow(self.timeout)
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        conn, self.conn = self.conn, None
+        self.pool.release(conn)
+        return False
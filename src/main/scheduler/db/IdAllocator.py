@@ -0,0 +1,67 @@
+import os
+import threading
+from db.Tracing import Tracer
+
+
+class IdAllocator:
+    '''
+    hands out the IDs of table from blocks reserved in the IdBlocks table (hi/lo), so only one ID in
+    block_size costs a round trip
+
+    blocks are reserved on a connection of their own and committed at once, so a block stays taken
+    when the transaction that used its IDs rolls back; IDs of failed reservations and what is left of
+    the block when the process exits are skipped, so IDs are unique but not gapless
+    '''
+    block_size = int(os.getenv("IdBlockSize", "100"))
+
+    def __init__(self, backend, table, column, block_size=None, retry_on=()):
+        self.backend = backend
+        self.table = table
+        self.column = column
+        self.block_size = block_size if block_size is not None else IdAllocator.block_size
+        # errors of a block reservation that are worth one more try, e.g. another process creating the row first
+        self.retry_on = retry_on
+        self.lock = threading.Lock()
+        self.conn = None
+        self.next_id = 1
+        self.last_id = 0
+        self.blocks = 0
+
+    def next(self):
+        with self.lock:
+            if self.next_id > self.last_id:
+                first = self.reserve_block()
+                self.next_id, self.last_id = first, first + self.block_size - 1
+                self.blocks += 1
+            next_id = self.next_id
+            self.next_id += 1
+            return next_id
+
+    def reserve_block(self):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = Tracer.connect(self.backend.connect)
+            try:
+                first = self.backend.allocate_ids(self.conn.cursor(), self.table, self.column, self.block_size)
+                self.conn.commit()
+                return first
+            except self.retry_on:
+                self.conn.rollback()
+                if attempt == 1:
+                    raise
+            except Exception:
+                # the connection may be broken; the next block opens a new one
+                self.disconnect()
+                raise
+
+    def disconnect(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def close(self):
+        with self.lock:
+            self.disconnect()
@@ -0,0 +1,177 @@
+import argparse
+import time
+from db.Tracing import Tracer
+
+
+'''
+ordered schema changes for databases created from an older resources/create.sql
+
+every migration checks what is already there before changing it, so running one again, or on a
+database created from the current create.sql, is harmless. SchemaVersion records the ones applied;
+migrate() runs the rest in version order, each in its own transaction.
+run from src/main/scheduler: python -m db.Migrations [--target N] [--status]
+'''
+
+
+def add_sessions(backend, cursor):
+    if not backend.table_exists(cursor, "Sessions"):
+        cursor.execute("CREATE TABLE Sessions (Token varchar(64), Username varchar(255), Role varchar(16), "
+                       "Expires bigint, PRIMARY KEY (Token))")
+
+
+def add_caregiver_bookings(backend, cursor):
+    if not backend.table_exists(cursor, "CaregiverBookings"):
+        cursor.execute("CREATE TABLE CaregiverBookings (Username varchar(255) REFERENCES Caregivers, Booked int, "
+                       "LastBooked int, PRIMARY KEY (Username))")
+        cursor.execute("INSERT INTO CaregiverBookings (Username, Booked, LastBooked) "
+                       "SELECT CaregiverName, COUNT(*), MAX(ID) FROM Reservations GROUP BY CaregiverName")
+
+
+def add_vaccine_doses(backend, cursor):
+    # the doses of a vaccine move from Vaccines.Doses to shard 0 of VaccineDoses
+    if not backend.table_exists(cursor, "VaccineDoses"):
+        cursor.execute("CREATE TABLE VaccineDoses (Name varchar(255) REFERENCES Vaccines, Shard int, Doses int, "
+                       "PRIMARY KEY (Name, Shard))")
+    if backend.column_exists(cursor, "Vaccines", "Doses"):
+        cursor.execute("INSERT INTO VaccineDoses (Name, Shard, Doses) SELECT v.Name, 0, v.Doses FROM Vaccines v "
+                       "WHERE v.Doses IS NOT NULL AND NOT EXISTS (SELECT 1 FROM VaccineDoses d WHERE d.Name = v.Name)")
+        cursor.execute("ALTER TABLE Vaccines DROP COLUMN Doses")
+
+
+def add_id_blocks(backend, cursor):
+    # the row of a table is created by its first allocation, after the largest ID already used
+    if not backend.table_exists(cursor, "IdBlocks"):
+        cursor.execute("CREATE TABLE IdBlocks (Name varchar(255), NextValue int, PRIMARY KEY (Name))")
+
+
+def add_reservation_indexes(backend, cursor):
+    # show_appointments reads the reservations of one patient or caregiver in ID order; with every other
+    # column in the index it's a range seek without lookups into the table
+    indexes = [
+        ("IX_Reservations_Patient", ["PatientName", "ID"], ["VaccineName", "Time", "CaregiverName"]),
+        ("IX_Reservations_Caregiver", ["CaregiverName", "ID"], ["VaccineName", "Time", "PatientName"]),
+    ]
+    for name, columns, include in indexes:
+        if not backend.index_exists(cursor, "Reservations", name):
+            backend.create_index(cursor, name, "Reservations", columns, include)
+
+
+def add_waitlist(backend, cursor):
+    if not backend.table_exists(cursor, "Waitlist"):
+        cursor.execute("CREATE TABLE Waitlist (ID int, PatientName varchar(255) REFERENCES Patients (Username), "
+                       "VaccineName varchar(255), StartDate date, EndDate date, PRIMARY KEY (ID))")
+    # the matcher reads the oldest entries of some vaccines, show_appointments those of one patient
+    for name, columns in (("IX_Waitlist_Vaccine", ["VaccineName", "ID"]), ("IX_Waitlist_Patient", ["PatientName", "ID"])):
+        if not backend.index_exists(cursor, "Waitlist", name):
+            backend.create_index(cursor, name, "Waitlist", columns)
+
+
+def add_utilization(backend, cursor):
+    created = False
+    if not backend.table_exists(cursor, "DailyUtilization"):
+        cursor.execute("CREATE TABLE DailyUtilization (Time date, OpenSlots int, Booked int, PRIMARY KEY (Time))")
+        created = True
+    if not backend.table_exists(cursor, "DailyVaccineUtilization"):
+        cursor.execute("CREATE TABLE DailyVaccineUtilization (Time date, VaccineName varchar(255), Booked int, "
+                       "PRIMARY KEY (Time, VaccineName))")
+        created = True
+    if created:
+        backend.rebuild_utilization(cursor)
+
+
+def last_booked_time(backend, cursor):
+    # LastBooked becomes the time of the last booking in microseconds since 1970 instead of the ID of the
+    # last appointment; the IDs stored so far are all smaller than any such time, so those caregivers
+    # keep their order among themselves and come before every caregiver booked from now on
+    backend.alter_column_type(cursor, "CaregiverBookings", "LastBooked", "bigint")
+
+
+def unique_waitlist_entries(backend, cursor):
+    # a patient waits once per vaccine; of entries that slipped in twice the oldest keeps its place
+    if not backend.index_exists(cursor, "Waitlist", "UX_Waitlist_PatientVaccine"):
+        cursor.execute("DELETE FROM Waitlist WHERE EXISTS (SELECT 1 FROM Waitlist w WHERE w.PatientName = Waitlist.PatientName "
+                       "AND w.VaccineName = Waitlist.VaccineName AND w.ID < Waitlist.ID)")
+        backend.create_index(cursor, "UX_Waitlist_PatientVaccine", "Waitlist", ["PatientName", "VaccineName"], unique=True)
+
+
+# (version, name, apply), in the order they were added; never renumber or change an applied one
+migrations = [
+    (1, "sessions", add_sessions),
+    (2, "caregiver_bookings", add_caregiver_bookings),
+    (3, "vaccine_doses", add_vaccine_doses),
+    (4, "id_blocks", add_id_blocks),
+    (5, "reservation_indexes", add_reservation_indexes),
+    (6, "waitlist", add_waitlist),
+    (7, "utilization", add_utilization),
+    (8, "last_booked_time", last_booked_time),
+    (9, "unique_waitlist_entries", unique_waitlist_entries),
+]
+
+
+def latest_version():
+    return migrations[-1][0]
+
+
+def current_version(backend, cursor):
+    if not backend.table_exists(cursor, "SchemaVersion"):
+        return 0
+    cursor.execute("SELECT MAX(Version) FROM SchemaVersion")
+    row = cursor.fetchone()
+    return row[0] if row is not None and row[0] is not None else 0
+
+
+# applies the migrations after the recorded version up to target (all by default);
+# returns the (version, name) of those applied
+def migrate(backend, target=None):
+    target = target if target is not None else latest_version()
+    applied = []
+    conn = Tracer.connect(backend.connect)
+    try:
+        cursor = conn.cursor()
+        if not backend.table_exists(cursor, "SchemaVersion"):
+            cursor.execute("CREATE TABLE SchemaVersion (Version int, Name varchar(255), Applied bigint, PRIMARY KEY (Version))")
+            conn.commit()
+        version = current_version(backend, cursor)
+        for number, name, apply in migrations:
+            if number <= version or number > target:
+                continue
+            try:
+                apply(backend, cursor)
+                cursor.execute("INSERT INTO SchemaVersion (Version, Name, Applied) VALUES (%d, %s, %d)",
+                               (number, name, int(time.time())))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                # another process may have applied it first
+                if current_version(backend, cursor) >= number:
+                    continue
+                raise
+            applied.append((number, name))
+        return applied
+    finally:
+        conn.close()
+
+
+def main():
+    # not at the top: Backend imports this module, and ConnectionManager imports Backend
+    from db.ConnectionManager import ConnectionManager
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", type=int, default=None, help="migrate up to this version, default the latest")
+    parser.add_argument("--status", action="store_true", help="only print the recorded and latest versions")
+    args = parser.parse_args()
+
+    backend = ConnectionManager().get_backend()
+    if not args.status:
+        for number, name in migrate(backend, args.target):
+            print(f"applied {number} {name}")
+    conn = backend.connect()
+    try:
+        version = current_version(backend, conn.cursor())
+    finally:
+        conn.close()
+    print(f"schema version {version}, latest {latest_version()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import os
+import sys
+import threading
+import time
+
+
+class TraceRecord:
+    # kind is "connect", "execute", "executemany", "commit", "rollback", "close" or "command"
+    def __init__(self, kind, statement=None, params=0, rows=None, elapsed=0.0, command=None):
+        self.kind = kind
+        self.statement = statement
+        self.params = params
+        self.rows = rows
+        self.elapsed = elapsed
+        self.command = command
+        self.slow = False
+        # for "command" records: database calls and time spent in them while the command ran
+        self.round_trips = 0
+
+    def __str__(self):
+        command = f"[{self.command}] " if self.command else ""
+        if self.kind == "command":
+            return (f"{command}{self.round_trips} round trips, {self.rows} rows, "
+                    f"{self.elapsed * 1000:.2f} ms in the database")
+        statement = " ".join(self.statement.split()) if self.statement else ""
+        rows = f" rows={self.rows}" if self.rows is not None else ""
+        slow = "SLOW " if self.slow else ""
+        return f"{command}{slow}{self.kind} {self.elapsed * 1000:.2f} ms params={self.params}{rows} {statement}".rstrip()
+
+
+class StreamSink:
+    # writes slow statements and per-command summaries, or every record with all_statements
+    def __init__(self, stream=None, all_statements=False):
+        self.stream = stream if stream is not None else sys.stderr
+        self.all_statements = all_statements
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        if record.kind == "command" or record.slow or self.all_statements:
+            with self.lock:
+                print(str(record), file=self.stream, flush=True)
+
+
+class MemorySink:
+    # keeps every record, e.g. for benchmarks
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        with self.lock:
+            self.records.append(record)
+
+
+class Tracer:
+    '''
+    times every database call made through a TracingConnection and hands a TraceRecord to sink
+
+    sink is any callable taking a TraceRecord; tracing is off while it is None.
+    statements at or above slow_threshold seconds are flagged slow
+    '''
+    sink = None
+    slow_threshold = 0.1
+    local = threading.local()
+
+    def configure(sink, slow_threshold=None):
+        Tracer.sink = sink
+        if slow_threshold is not None:
+            Tracer.slow_threshold = slow_threshold
+
+    def configure_from_env():
+        # SQLTrace=stderr or a file path, SQLTraceAll=1 to log every statement, SlowQueryMs=threshold
+        target = os.getenv("SQLTrace")
+        if not target:
+            return
+        stream = sys.stderr if target == "stderr" else open(target, "a")
+        Tracer.configure(StreamSink(stream, all_statements=os.getenv("SQLTraceAll") == "1"),
+                         float(os.getenv("SlowQueryMs", "100")) / 1000.0)
+
+    def emit(record):
+        sink = Tracer.sink
+        if sink is None:
+            return
+        summary = getattr(Tracer.local, "summary", None)
+        if summary is not None:
+            record.command = summary.command
+            if record.kind != "close":
+                summary.round_trips += 1
+            summary.elapsed += record.elapsed
+            if record.kind in ("execute", "executemany") and record.rows is not None and record.rows > 0:
+                summary.rows += record.rows
+        record.slow = record.kind != "command" and record.elapsed >= Tracer.slow_threshold
+        sink(record)
+
+    # brackets a command so its database calls are summed into one "command" record
+    def begin_command(name):
+        if Tracer.sink is None:
+            Tracer.local.summary = None
+            return
+        summary = TraceRecord("command", rows=0, command=name)
+        Tracer.local.summary = summary
+
+    def end_command():
+        Tracer.flush_pending()
+        summary = getattr(Tracer.local, "summary", None)
+        Tracer.local.summary = None
+        if summary is not None and Tracer.sink is not None:
+            Tracer.sink(summary)
+        return summary
+
+    # reports the statements of this thread whose results were not read to the end
+    def flush_pending():
+        cursors = getattr(Tracer.local, "pending", None)
+        Tracer.local.pending = []
+        for cursor in cursors or []:
+            cursor.flush()
+
+    def connect(connect):
+        started = time.perf_counter()
+        conn = connect()
+        Tracer.emit(TraceRecord("connect", elapsed=time.perf_counter() - started))
+        return TracingConnection(conn)
+
+
+def _param_count(params):
+    if params is None:
+        return 0
+    if isinstance(params, (tuple, list, dict)):
+        return len(params)
+    return 1
+
+
+class TracingConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, as_dict=False):
+        return TracingCursor(self.conn.cursor(as_dict=as_dict))
+
+    def _timed(self, kind, call):
+        if Tracer.sink is None:
+            return call()
+        # results left unread are reported before the transaction ends
+        Tracer.flush_pending()
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            Tracer.emit(TraceRecord(kind, elapsed=time.perf_counter() - started))
+
+    def commit(self):
+        return self._timed("commit", self.conn.commit)
+
+    def rollback(self):
+        return self._timed("rollback", self.conn.rollback)
+
+    def close(self):
+        return self._timed("close", self.conn.close)
+
+
+class TracingCursor:
+    '''
+    the record of a query is emitted once its results are read to the end, the next statement
+    runs, the transaction ends or the command ends, so it can count the rows returned;
+    other statements are reported right away with the rows they changed
+    '''
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.pending = None
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def in_transaction(self):
+        # SQLite cursors only, see SQLiteBackend.savepoint
+        return self.cursor.in_transaction
+
+    def flush(self):
+        record, self.pending = self.pending, None
+        if record is not None:
+            Tracer.emit(record)
+
+    def _execute(self, kind, call, operation, params):
+        if Tracer.sink is None:
+            return call()
+        self.flush()
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            record = TraceRecord(kind, operation, params, 0, time.perf_counter() - started)
+            if self.cursor.description is None:
+                record.rows = self.cursor.rowcount
+                Tracer.emit(record)
+            else:
+                self.pending = record
+                if not hasattr(Tracer.local, "pending"):
+                    Tracer.local.pending = []
+                Tracer.local.pending.append(self)
+
+    def execute(self, operation, params=None):
+        return self._execute("execute", lambda: self.cursor.execute(operation, params), operation, _param_count(params))
+
+    def executemany(self, operation, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        return self._execute("executemany", lambda: self.cursor.executemany(operation, seq_of_params),
+                             operation, len(seq_of_params))
+
+    def _fetched(self, rows, started, done):
+        if self.pending is not None:
+            self.pending.rows += rows
+            self.pending.elapsed += time.perf_counter() - started
+            if done:
+                self.flush()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self.cursor.fetchone()
+        self._fetched(0 if row is None else 1, started, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = self.cursor.fetchmany(size) if size is not None else self.cursor.fetchmany()
+        self._fetched(len(rows), started, not rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self.cursor.fetchall()
+        self._fetched(len(rows), started, True)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        self.flush()
+        self.cursor.close()
@@ -0,0 +1,118 @@
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Backend import column
+import bisect
+import os
+import threading
+import time
+
+
+class AvailabilityIndex:
+    '''
+    in-memory calendar of the Availabilities table: date -> sorted caregiver usernames
+
+    loaded with one scan on first use and kept current by upload_availability, reserve and cancel;
+    the whole index is reloaded after ttl seconds to pick up writes from other processes
+    '''
+    ttl = float(os.getenv("AvailabilityIndexTTL", "60"))
+    # scans ensure_loaded() tries while writes race with them before it answers from one it doesn't keep
+    load_attempts = 3
+    lock = threading.Lock()
+    caregivers = {}
+    # the keys of caregivers, sorted, for range lookups
+    dates = []
+    loaded = None
+    generation = 0
+
+    # one scan of the table: date -> sorted caregivers
+    def scan():
+        calendar = {}
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT Time, Username FROM Availabilities ORDER BY Time, Username")
+            for row in cursor:
+                calendar.setdefault(column(row, "Time", 0), []).append(column(row, "Username", 1))
+        finally:
+            cm.close_connection()
+        return calendar
+
+    # (caregivers, dates) to answer from, read them under the lock: the index when it is current, after
+    # loading it if needed. a write that happened during a scan may be missing from it, so such a scan
+    # isn't kept; when writes race with every attempt the last scan answers this one call
+    def ensure_loaded():
+        for _ in range(AvailabilityIndex.load_attempts):
+            with AvailabilityIndex.lock:
+                if AvailabilityIndex.loaded is not None and time.monotonic() - AvailabilityIndex.loaded < AvailabilityIndex.ttl:
+                    return AvailabilityIndex.caregivers, AvailabilityIndex.dates
+                generation = AvailabilityIndex.generation
+
+            loaded = time.monotonic()
+            calendar = AvailabilityIndex.scan()
+            dates = sorted(calendar)
+
+            with AvailabilityIndex.lock:
+                if generation == AvailabilityIndex.generation:
+                    AvailabilityIndex.caregivers = calendar
+                    AvailabilityIndex.dates = dates
+                    AvailabilityIndex.loaded = loaded
+                    return calendar, dates
+        return calendar, dates
+
+    # sorted caregivers available on date
+    def get(date):
+        caregivers, _ = AvailabilityIndex.ensure_loaded()
+        with AvailabilityIndex.lock:
+            return list(caregivers.get(date, []))
+
+    # (date, sorted caregivers) for every date from start to end inclusive that has a caregiver
+    def between(start, end):
+        caregivers, dates = AvailabilityIndex.ensure_loaded()
+        with AvailabilityIndex.lock:
+            found = []
+            for i in range(bisect.bisect_left(dates, start), len(dates)):
+                if dates[i] > end:
+                    break
+                found.append((dates[i], list(caregivers[dates[i]])))
+            return found
+
+    def add(dates, username):
+        with AvailabilityIndex.lock:
+            AvailabilityIndex.generation += 1
+            if AvailabilityIndex.loaded is None:
+                return
+            for date in dates:
+                caregivers = AvailabilityIndex.caregivers.get(date)
+                if caregivers is None:
+                    AvailabilityIndex.caregivers[date] = [username]
+                    bisect.insort(AvailabilityIndex.dates, date)
+                    continue
+                i = bisect.bisect_left(caregivers, username)
+                if i == len(caregivers) or caregivers[i] != username:
+                    caregivers.insert(i, username)
+
+    def remove(date, username):
+        with AvailabilityIndex.lock:
+            AvailabilityIndex.generation += 1
+            if AvailabilityIndex.loaded is None:
+                return
+            caregivers = AvailabilityIndex.caregivers.get(date)
+            if caregivers is None:
+                return
+            i = bisect.bisect_left(caregivers, username)
+            if i < len(caregivers) and caregivers[i] == username:
+                del caregivers[i]
+            if not caregivers:
+                del AvailabilityIndex.caregivers[date]
+                del AvailabilityIndex.dates[bisect.bisect_left(AvailabilityIndex.dates, date)]
+
+    def invalidate():
+        with AvailabilityIndex.lock:
+            AvailabilityIndex.generation += 1
+            AvailabilityIndex.loaded = None
+
+
+# a batch run that rolls a command back may have told the cache about its writes already
+ConnectionManager.on_rollback(AvailabilityIndex.invalidate)
@@ -1,83 +1,137 @@
-import sys
-sys.path.append("../util/*")
-sys.path.append("../db/*")
-from util.Util import Util
-from db.ConnectionManager import ConnectionManager
-import pymssql
-
-
-class Caregiver:
-    def __init__(self, username, password=None, salt=None, hash=None):
-        self.username = username
-        self.password = password
-        self.salt = salt
-        self.hash = hash
-
-    # getters
-    def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-
-        get_caregiver_details = "SELECT Salt, Hash FROM Caregivers WHERE Username = %s"
-        try:
-            cursor.execute(get_caregiver_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
-                    # print("Incorrect password")
-                    cm.close_connection()
-                    return None
-                else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
-            raise e
-        finally:
-            cm.close_connection()
-        return None
-
-    def get_username(self):
-        return self.username
-
-    def get_salt(self):
-        return self.salt
-
-    def get_hash(self):
-        return self.hash
-
-    def save_to_db(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_caregivers = "INSERT INTO Caregivers VALUES (%s, %s, %s)"
-        try:
-            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            raise
-        finally:
-            cm.close_connection()
-
-    # Insert availability with parameter date d
-    def upload_availability(self, d):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_availability = "INSERT INTO Availabilities VALUES (%s , %s)"
-        try:
-            cursor.execute(add_availability, (d, self.username))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when updating caregiver availability")
-            raise
-        finally:
-            cm.close_connection()
+import sys
+sys.path.append("../util/*")
+sys.path.append("../db/*")
+from util.HashService import HashService
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DBError, IntegrityError, column
+from model.AvailabilityIndex import AvailabilityIndex
+
+
+class Caregiver:
+    # dates per INSERT statement when uploading availability in bulk
+    upload_chunk_size = 500
+    # accounts per INSERT statement when saving in bulk
+    save_chunk_size = 500
+
+    def __init__(self, username, password=None, salt=None, hash=None):
+        self.username = username
+        self.password = password
+        self.salt = salt
+        self.hash = hash
+
+    # getters
+    def get(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor(as_dict=True)
+
+        get_caregiver_details = "SELECT Salt, Hash FROM Caregivers WHERE Username = %s"
+        try:
+            cursor.execute(get_caregiver_details, self.username)
+            for row in cursor:
+                curr_salt = row['Salt']
+                curr_hash = row['Hash']
+                calculated_hash = HashService.get().hash(self.password, curr_salt)
+                if not curr_hash == calculated_hash:
+                    # print("Incorrect password")
+                    cm.close_connection()
+                    return None
+                else:
+                    self.salt = curr_salt
+                    self.hash = calculated_hash
+                    cm.close_connection()
+                    return self
+        except DBError as e:
+            raise e
+        finally:
+            cm.close_connection()
+        return None
+
+    def get_username(self):
+        return self.username
+
+    def get_salt(self):
+        return self.salt
+
+    def get_hash(self):
+        return self.hash
+
+    # returns False without saving if the username is taken, which the primary key reports
+    def save_to_db(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        add_caregivers = "INSERT INTO Caregivers VALUES (%s, %s, %s)"
+        try:
+            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except IntegrityError:
+            conn.rollback()
+            return False
+        except DBError:
+            raise
+        finally:
+            cm.close_connection()
+        return True
+
+    # Insert many caregivers in one transaction, e.g. with credentials from HashService.create_credentials
+    # usernames that are already taken are skipped; returns the usernames inserted
+    def save_many(caregivers):
+        unique = {}
+        for caregiver in caregivers:
+            unique.setdefault(caregiver.username, caregiver)
+        caregivers = list(unique.values())
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        inserted = []
+        try:
+            for start in range(0, len(caregivers), Caregiver.save_chunk_size):
+                chunk = caregivers[start:start + Caregiver.save_chunk_size]
+                names = ", ".join(["%s"] * len(chunk))
+                cursor.execute(f"SELECT Username FROM Caregivers WHERE Username IN ({names})", tuple(caregiver.username for caregiver in chunk))
+                taken = {column(row, "Username") for row in cursor.fetchall()}
+                new = [caregiver for caregiver in chunk if caregiver.username not in taken]
+                if not new:
+                    continue
+                add_caregivers = "INSERT INTO Caregivers VALUES " + ", ".join(["(%s, %s, %s)"] * len(new))
+                cursor.execute(add_caregivers, tuple(value for caregiver in new for value in (caregiver.username, caregiver.salt, caregiver.hash)))
+                inserted += [caregiver.username for caregiver in new]
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DBError:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+        return inserted
+
+    # Insert availability for date d, or for every date of a list of dates, in one transaction
+    # dates that are already uploaded or booked are skipped; returns the number of dates inserted
+    def upload_availability(self, d):
+        dates = list(dict.fromkeys(d)) if isinstance(d, (list, tuple)) else [d]
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        inserted = []
+        try:
+            for start in range(0, len(dates), Caregiver.upload_chunk_size):
+                chunk = dates[start:start + Caregiver.upload_chunk_size]
+                # one multi-row INSERT ... SELECT per chunk, counted in DailyUtilization in the same transaction
+                inserted += [date for date, _ in cm.get_backend().add_availability(cursor, [(date, self.username) for date in chunk])]
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DBError:
+            # print("Error occurred when updating caregiver availability")
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+        AvailabilityIndex.add(inserted, self.username)
+        return len(inserted)
@@ -1,66 +1,108 @@
-import sys
-sys.path.append("../util/*")
-sys.path.append("../db/*")
-from util.Util import Util
-from db.ConnectionManager import ConnectionManager
-import pymssql
-
-
-class Patient:
-    def __init__(self, username, password=None, salt=None, hash=None):
-        self.username = username
-        self.password = password
-        self.salt = salt
-        self.hash = hash
-
-    # getters
-    def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-
-        get_patient_details = "SELECT Salt, Hash FROM Patients WHERE Username = %s"
-        try:
-            cursor.execute(get_patient_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
-                    # print("Incorrect password")
-                    cm.close_connection()
-                    return None
-                else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
-            raise e
-        finally:
-            cm.close_connection()
-        return None
-
-    def get_username(self):
-        return self.username
-
-    def get_salt(self):
-        return self.salt
-
-    def get_hash(self):
-        return self.hash
-
-    def save_to_db(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_patients = "INSERT INTO Patients VALUES (%s, %s, %s)"
-        try:
-            cursor.execute(add_patients, (self.username, self.salt, self.hash))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            raise
-        finally:
-            cm.close_connection()
+import sys
+sys.path.append("../util/*")
+sys.path.append("../db/*")
+from util.HashService import HashService
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DBError, IntegrityError, column
+
+
+class Patient:
+    # accounts per INSERT statement when saving in bulk
+    save_chunk_size = 500
+
+    def __init__(self, username, password=None, salt=None, hash=None):
+        self.username = username
+        self.password = password
+        self.salt = salt
+        self.hash = hash
+
+    # getters
+    def get(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor(as_dict=True)
+
+        get_patient_details = "SELECT Salt, Hash FROM Patients WHERE Username = %s"
+        try:
+            cursor.execute(get_patient_details, self.username)
+            for row in cursor:
+                curr_salt = row['Salt']
+                curr_hash = row['Hash']
+                calculated_hash = HashService.get().hash(self.password, curr_salt)
+                if not curr_hash == calculated_hash:
+                    # print("Incorrect password")
+                    cm.close_connection()
+                    return None
+                else:
+                    self.salt = curr_salt
+                    self.hash = calculated_hash
+                    cm.close_connection()
+                    return self
+        except DBError as e:
+            raise e
+        finally:
+            cm.close_connection()
+        return None
+
+    def get_username(self):
+        return self.username
+
+    def get_salt(self):
+        return self.salt
+
+    def get_hash(self):
+        return self.hash
+
+    # returns False without saving if the username is taken, which the primary key reports
+    def save_to_db(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        add_patients = "INSERT INTO Patients VALUES (%s, %s, %s)"
+        try:
+            cursor.execute(add_patients, (self.username, self.salt, self.hash))
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except IntegrityError:
+            conn.rollback()
+            return False
+        except DBError:
+            raise
+        finally:
+            cm.close_connection()
+        return True
+
+    # Insert many patients in one transaction, e.g. with credentials from HashService.create_credentials
+    # usernames that are already taken are skipped; returns the usernames inserted
+    def save_many(patients):
+        unique = {}
+        for patient in patients:
+            unique.setdefault(patient.username, patient)
+        patients = list(unique.values())
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        inserted = []
+        try:
+            for start in range(0, len(patients), Patient.save_chunk_size):
+                chunk = patients[start:start + Patient.save_chunk_size]
+                names = ", ".join(["%s"] * len(chunk))
+                cursor.execute(f"SELECT Username FROM Patients WHERE Username IN ({names})", tuple(patient.username for patient in chunk))
+                taken = {column(row, "Username") for row in cursor.fetchall()}
+                new = [patient for patient in chunk if patient.username not in taken]
+                if not new:
+                    continue
+                add_patients = "INSERT INTO Patients VALUES " + ", ".join(["(%s, %s, %s)"] * len(new))
+                cursor.execute(add_patients, tuple(value for patient in new for value in (patient.username, patient.salt, patient.hash)))
+                inserted += [patient.username for patient in new]
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DBError:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+        return inserted
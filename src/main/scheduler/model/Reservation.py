@@ -0,0 +1,69 @@
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Backend import column
+import os
+
+
+class Reservation:
+    # rows pulled from the cursor at a time while streaming
+    fetch_size = 500
+    # the same for between(), which reads far more rows
+    export_fetch_size = int(os.getenv("ExportFetchSize", "5000"))
+
+    def __init__(self, appointment_id, vaccine_name, time, patient_name, caregiver_name):
+        self.appointment_id = appointment_id
+        self.vaccine_name = vaccine_name
+        self.time = time
+        self.patient_name = patient_name
+        self.caregiver_name = caregiver_name
+
+    # streams the reservations of a caregiver or patient in ID order, keyset paginated:
+    # only IDs greater than after, only dates from from_date on, at most limit rows.
+    # the connection is held until the generator is exhausted or closed
+    def stream(username, caregiver=False, from_date=None, after=None, limit=None):
+        owner = "CaregiverName" if caregiver else "PatientName"
+        top = f"TOP {int(limit)} " if limit is not None else ""
+        select_appointments = f"SELECT {top}ID, VaccineName, Time, PatientName, CaregiverName FROM Reservations WHERE {owner} = %s"
+        params = [username]
+        if after is not None:
+            select_appointments += " AND ID > %s"
+            params.append(after)
+        if from_date is not None:
+            select_appointments += " AND Time >= %s"
+            params.append(from_date)
+        select_appointments += " ORDER BY ID"
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(select_appointments, tuple(params))
+            while True:
+                rows = cursor.fetchmany(Reservation.fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield Reservation(column(row, "ID", 0), column(row, "VaccineName", 1), column(row, "Time", 2),
+                                      column(row, "PatientName", 3), column(row, "CaregiverName", 4))
+        finally:
+            cm.close_connection()
+
+    # streams every reservation from start to end (both included) in ID order, export_fetch_size rows at a time,
+    # so memory stays flat however many there are; the connection is held until the generator is exhausted or closed
+    def between(start, end):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ID, VaccineName, Time, PatientName, CaregiverName FROM Reservations "
+                           "WHERE Time >= %s AND Time <= %s ORDER BY ID", (start, end))
+            while True:
+                rows = cursor.fetchmany(Reservation.export_fetch_size)
+                if not rows:
+                    break
+                # a tuple cursor, so rows unpack without column() per value
+                for appointment_id, vaccine_name, time, patient_name, caregiver_name in rows:
+                    yield Reservation(appointment_id, vaccine_name, time, patient_name, caregiver_name)
+        finally:
+            cm.close_connection()
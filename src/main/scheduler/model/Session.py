@@ -0,0 +1,82 @@
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DBError, column
+import hashlib
+import os
+import secrets
+import time
+
+
+class Session:
+    # seconds a session token stays valid
+    ttl = int(os.getenv("SessionTTL", "28800"))
+
+    def __init__(self, token, username=None, role=None, expires=None):
+        self.token = token
+        self.username = username
+        self.role = role
+        self.expires = expires
+
+    # only a digest of the token is stored, so the Sessions table can't be used to log in
+    def digest(token):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    # issues a new token for username logged in as role ("patient" or "caregiver")
+    def create(username, role):
+        session = Session(secrets.token_hex(32), username, role, int(time.time()) + Session.ttl)
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        add_session = "INSERT INTO Sessions VALUES (%s, %s, %s, %s)"
+        try:
+            cursor.execute(add_session, (Session.digest(session.token), session.username, session.role, session.expires))
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DBError:
+            raise
+        finally:
+            cm.close_connection()
+        return session
+
+    # looks the token up by primary key; returns None if it is unknown or expired
+    def get(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor(as_dict=True)
+
+        get_session = "SELECT Username, Role, Expires FROM Sessions WHERE Token = %s"
+        try:
+            cursor.execute(get_session, Session.digest(self.token))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            if column(row, "Expires", 2) <= time.time():
+                cursor.execute("DELETE FROM Sessions WHERE Token = %s", Session.digest(self.token))
+                conn.commit()
+                return None
+            self.username = column(row, "Username", 0)
+            self.role = column(row, "Role", 1)
+            self.expires = column(row, "Expires", 2)
+            return self
+        except DBError:
+            raise
+        finally:
+            cm.close_connection()
+
+    def revoke(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        delete_session = "DELETE FROM Sessions WHERE Token = %s"
+        try:
+            cursor.execute(delete_session, Session.digest(self.token))
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DBError:
+            raise
+        finally:
+            cm.close_connection()
@@ -0,0 +1,96 @@
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DBError, UTILIZATION_DAYS, UTILIZATION_VACCINE_DAYS, as_date, column
+
+
+class Utilization:
+    '''
+    one day of the DailyUtilization summary: open caregiver slots, bookings, and bookings per vaccine
+
+    the summary tables are updated in the same transactions as Availabilities and Reservations, so reading
+    them costs one range seek per table instead of aggregating the base tables
+    '''
+
+    def __init__(self, date, open_slots, booked, vaccines=None):
+        self.date = date
+        self.open_slots = open_slots
+        self.booked = booked
+        # vaccine name -> bookings
+        self.vaccines = vaccines if vaccines is not None else {}
+
+    # the days from start to end (both included) with open slots or bookings
+    def between(start, end):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("SELECT Time, OpenSlots, Booked FROM DailyUtilization WHERE Time >= %s AND Time <= %s "
+                           "AND (OpenSlots <> 0 OR Booked <> 0) ORDER BY Time", (start, end))
+            days = {}
+            for row in cursor.fetchall():
+                date = column(row, "Time", 0)
+                days[date] = Utilization(date, column(row, "OpenSlots", 1), column(row, "Booked", 2))
+            cursor.execute("SELECT Time, VaccineName, Booked FROM DailyVaccineUtilization WHERE Time >= %s AND Time <= %s "
+                           "AND Booked <> 0 ORDER BY Time, VaccineName", (start, end))
+            for row in cursor.fetchall():
+                day = days.get(column(row, "Time", 0))
+                if day is not None:
+                    day.vaccines[column(row, "VaccineName", 1)] = column(row, "Booked", 2)
+            return list(days.values())
+        finally:
+            cm.close_connection()
+
+    # recomputes the summaries from the base tables; returns the number of days
+    def rebuild():
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        try:
+            cm.get_backend().rebuild_utilization(cursor)
+            cursor.execute("SELECT COUNT(*) FROM DailyUtilization")
+            days = cursor.fetchone()[0]
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+            return days
+        except DBError:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+
+    # compares the summaries with the base tables without changing them;
+    # returns (date, vaccine name or None for the day, counter, expected, stored) for every difference
+    def verify():
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(UTILIZATION_DAYS)
+            expected = {}
+            for row in cursor.fetchall():
+                expected[(as_date(row[0]), None, "open")] = row[1]
+                expected[(as_date(row[0]), None, "booked")] = row[2]
+            cursor.execute(UTILIZATION_VACCINE_DAYS)
+            for row in cursor.fetchall():
+                expected[(as_date(row[0]), row[1], "booked")] = row[2]
+            stored = {}
+            cursor.execute("SELECT Time, OpenSlots, Booked FROM DailyUtilization")
+            for row in cursor.fetchall():
+                stored[(row[0], None, "open")] = row[1]
+                stored[(row[0], None, "booked")] = row[2]
+            cursor.execute("SELECT Time, VaccineName, Booked FROM DailyVaccineUtilization")
+            for row in cursor.fetchall():
+                stored[(row[0], row[1], "booked")] = row[2]
+        finally:
+            cm.close_connection()
+
+        # a summary row counted down to 0 matches a day that is gone from the base tables
+        differences = []
+        for key in sorted(set(expected) | set(stored), key=lambda key: (key[0], key[1] or "", key[2])):
+            if expected.get(key, 0) != stored.get(key, 0):
+                differences.append(key + (expected.get(key, 0), stored.get(key, 0)))
+        return differences
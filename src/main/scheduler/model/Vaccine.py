@@ -1,99 +1,161 @@
-import sys
-sys.path.append("../db/*")
-from db.ConnectionManager import ConnectionManager
-import pymssql
-
-
-class Vaccine:
-    def __init__(self, vaccine_name, available_doses):
-        self.vaccine_name = vaccine_name
-        self.available_doses = available_doses
-
-    # getters
-    def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        get_vaccine = "SELECT Name, Doses FROM Vaccines WHERE Name = %s"
-        try:
-            cursor.execute(get_vaccine, self.vaccine_name)
-            for row in cursor:
-                self.available_doses = row[1]
-                return self
-        except pymssql.Error:
-            # print("Error occurred when getting Vaccine")
-            raise
-        finally:
-            cm.close_connection()
-        return None
-
-    def get_vaccine_name(self):
-        return self.vaccine_name
-
-    def get_available_doses(self):
-        return self.available_doses
-
-    def save_to_db(self):
-        if self.available_doses is None or self.available_doses <= 0:
-            raise ValueError("Argument cannot be negative!")
-
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_doses = "INSERT INTO VACCINES VALUES (%s, %d)"
-        try:
-            cursor.execute(add_doses, (self.vaccine_name, self.available_doses))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when insert Vaccines")
-            raise
-        finally:
-            cm.close_connection()
-
-    # Increment the available doses
-    def increase_available_doses(self, num):
-        if num <= 0:
-            raise ValueError("Argument cannot be negative!")
-        self.available_doses += num
-
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
-        try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when updating vaccine availability")
-            raise
-        finally:
-            cm.close_connection()
-
-    # Decrement the available doses
-    def decrease_available_doses(self, num):
-        if self.available_doses - num < 0:
-            ValueError("Not enough available doses!")
-        self.available_doses -= num
-
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
-        try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when updating vaccine availability")
-            raise
-        finally:
-            cm.close_connection()
-
-    def __str__(self):
-        return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DBError, column
+from model.VaccineCache import VaccineCache
+import os
+import random
+
+
+class Vaccine:
+    # VaccineDoses rows per MERGE statement when adding a shipment
+    merge_chunk_size = 500
+    # VaccineDoses rows new doses are spread over; reserve takes a dose from a random non-empty one
+    shards = int(os.getenv("DoseShards", "8"))
+
+    def __init__(self, vaccine_name, available_doses):
+        self.vaccine_name = vaccine_name
+        self.available_doses = available_doses
+
+    # getters
+    # served from VaccineCache, which reads through to the database when its entry is stale
+    def get(self):
+        doses = VaccineCache.get(self.vaccine_name)
+        if doses is None:
+            return None
+        self.available_doses = doses
+        return self
+
+    def get_vaccine_name(self):
+        return self.vaccine_name
+
+    def get_available_doses(self):
+        return self.available_doses
+
+    # splits doses evenly over the shards, as a list of (shard, doses) without empty parts;
+    # the remainder starts at a random shard so small additions don't all land on the first one
+    def spread(doses):
+        share, extra = divmod(doses, Vaccine.shards)
+        first = random.randrange(Vaccine.shards)
+        parts = []
+        for shard in range(Vaccine.shards):
+            part = share + (1 if (shard - first) % Vaccine.shards < extra else 0)
+            if part > 0:
+                parts.append((shard, part))
+        return parts
+
+    def save_to_db(self):
+        if self.available_doses is None or self.available_doses <= 0:
+            raise ValueError("Argument cannot be negative!")
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        add_vaccine = "INSERT INTO Vaccines VALUES (%s)"
+        try:
+            cursor.execute(add_vaccine, self.vaccine_name)
+            cm.get_backend().merge_doses(cursor, [(self.vaccine_name, shard, doses) for shard, doses in Vaccine.spread(self.available_doses)])
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DBError:
+            # print("Error occurred when insert Vaccines")
+            raise
+        finally:
+            cm.close_connection()
+        VaccineCache.invalidate(self.vaccine_name)
+
+    # Increment the available doses
+    def increase_available_doses(self, num):
+        if num <= 0:
+            raise ValueError("Argument cannot be negative!")
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        # increment in place so concurrent updates are not lost
+        try:
+            cm.get_backend().merge_doses(cursor, [(self.vaccine_name, shard, doses) for shard, doses in Vaccine.spread(num)])
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DBError:
+            # print("Error occurred when updating vaccine availability")
+            raise
+        finally:
+            cm.close_connection()
+        VaccineCache.invalidate(self.vaccine_name)
+        self.available_doses += num
+
+    # Decrement the available doses
+    def decrease_available_doses(self, num):
+        if num <= 0:
+            raise ValueError("Argument cannot be negative!")
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        # takes the doses shard by shard; the WHERE clause keeps every shard from going negative under
+        # concurrent decrements, and the whole decrement is rolled back if a shard ran short meanwhile
+        update_vaccine_availability = "UPDATE VaccineDoses SET Doses = Doses - %d WHERE Name = %s AND Shard = %d AND Doses >= %d"
+        try:
+            cursor.execute("SELECT Shard, Doses FROM VaccineDoses WHERE Name = %s AND Doses > 0", self.vaccine_name)
+            shards = [(column(row, "Shard", 0), column(row, "Doses", 1)) for row in cursor.fetchall()]
+            remaining = num
+            for shard, doses in shards:
+                if remaining == 0:
+                    break
+                take = min(doses, remaining)
+                cursor.execute(update_vaccine_availability, (take, self.vaccine_name, shard, take))
+                if cursor.rowcount == 0:
+                    break
+                remaining -= take
+            if remaining > 0:
+                conn.rollback()
+                raise ValueError("Not enough available doses!")
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DBError:
+            # print("Error occurred when updating vaccine availability")
+            raise
+        finally:
+            cm.close_connection()
+        VaccineCache.invalidate(self.vaccine_name)
+        self.available_doses -= num
+
+    # Add a whole shipment, a list of (vaccine name, doses), in one transaction
+    # returns a list of (vaccine name, doses added, doses after the update, True if the vaccine is new)
+    def add_doses(shipment):
+        totals = {}
+        for vaccine_name, doses in shipment:
+            if doses <= 0:
+                raise ValueError("Argument cannot be negative!")
+            totals[vaccine_name] = totals.get(vaccine_name, 0) + doses
+        vaccine_names = list(totals)
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        results = []
+        try:
+            per_chunk = max(1, Vaccine.merge_chunk_size // Vaccine.shards)
+            for start in range(0, len(vaccine_names), per_chunk):
+                chunk = [(vaccine_name, shard, doses) for vaccine_name in vaccine_names[start:start + per_chunk]
+                         for shard, doses in Vaccine.spread(totals[vaccine_name])]
+                for vaccine_name, doses, created in cm.get_backend().merge_doses(cursor, chunk):
+                    results.append((vaccine_name, totals[vaccine_name], doses, created))
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DBError:
+            # print("Error occurred when adding doses")
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+        VaccineCache.invalidate(*totals)
+        return results
+
+    def __str__(self):
+        return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
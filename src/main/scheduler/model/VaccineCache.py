@@ -0,0 +1,104 @@
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Backend import column
+import os
+import threading
+import time
+
+
+class VaccineCache:
+    '''
+    read-through cache of the doses of every vaccine, summed over its VaccineDoses shards, keyed by vaccine name
+
+    entries expire after ttl seconds; every write to VaccineDoses calls invalidate() once it commits
+    so this process never serves doses older than its own last write
+    '''
+    ttl = float(os.getenv("VaccineCacheTTL", "5"))
+    lock = threading.Lock()
+    # name -> (doses, time loaded)
+    entries = {}
+    # time the whole table was last loaded, None if the listing is stale
+    listing_loaded = None
+    # bumped by invalidate() so a load that raced with a write doesn't store what it read
+    generation = 0
+    counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def fresh(loaded):
+        return loaded is not None and time.monotonic() - loaded < VaccineCache.ttl
+
+    # doses of one vaccine, or None if there is no such vaccine
+    def get(vaccine_name):
+        with VaccineCache.lock:
+            entry = VaccineCache.entries.get(vaccine_name)
+            if entry is not None and VaccineCache.fresh(entry[1]):
+                VaccineCache.counters["hits"] += 1
+                return entry[0]
+            if entry is None and VaccineCache.fresh(VaccineCache.listing_loaded):
+                # the full listing is current and doesn't have it
+                VaccineCache.counters["hits"] += 1
+                return None
+            VaccineCache.counters["misses"] += 1
+            generation = VaccineCache.generation
+
+        loaded = time.monotonic()
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT COALESCE(SUM(d.Doses), 0) AS Doses FROM Vaccines v LEFT JOIN VaccineDoses d ON d.Name = v.Name "
+                           "WHERE v.Name = %s GROUP BY v.Name", vaccine_name)
+            row = cursor.fetchone()
+        finally:
+            cm.close_connection()
+        doses = None if row is None else column(row, "Doses")
+        with VaccineCache.lock:
+            if doses is not None and generation == VaccineCache.generation:
+                VaccineCache.entries[vaccine_name] = (doses, loaded)
+        return doses
+
+    # every (name, doses) pair
+    def all():
+        with VaccineCache.lock:
+            if VaccineCache.fresh(VaccineCache.listing_loaded):
+                VaccineCache.counters["hits"] += 1
+                return [(name, doses) for name, (doses, _) in VaccineCache.entries.items()]
+            VaccineCache.counters["misses"] += 1
+            generation = VaccineCache.generation
+
+        loaded = time.monotonic()
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT v.Name, COALESCE(SUM(d.Doses), 0) AS Doses FROM Vaccines v "
+                           "LEFT JOIN VaccineDoses d ON d.Name = v.Name GROUP BY v.Name")
+            vaccines = [(column(row, "Name", 0), column(row, "Doses", 1)) for row in cursor.fetchall()]
+        finally:
+            cm.close_connection()
+        with VaccineCache.lock:
+            if generation == VaccineCache.generation:
+                VaccineCache.entries = {name: (doses, loaded) for name, doses in vaccines}
+                VaccineCache.listing_loaded = loaded
+        return vaccines
+
+    # drops the given vaccines, or everything, so the next read goes to the database
+    def invalidate(*vaccine_names):
+        with VaccineCache.lock:
+            VaccineCache.counters["invalidations"] += 1
+            VaccineCache.generation += 1
+            if not vaccine_names:
+                VaccineCache.entries = {}
+            for vaccine_name in vaccine_names:
+                VaccineCache.entries.pop(vaccine_name, None)
+            VaccineCache.listing_loaded = None
+
+    def stats():
+        with VaccineCache.lock:
+            stats = dict(VaccineCache.counters)
+            stats["entries"] = len(VaccineCache.entries)
+            return stats
+
+
+# a batch run that rolls a command back may have told the cache about its writes already
+ConnectionManager.on_rollback(VaccineCache.invalidate)
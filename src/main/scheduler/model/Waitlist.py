@@ -0,0 +1,125 @@
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DBError, IntegrityError, column
+from model.AvailabilityIndex import AvailabilityIndex
+from model.VaccineCache import VaccineCache
+import os
+
+
+class Waitlist:
+    '''
+    a patient waiting for a dose of vaccine on any date from start to end
+
+    match() books waiting patients first come, first served whenever a command adds caregivers or doses,
+    so the patients find their appointment in show_appointments instead of polling the schedule
+    '''
+    # waiting patients match() tries per run
+    batch_size = int(os.getenv("WaitlistBatchSize", "100"))
+
+    def __init__(self, patient_name, vaccine_name, start, end, entry_id=None):
+        self.patient_name = patient_name
+        self.vaccine_name = vaccine_name
+        self.start = start
+        self.end = end
+        self.entry_id = entry_id
+
+    # adds the entry at the end of the waitlist; returns False if the patient already waits for the vaccine
+    # (UX_Waitlist_PatientVaccine rejects the second entry, even one saved at the same time by another session)
+    def save(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        try:
+            self.entry_id = cm.get_backend().next_id(cursor, "Waitlist", "ID")
+            cursor.execute("INSERT INTO Waitlist (ID, PatientName, VaccineName, StartDate, EndDate) VALUES (%s, %s, %s, %s, %s)",
+                           (self.entry_id, self.patient_name, self.vaccine_name, self.start, self.end))
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+            return True
+        except IntegrityError:
+            conn.rollback()
+            self.entry_id = None
+            return False
+        except DBError:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+
+    # the entries of a patient, oldest first
+    def of_patient(patient_name):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("SELECT ID, VaccineName, StartDate, EndDate FROM Waitlist WHERE PatientName = %s ORDER BY ID",
+                           patient_name)
+            return [Waitlist(patient_name, column(row, "VaccineName", 1), column(row, "StartDate", 2),
+                             column(row, "EndDate", 3), column(row, "ID", 0)) for row in cursor.fetchall()]
+        finally:
+            cm.close_connection()
+
+    # books the oldest entries for vaccine_names (None for every vaccine) that have a dose and a caregiver
+    # in their dates, up to batch_size, in one transaction; every booked entry leaves the waitlist
+    # returns a list of (entry, appointment id, caregiver name, date)
+    def match(vaccine_names=None):
+        if vaccine_names is not None and not vaccine_names:
+            return []
+        vaccine_names = list(vaccine_names) if vaccine_names is not None else None
+
+        cm = ConnectionManager()
+        backend = cm.get_backend()
+        conn = cm.create_connection()
+        cursor = conn.cursor(as_dict=True)
+
+        # only entries some capacity could serve, so old entries nobody can serve don't hold up the rest
+        select_waiting = f"SELECT TOP {int(Waitlist.batch_size)} w.ID, w.PatientName, w.VaccineName, w.StartDate, w.EndDate " \
+                         "FROM Waitlist w WHERE EXISTS (SELECT 1 FROM VaccineDoses d WHERE d.Name = w.VaccineName AND d.Doses > 0) " \
+                         "AND EXISTS (SELECT 1 FROM Availabilities a WHERE a.Time >= w.StartDate AND a.Time <= w.EndDate)"
+        params = ()
+        if vaccine_names is not None:
+            select_waiting += " AND w.VaccineName IN (" + ", ".join(["%s"] * len(vaccine_names)) + ")"
+            params = tuple(vaccine_names)
+        select_waiting += " ORDER BY w.ID"
+
+        matches = []
+        try:
+            cursor.execute(select_waiting, params)
+            waiting = [Waitlist(column(row, "PatientName", 1), column(row, "VaccineName", 2), column(row, "StartDate", 3),
+                                column(row, "EndDate", 4), column(row, "ID", 0)) for row in cursor.fetchall()]
+            out_of_doses = set()
+            for entry in waiting:
+                if entry.vaccine_name in out_of_doses:
+                    continue
+                # a failed reservation may have taken a dose already, so each one can be undone on its own
+                backend.savepoint(cursor, "waitlist_entry")
+                try:
+                    status, appointment_id, caregiver_name, date = backend.reserve_earliest(
+                        cursor, entry.patient_name, entry.vaccine_name, entry.start, entry.end)
+                    if status == "ok":
+                        cursor.execute("DELETE FROM Waitlist WHERE ID = %s", entry.entry_id)
+                        backend.release_savepoint(cursor, "waitlist_entry")
+                        matches.append((entry, appointment_id, caregiver_name, date))
+                        continue
+                except DBError:
+                    # keep what was booked so far; the entry waits for the next run
+                    backend.rollback_to_savepoint(cursor, "waitlist_entry")
+                    backend.release_savepoint(cursor, "waitlist_entry")
+                    break
+                backend.rollback_to_savepoint(cursor, "waitlist_entry")
+                backend.release_savepoint(cursor, "waitlist_entry")
+                if status == "no_doses":
+                    out_of_doses.add(entry.vaccine_name)
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        finally:
+            cm.close_connection()
+
+        if matches:
+            VaccineCache.invalidate(*{entry.vaccine_name for entry, _, _, _ in matches})
+            for _, _, caregiver_name, date in matches:
+                AvailabilityIndex.remove(date, caregiver_name)
+        return matches
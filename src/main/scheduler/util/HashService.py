@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from util.Util import Util
+
+
+def _hash(item):
+    password, salt = item
+    return Util.generate_hash(password, salt)
+
+
+class HashService:
+    '''
+    runs Util.generate_hash on a pool of worker processes, one per core by default
+
+    PBKDF2 holds the GIL, so threads don't help; batches are split across processes instead.
+    batches smaller than inline_below are hashed on the calling thread to skip the IPC.
+    the workers are spawned, not forked: the server starts the pool from a handler thread, and a fork
+    there would copy locks held by the other threads into the child
+    '''
+    default = None
+    default_lock = threading.Lock()
+
+    def __init__(self, workers=None, inline_below=2):
+        self.workers = workers if workers is not None else int(os.getenv("HashWorkers", str(os.cpu_count() or 1)))
+        self.inline_below = inline_below
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get():
+        # the process-wide service
+        if HashService.default is None:
+            with HashService.default_lock:
+                if HashService.default is None:
+                    HashService.default = HashService()
+        return HashService.default
+
+    def get_executor(self):
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                        mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    # hashes many (password, salt) pairs, results in input order
+    def generate_hashes(self, items):
+        items = list(items)
+        if len(items) < self.inline_below or self.workers <= 1:
+            return [_hash(item) for item in items]
+        # a few chunks per worker keeps the processes busy without one message per password
+        chunksize = max(1, len(items) // (self.workers * 4))
+        return list(self.get_executor().map(_hash, items, chunksize=chunksize))
+
+    # (username, password) pairs in, (username, salt, hash) out, for bulk account creation
+    def create_credentials(self, pairs):
+        pairs = list(pairs)
+        salts = [Util.generate_salt() for _ in pairs]
+        hashes = self.generate_hashes((password, salt) for (_, password), salt in zip(pairs, salts))
+        return [(username, salt, hash) for (username, _), salt, hash in zip(pairs, salts, hashes)]
+
+    # hashes one password; it stays on the calling thread unless inline_below is 1, as in the server
+    def hash(self, password, salt):
+        return self.generate_hashes([(password, salt)])[0]
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
@@ -0,0 +1,94 @@
+import math
+import threading
+
+
+class LatencyHistogram:
+    '''
+    fixed log-scale buckets, each about 9% wider than the previous one, from 1 microsecond up;
+    percentiles are reported as the upper edge of their bucket, so they are within 9% of the truth
+    '''
+    base = 1e-6
+    growth = 2 ** 0.125
+    buckets = 300
+
+    def __init__(self):
+        self.counts = [0] * LatencyHistogram.buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= LatencyHistogram.base:
+            bucket = 0
+        else:
+            bucket = min(LatencyHistogram.buckets - 1,
+                         int(math.ceil(math.log(seconds / LatencyHistogram.base, LatencyHistogram.growth))))
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        rank = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.max, LatencyHistogram.base * LatencyHistogram.growth ** bucket)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # adds the samples of another histogram, e.g. one filled by another process
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+
+class CommandMetrics:
+    # wall-clock latency and success/failure counts per command name, thread-safe
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}
+
+    def record(self, name, seconds, ok):
+        with self.lock:
+            command = self.commands.get(name)
+            if command is None:
+                command = self.commands[name] = {"ok": 0, "failed": 0, "latency": LatencyHistogram()}
+            command["ok" if ok else "failed"] += 1
+            command["latency"].record(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = {}
+            for name, command in self.commands.items():
+                latency = command["latency"]
+                snapshot[name] = {
+                    "count": latency.count,
+                    "ok": command["ok"],
+                    "failed": command["failed"],
+                    "mean": latency.mean(),
+                    "p50": latency.percentile(50),
+                    "p95": latency.percentile(95),
+                    "p99": latency.percentile(99),
+                    "max": latency.max,
+                }
+            return snapshot
+
+    def report(self):
+        lines = [f"{'command':<26}{'count':>8}{'ok':>8}{'failed':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for name, stats in sorted(self.snapshot().items()):
+            lines.append(f"{name:<26}{stats['count']:>8}{stats['ok']:>8}{stats['failed']:>8}"
+                         f"{stats['p50'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}"
+                         f"{stats['p99'] * 1000:>10.2f}{stats['max'] * 1000:>10.2f}")
+        return lines
+
+    def reset(self):
+        with self.lock:
+            self.commands = {}
@@ -1,3 +1,4 @@
+import datetime
 import hashlib
 import os
 
@@ -15,3 +16,34 @@ class Util:
             dklen=16
         )
         return key
+
+    def parse_date(date):
+        # dates are entered hyphenated in the format mm-dd-yyyy
+        month, day, year = date.split("-")
+        return datetime.date(int(year), int(month), int(day))
+
+    def parse_dates(dates):
+        # comma separated list form: mm-dd-yyyy,mm-dd-yyyy,...
+        return [Util.parse_date(date) for date in dates.split(",") if date]
+
+    def parse_weekdays(weekdays):
+        # comma separated day names, e.g. mon,wed,fri; returns datetime weekday numbers
+        names = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+        days = set()
+        for name in weekdays.split(","):
+            if name[:3] not in names:
+                raise ValueError(f"Unknown weekday {name}")
+            days.add(names.index(name[:3]))
+        return days
+
+    def date_range(start, end, weekdays=None):
+        # every date from start to end inclusive, optionally only on the given weekday numbers
+        if end < start:
+            raise ValueError("End date is before start date")
+        dates = []
+        d = start
+        while d <= end:
+            if weekdays is None or d.weekday() in weekdays:
+                dates.append(d)
+            d += datetime.timedelta(days=1)
+        return dates
@@ -0,0 +1,35 @@
+import os
+import sys
+# the scheduler modules import each other from src/main/scheduler, as when run from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "main", "scheduler"))
+
+import pytest
+from db.Backend import SQLiteBackend
+from db.ConnectionManager import ConnectionManager
+from model.AvailabilityIndex import AvailabilityIndex
+from model.VaccineCache import VaccineCache
+import Scheduler
+
+
+@pytest.fixture
+def backend(tmp_path):
+    # a fresh database for the process, with empty caches; a file, so other connections
+    # only see what was committed, like on the server
+    backend = SQLiteBackend(str(tmp_path / "scheduler.db"))
+    ConnectionManager.configure(backend)
+    VaccineCache.invalidate()
+    AvailabilityIndex.invalidate()
+    yield backend
+    ConnectionManager.configure(None)
+    VaccineCache.invalidate()
+    AvailabilityIndex.invalidate()
+    backend.close()
+
+
+@pytest.fixture
+def run(backend):
+    # runs scheduler commands like a batch file, as a client nobody is logged in on yet;
+    # returns the (line, command, error) of those that failed
+    token = Scheduler.current_client.set(Scheduler.ClientSession())
+    yield lambda *lines: Scheduler.run_batch(lines)
+    Scheduler.current_client.reset(token)
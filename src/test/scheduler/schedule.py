@@ -0,0 +1,45 @@
+from db.Backend import UTILIZATION_DAYS
+from model.Utilization import Utilization
+
+# the schedule seed() creates: caregivers c0.. available on 11-01-2026 and the days after, and one vaccine
+CAREGIVERS = 4
+DAYS = 5
+DOSES = 30
+
+
+def seed(run):
+    lines = []
+    for i in range(CAREGIVERS):
+        lines += [f"create_caregiver c{i} pw", f"login_caregiver c{i} pw"]
+        lines += [f"upload_availability 11-{day:02d}-2026" for day in range(1, DAYS + 1)]
+        lines += ["logout"]
+    lines[-1:-1] = [f"add_doses pfizer {DOSES}"]
+    assert run(*lines) == []
+
+
+def count(backend, query, params=()):
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+# every seeded dose and each of the slots caregiver days not taken off is either still free or in exactly
+# one reservation, and the counters agree with the base tables; returns the number of reservations
+def check_invariants(backend, slots=CAREGIVERS * DAYS):
+    assert count(backend, "SELECT COUNT(*) FROM (SELECT Time, CaregiverName FROM Reservations "
+                          "GROUP BY Time, CaregiverName HAVING COUNT(*) > 1)") == 0
+    assert count(backend, "SELECT COUNT(*) FROM Reservations r JOIN Availabilities a "
+                          "ON a.Time = r.Time AND a.Username = r.CaregiverName") == 0
+    assert count(backend, "SELECT COUNT(*) FROM VaccineDoses WHERE Doses < 0") == 0
+    reservations = count(backend, "SELECT COUNT(*) FROM Reservations")
+    assert count(backend, "SELECT COALESCE(SUM(Doses), 0) FROM VaccineDoses") + reservations == DOSES
+    assert count(backend, "SELECT COUNT(*) FROM Availabilities") + reservations == slots
+    assert count(backend, "SELECT COALESCE(SUM(Booked), 0) FROM CaregiverBookings") == reservations
+    assert count(backend, f"SELECT COUNT(*) FROM ({UTILIZATION_DAYS}) e LEFT JOIN DailyUtilization d ON d.Time = e.Time "
+                          "WHERE d.Time IS NULL OR d.OpenSlots <> e.OpenSlots OR d.Booked <> e.Booked") == 0
+    assert Utilization.verify() == []
+    return reservations
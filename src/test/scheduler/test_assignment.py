@@ -0,0 +1,70 @@
+import pytest
+import datetime
+from db.Assignment import AssignmentStrategy, LeastBooked, RoundRobin
+from model.AvailabilityIndex import AvailabilityIndex
+
+NOV_2 = datetime.date(2026, 11, 2)
+NOV_3 = datetime.date(2026, 11, 3)
+
+
+@pytest.fixture
+def least_booked(monkeypatch):
+    monkeypatch.setattr(AssignmentStrategy, "default", LeastBooked())
+
+
+def test_least_booked_follows_the_booking_counters(run, least_booked, capsys):
+    assert run("create_caregiver ca pw", "create_caregiver cb pw", "create_caregiver cc pw",
+               "create_patient p1 pw", "create_patient p2 pw", "create_patient p3 pw", "create_patient p4 pw",
+               "login_caregiver ca pw", "add_doses pfizer 10", "upload_availability 11-02-2026",
+               "upload_availability 11-03-2026", "upload_availability 11-05-2026", "logout",
+               "login_caregiver cb pw", "upload_availability 11-04-2026", "upload_availability 11-05-2026", "logout",
+               "login_caregiver cc pw", "upload_availability 11-05-2026", "logout",
+               "login_patient p1 pw", "reserve 11-02-2026 pfizer", "logout",
+               "login_patient p2 pw", "reserve 11-03-2026 pfizer", "logout",
+               "login_patient p3 pw", "reserve 11-04-2026 pfizer", "logout") == []
+    capsys.readouterr()
+    # ca has two appointments, cb one and cc none; the fewest go first, the username breaks ties
+    assert run("login_patient p4 pw", "reserve 11-05-2026 pfizer", "logout") == []
+    assert "Caregiver username cc" in capsys.readouterr().out
+    assert run("login_caregiver cc pw", "upload_availability 11-06-2026", "logout",
+               "login_caregiver cb pw", "upload_availability 11-06-2026", "logout",
+               "login_patient p4 pw", "reserve 11-06-2026 pfizer") == []
+    assert "Caregiver username cb" in capsys.readouterr().out
+
+
+def test_booked_date_cannot_be_uploaded_again(run, capsys):
+    assert run("create_caregiver ca pw", "create_patient p1 pw",
+               "login_caregiver ca pw", "add_doses pfizer 10", "upload_availability 11-02-2026", "logout",
+               "login_patient p1 pw", "reserve 11-02-2026 pfizer", "logout") == []
+    capsys.readouterr()
+    assert run("login_caregiver ca pw", "upload_availability 11-02-2026,11-03-2026") == []
+    assert "Skipped 1 date(s) that were already uploaded or booked" in capsys.readouterr().out
+    assert AvailabilityIndex.get(NOV_2) == [] and AvailabilityIndex.get(NOV_3) == ["ca"]
+
+
+def set_next_id(backend, value):
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM IdBlocks WHERE Name = 'Reservations'")
+        cursor.execute("INSERT INTO IdBlocks (Name, NextValue) VALUES ('Reservations', %d)", value)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_round_robin_follows_booking_time_not_id_order(backend, run, monkeypatch, capsys):
+    monkeypatch.setattr(AssignmentStrategy, "default", RoundRobin())
+    assert run("create_caregiver ca pw", "create_caregiver cb pw",
+               "create_patient p1 pw", "create_patient p2 pw", "create_patient p3 pw",
+               "login_caregiver ca pw", "add_doses pfizer 10", "upload_availability 11-02-2026",
+               "upload_availability 11-04-2026", "logout",
+               "login_caregiver cb pw", "upload_availability 11-03-2026", "upload_availability 11-04-2026", "logout") == []
+    # cb is booked after ca with a smaller ID, as when another process hands out IDs from an older block
+    set_next_id(backend, 1000)
+    assert run("login_patient p1 pw", "reserve 11-02-2026 pfizer", "logout") == []
+    set_next_id(backend, 2)
+    assert run("login_patient p2 pw", "reserve 11-03-2026 pfizer", "logout") == []
+    capsys.readouterr()
+    assert run("login_patient p3 pw", "reserve 11-04-2026 pfizer") == []
+    assert "Caregiver username ca" in capsys.readouterr().out
@@ -0,0 +1,49 @@
+import datetime
+from model.AvailabilityIndex import AvailabilityIndex
+
+NOV_2 = datetime.date(2026, 11, 2)
+NOV_3 = datetime.date(2026, 11, 3)
+
+
+def test_write_during_load_is_not_lost(run, monkeypatch):
+    assert run("create_caregiver c1 pw", "login_caregiver c1 pw", "upload_availability 11-02-2026") == []
+    AvailabilityIndex.invalidate()
+    scan = AvailabilityIndex.scan
+    scans = []
+
+    def scan_racing_with_upload():
+        calendar = scan()
+        scans.append(calendar)
+        if len(scans) == 1:
+            # lands after the scan read the table, before the scan is installed
+            assert run("upload_availability 11-03-2026") == []
+        return calendar
+    monkeypatch.setattr(AvailabilityIndex, "scan", scan_racing_with_upload)
+
+    assert AvailabilityIndex.get(NOV_3) == ["c1"]
+    assert len(scans) == 2
+    assert AvailabilityIndex.between(NOV_2, NOV_3) == [(NOV_2, ["c1"]), (NOV_3, ["c1"])]
+    assert len(scans) == 2
+
+
+def test_answers_from_scan_when_writes_keep_racing(run, monkeypatch):
+    assert run("create_caregiver c1 pw", "login_caregiver c1 pw", "upload_availability 11-02-2026") == []
+    AvailabilityIndex.invalidate()
+    scan = AvailabilityIndex.scan
+
+    def scan_racing_with_write():
+        calendar = scan()
+        AvailabilityIndex.add([NOV_3], "c2")
+        return calendar
+    monkeypatch.setattr(AvailabilityIndex, "scan", scan_racing_with_write)
+
+    assert AvailabilityIndex.between(NOV_2, NOV_3) == [(NOV_2, ["c1"])]
+    assert AvailabilityIndex.loaded is None
+
+
+def test_range_search_prints_dates_as_entered(run, capsys):
+    assert run("create_caregiver c1 pw", "login_caregiver c1 pw", "upload_availability 11-02-2026",
+               "upload_availability 11-03-2026") == []
+    capsys.readouterr()
+    assert run("search_caregiver_schedule 11-02-2026 11-03-2026") == []
+    assert capsys.readouterr().out.splitlines()[:2] == ["11-02-2026 c1", "11-03-2026 c1"]
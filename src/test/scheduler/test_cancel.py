@@ -0,0 +1,39 @@
+import datetime
+from model.Reservation import Reservation
+from model.VaccineCache import VaccineCache
+from schedule import CAREGIVERS, DAYS, DOSES, check_invariants, seed
+
+NOV_2 = datetime.date(2026, 11, 2)
+
+
+def book(run, patients):
+    lines = []
+    for i in range(patients):
+        lines += [f"create_patient p{i} pw", f"login_patient p{i} pw", f"reserve 11-0{1 + i % 2}-2026 pfizer", "logout"]
+    assert run(*lines) == []
+
+
+def test_cancel_gives_back_dose_and_slot(backend, run):
+    seed(run)
+    book(run, 8)
+    assert run("login_patient p0 pw", "cancel 1", "logout") == []
+    assert check_invariants(backend) == 7
+    assert VaccineCache.get("pfizer") == DOSES - 7
+
+
+def test_cancel_is_all_or_nothing(backend, run):
+    seed(run)
+    book(run, 2)
+    # p0 can't cancel the appointment of p1, so neither is canceled
+    failed = run("login_patient p0 pw", "cancel 1 2", "logout")
+    assert [command for _, command, _ in failed] == ["cancel 1 2"]
+    assert check_invariants(backend) == 2
+
+
+def test_cancel_day_keeps_the_slots_taken_off(backend, run):
+    seed(run)
+    book(run, 8)
+    c0_on_nov_2 = len([r for r in Reservation.between(NOV_2, NOV_2) if r.caregiver_name == "c0"])
+    assert run("login_caregiver c0 pw", "cancel_day 11-02-2026", "logout") == []
+    # the canceled appointments' doses go back, c0's slot on 11-02 doesn't
+    assert check_invariants(backend, CAREGIVERS * DAYS - 1) == 8 - c0_on_nov_2
@@ -0,0 +1,106 @@
+import threading
+import time
+import pytest
+from db.Backend import SQLiteBackend
+from db.ConnectionManager import ConnectionManager
+from db.ConnectionPool import ConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        pass
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect():
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+    return ConnectionPool(connect, **kwargs), opened
+
+
+def test_borrow_times_out_when_exhausted():
+    pool, _ = make_pool(min_size=0, max_size=1)
+    conn = pool.borrow()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeoutError):
+        pool.borrow(timeout=0.1)
+    assert time.monotonic() - started >= 0.1
+    assert pool.stats()["timeouts"] == 1
+    pool.release(conn)
+    assert pool.borrow(timeout=0.1) is conn
+
+
+def test_waiter_gets_released_connection():
+    pool, _ = make_pool(min_size=0, max_size=1)
+    conn = pool.borrow()
+    borrowed = []
+    waiter = threading.Thread(target=lambda: borrowed.append(pool.borrow(timeout=5)))
+    waiter.start()
+    time.sleep(0.05)
+    pool.release(conn)
+    waiter.join(5)
+    assert borrowed == [conn]
+    assert pool.stats()["waits"] == 1
+
+
+def test_idle_connections_beyond_min_size_are_evicted():
+    pool, opened = make_pool(min_size=1, max_size=3, idle_timeout=0.05)
+    conns = [pool.borrow() for _ in range(3)]
+    for conn in conns:
+        pool.release(conn)
+    assert pool.stats()["idle"] == 3
+    time.sleep(0.1)
+    pool.evict_idle()
+    stats = pool.stats()
+    assert stats["idle"] == 1 and stats["size"] == 1 and stats["evictions"] == 2
+    assert sum(conn.closed for conn in opened) == 2
+
+
+def test_failed_ping_counts_one_borrow():
+    pings = []
+
+    def ping(conn):
+        pings.append(conn)
+        if len(pings) == 1:
+            raise RuntimeError("connection reset")
+    pool, opened = make_pool(min_size=0, max_size=2, ping_interval=0, ping=ping)
+    first, second = pool.borrow(), pool.borrow()
+    pool.release(first)
+    pool.release(second)
+    conn = pool.borrow()
+    stats = pool.stats()
+    assert stats["borrows"] == 3 and stats["failed_pings"] == 1 and stats["discards"] == 1
+    assert conn is first and opened[1].closed
+
+
+def test_fill_opens_min_size():
+    pool, opened = make_pool(min_size=2, max_size=4)
+    pool.fill()
+    assert len(opened) == 2 and pool.stats()["idle"] == 2
+    pool.borrow()
+    assert len(opened) == 2
+
+
+def test_manager_fills_pool_and_releases_to_its_own_pool(monkeypatch):
+    monkeypatch.setenv("PoolMinSize", "2")
+    ConnectionManager.configure(SQLiteBackend())
+    try:
+        cm = ConnectionManager()
+        cm.create_connection()
+        old_pool = ConnectionManager.pool
+        assert old_pool.stats()["creations"] == 2
+        # another backend replaces the pool while the connection is out
+        ConnectionManager.configure(SQLiteBackend())
+        cm.close_connection()
+        assert old_pool.stats()["size"] == 0
+    finally:
+        ConnectionManager.configure(None)
@@ -0,0 +1,25 @@
+from model.VaccineCache import VaccineCache
+
+
+def write(tmp_path, text):
+    path = tmp_path / "doses.csv"
+    path.write_text(text)
+    return str(path)
+
+
+def login(run):
+    assert run("create_caregiver c1 pw", "login_caregiver c1 pw") == []
+
+
+def test_header_row_is_skipped(run, tmp_path):
+    login(run)
+    assert run("import_doses " + write(tmp_path, "Vaccine,Doses\npfizer,5\nmoderna,3\n")) == []
+    assert VaccineCache.get("pfizer") == 5 and VaccineCache.get("moderna") == 3
+
+
+def test_invalid_first_row_is_an_error(run, tmp_path, capsys):
+    login(run)
+    failed = run("import_doses " + write(tmp_path, "pfizer,five\nmoderna,3\n"))
+    assert len(failed) == 1
+    assert "line 1: invalid number of doses five" in capsys.readouterr().out
+    assert VaccineCache.get("moderna") is None
@@ -0,0 +1,40 @@
+import threading
+import Scheduler
+from model.VaccineCache import VaccineCache
+from schedule import CAREGIVERS, DAYS, DOSES, check_invariants, seed
+
+
+def test_reserve_keeps_invariants(backend, run):
+    seed(run)
+    lines = []
+    for i in range(8):
+        lines += [f"create_patient p{i} pw", f"login_patient p{i} pw", f"reserve 11-0{1 + i % 2}-2026 pfizer", "logout"]
+    assert run(*lines) == []
+    assert check_invariants(backend) == 8
+    assert VaccineCache.get("pfizer") == DOSES - 8
+    # the fifth reservation of a day finds every caregiver taken
+    failed = run("create_patient p8 pw", "login_patient p8 pw", "reserve 11-01-2026 pfizer", "logout")
+    assert [command for _, command, _ in failed] == ["reserve 11-01-2026 pfizer"]
+    assert check_invariants(backend) == 8
+
+
+def test_concurrent_reservations_keep_invariants(backend, run):
+    seed(run)
+    assert run(*[f"create_patient p{i} pw" for i in range(24)]) == []
+    booked = []
+
+    def patient(i):
+        client = Scheduler.ClientSession()
+        Scheduler.run_command(["login_patient", f"p{i}", "pw"], client)
+        for day in range(1, DAYS + 1):
+            if Scheduler.run_command(["reserve", f"11-0{day}-2026", "pfizer"], client):
+                booked.append(i)
+                return
+    threads = [threading.Thread(target=patient, args=(i,)) for i in range(24)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    # 20 caregiver days for 24 patients
+    assert len(booked) == CAREGIVERS * DAYS
+    assert check_invariants(backend) == CAREGIVERS * DAYS
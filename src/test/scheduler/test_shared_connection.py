@@ -0,0 +1,51 @@
+from db.ConnectionManager import ConnectionManager
+from model.Vaccine import Vaccine
+from model.VaccineCache import VaccineCache
+
+
+def committed_doses(backend, vaccine_name):
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT SUM(Doses) FROM VaccineDoses WHERE Name = %s", vaccine_name)
+        return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_released_commands_are_committed_by_flush_only(backend):
+    with ConnectionManager.share() as shared:
+        shared.begin_command()
+        Vaccine("pfizer", 5).save_to_db()
+        shared.end_command()
+        # releasing the savepoint must not commit the batch transaction
+        assert committed_doses(backend, "pfizer") is None
+        shared.begin_command()
+        Vaccine("pfizer", 0).get().increase_available_doses(3)
+        shared.end_command()
+        shared.flush()
+    assert committed_doses(backend, "pfizer") == 8
+
+
+def test_rolled_back_command_is_dropped_from_caches(backend):
+    with ConnectionManager.share() as shared:
+        shared.begin_command()
+        Vaccine("pfizer", 5).save_to_db()
+        shared.end_command()
+        shared.begin_command()
+        Vaccine("pfizer", 0).get().increase_available_doses(3)
+        assert VaccineCache.get("pfizer") == 8
+        shared.rollback()
+        assert VaccineCache.get("pfizer") == 5
+        shared.flush()
+    assert committed_doses(backend, "pfizer") == 5
+
+
+def test_unflushed_batch_is_dropped_from_caches(backend):
+    with ConnectionManager.share() as shared:
+        shared.begin_command()
+        Vaccine("pfizer", 5).save_to_db()
+        shared.end_command()
+        assert VaccineCache.get("pfizer") == 5
+    assert committed_doses(backend, "pfizer") is None
+    assert VaccineCache.get("pfizer") is None
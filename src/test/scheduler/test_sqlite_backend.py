@@ -0,0 +1,39 @@
+import threading
+import time
+from db.Backend import SQLiteBackend, TRANSLATION_CACHE_SIZE, translate
+
+
+def test_translate_rewrites_params_and_top():
+    assert translate("SELECT TOP 3 Name FROM Vaccines WHERE Name = %s AND Doses > %d;") == \
+        "SELECT Name FROM Vaccines WHERE Name = ? AND Doses > ? LIMIT 3"
+
+
+def test_translation_cache_is_bounded():
+    for i in range(TRANSLATION_CACHE_SIZE + 10):
+        translate(f"SELECT {i} FROM Vaccines WHERE Name = %s")
+    assert translate.cache_info().currsize <= TRANSLATION_CACHE_SIZE
+
+
+def test_memory_database_readers_do_not_see_uncommitted_rows():
+    backend = SQLiteBackend()
+    writer, reader = backend.connect(), backend.connect()
+    try:
+        writer.cursor().execute("INSERT INTO Vaccines (Name) VALUES (%s)", "pfizer")
+        found = []
+
+        def read():
+            cursor = reader.cursor()
+            cursor.execute("SELECT Name FROM Vaccines")
+            found.extend(row[0] for row in cursor.fetchall())
+        thread = threading.Thread(target=read)
+        thread.start()
+        # the reader waits for the writer instead of reading its row
+        time.sleep(0.1)
+        assert thread.is_alive()
+        writer.rollback()
+        thread.join(5)
+        assert found == []
+    finally:
+        writer.close()
+        reader.close()
+        backend.close()
@@ -0,0 +1,22 @@
+import datetime
+from model.Utilization import Utilization
+from schedule import CAREGIVERS, DAYS, seed
+
+
+def test_utilization_follows_bookings(backend, run):
+    seed(run)
+    assert run("create_patient p0 pw", "login_patient p0 pw", "reserve 11-01-2026 pfizer", "logout") == []
+    days = {day.date: day for day in Utilization.between(datetime.date(2026, 11, 1), datetime.date(2026, 11, 2))}
+    assert (days[datetime.date(2026, 11, 1)].open_slots, days[datetime.date(2026, 11, 1)].booked) == (CAREGIVERS - 1, 1)
+    assert days[datetime.date(2026, 11, 1)].vaccines == {"pfizer": 1}
+    assert (days[datetime.date(2026, 11, 2)].open_slots, days[datetime.date(2026, 11, 2)].booked) == (CAREGIVERS, 0)
+    # a summary that drifted is reported, and rebuilt from the base tables
+    conn = backend.connect()
+    try:
+        conn.cursor().execute("UPDATE DailyUtilization SET Booked = 5 WHERE Time = %s", datetime.date(2026, 11, 1))
+        conn.commit()
+    finally:
+        conn.close()
+    assert Utilization.verify() == [(datetime.date(2026, 11, 1), None, "booked", 1, 5)]
+    assert Utilization.rebuild() == DAYS
+    assert Utilization.verify() == []
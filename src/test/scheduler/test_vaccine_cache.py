@@ -0,0 +1,29 @@
+from db.ConnectionManager import ConnectionManager
+from model.Vaccine import Vaccine
+from model.VaccineCache import VaccineCache
+
+
+def test_reads_through_and_invalidates_on_write(backend):
+    Vaccine("pfizer", 5).save_to_db()
+    assert VaccineCache.get("pfizer") == 5
+    hits = VaccineCache.stats()["hits"]
+    assert VaccineCache.get("pfizer") == 5
+    assert VaccineCache.stats()["hits"] == hits + 1
+    Vaccine("pfizer", 0).get().increase_available_doses(2)
+    assert VaccineCache.get("pfizer") == 7
+    assert VaccineCache.all() == [("pfizer", 7)]
+    assert VaccineCache.get("moderna") is None
+
+
+def test_load_racing_with_a_write_is_not_kept(backend, monkeypatch):
+    Vaccine("pfizer", 5).save_to_db()
+    create_connection = ConnectionManager.create_connection
+
+    def create_connection_racing_with_write(cm):
+        # the write lands after the cache noted the generation, before it reads
+        monkeypatch.setattr(ConnectionManager, "create_connection", create_connection)
+        Vaccine("pfizer", 0).get().increase_available_doses(2)
+        return create_connection(cm)
+    monkeypatch.setattr(ConnectionManager, "create_connection", create_connection_racing_with_write)
+    assert VaccineCache.get("pfizer") == 7
+    assert "pfizer" not in VaccineCache.entries
@@ -0,0 +1,28 @@
+import datetime
+from model.Reservation import Reservation
+from model.VaccineCache import VaccineCache
+from model.Waitlist import Waitlist
+
+
+def test_waitlist_is_booked_when_capacity_appears(backend, run):
+    assert run("create_caregiver c0 pw", "create_patient p0 pw", "create_patient p1 pw",
+               "login_caregiver c0 pw", "add_doses pfizer 5", "logout",
+               "login_patient p0 pw", "waitlist 11-01-2026 11-03-2026 pfizer", "logout",
+               "login_patient p1 pw", "waitlist 11-02-2026 11-02-2026 pfizer", "logout") == []
+    assert [entry.patient_name for entry in Waitlist.of_patient("p0")] == ["p0"]
+    # one slot: the older entry gets it, the other keeps waiting
+    assert run("login_caregiver c0 pw", "upload_availability 11-02-2026", "logout") == []
+    assert Waitlist.of_patient("p0") == [] and len(Waitlist.of_patient("p1")) == 1
+    assert [(r.patient_name, r.caregiver_name) for r in Reservation.between(datetime.date(2026, 11, 1),
+                                                                            datetime.date(2026, 11, 3))] == [("p0", "c0")]
+    assert VaccineCache.get("pfizer") == 4
+
+
+def test_patient_waits_once_per_vaccine(backend, run):
+    assert run("create_patient p0 pw") == []
+    start, end = datetime.date(2026, 11, 1), datetime.date(2026, 11, 3)
+    assert Waitlist("p0", "pfizer", start, end).save()
+    # the second entry is refused by the unique index, not by a lookup that a concurrent save could race
+    assert not Waitlist("p0", "pfizer", start, end).save()
+    assert Waitlist("p0", "moderna", start, end).save()
+    assert [entry.vaccine_name for entry in Waitlist.of_patient("p0")] == ["pfizer", "moderna"]